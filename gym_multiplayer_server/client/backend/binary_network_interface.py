@@ -0,0 +1,153 @@
+import asyncio
+from typing import Optional
+
+import numpy as np
+
+from gym_multiplayer_server.common.binary_protocol import (
+    FRAME_PREFIX,
+    MAX_FRAME_LENGTH,
+    Op,
+    decode_message,
+    encode_message,
+    frame,
+    login_response,
+    pack_json,
+    unpack_json,
+    unpack_json_and_bytes,
+)
+from gym_multiplayer_server.common.wire import pack_array, unpack_array, unpack_step
+from .network_interface import NetworkInterfaceConnectionError, NetworkInterfaceState
+
+
+class BinaryNetworkInterface(asyncio.Protocol):
+    """
+    asyncio counterpart of NetworkInterface speaking the length-prefixed binary
+    protocol. It issues the same operations and calls the same client callbacks,
+    but needs neither twisted nor a reactor on the client side.
+    """
+
+    def __init__(
+        self,
+        *,
+        client,
+        server: str = "al-hockey.is.tuebingen.mpg.de",
+        port: str = "33001",
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+
+        self.client = client
+
+        self.server = server
+        self.port = port
+        self.loop = loop
+
+        self.transport = None
+        self.buffer = bytearray()
+
+        self.state = NetworkInterfaceState.DISCONNECTED
+
+    # Functions to establish/close connection to server
+    async def connect(self) -> None:
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        try:
+            await self.loop.create_connection(lambda: self, self.server, int(self.port))
+        except OSError:
+            self.connection_error(conn_err=NetworkInterfaceConnectionError.CONNECTING)
+            return
+
+        self._send(
+            Op.LOGIN,
+            pack_json(
+                {
+                    "username": self.client.username,
+                    "client_version": self.client.__VERSION__,
+                }
+            ),
+        )
+
+    def disconnect(self) -> None:
+        self.state = NetworkInterfaceState.DISCONNECTED
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def connection_error(self, conn_err: NetworkInterfaceConnectionError) -> None:
+        self.state = NetworkInterfaceState.SERVER_ERROR
+        self.client.connection_error(conn_err)
+        self.disconnect()
+
+    # asyncio.Protocol
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc) -> None:
+        self.transport = None
+        if self.state == NetworkInterfaceState.CONNECTED:
+            self.connection_error(conn_err=NetworkInterfaceConnectionError.LOST)
+
+    def data_received(self, data: bytes) -> None:
+        self.buffer += data
+        while len(self.buffer) >= FRAME_PREFIX.size:
+            (length,) = FRAME_PREFIX.unpack_from(self.buffer)
+            if length > MAX_FRAME_LENGTH:
+                self.connection_error(conn_err=NetworkInterfaceConnectionError.LOST)
+                return
+            end = FRAME_PREFIX.size + length
+            if len(self.buffer) < end:
+                return
+            message = bytes(self.buffer[FRAME_PREFIX.size : end])
+            del self.buffer[:end]
+            self.message_received(*decode_message(message))
+
+    def message_received(self, op: int, payload: bytes) -> None:
+        if op == Op.RECEIVE_OBSERVATION:
+            self.client.step(*unpack_step(payload))
+        elif op == Op.GAME_STARTS:
+            info, ob = unpack_json_and_bytes(payload)
+            info["player"] = tuple(info["player"])
+            self.client.game_starts(unpack_array(ob).copy(), info)
+        elif op == Op.GAME_DONE:
+            result, step = unpack_json_and_bytes(payload)
+            ob, r, done, info = unpack_step(step)
+            self.client.game_done(ob, r, done, info, result)
+        elif op == Op.GAME_ABORTED:
+            self.client.game_aborted(payload.decode("utf-8"))
+        elif op == Op.QUEUING:
+            self.client.waiting_for_game_to_start()
+        elif op == Op.STATS:
+            self.client.show_stats(unpack_json(payload))
+        elif op == Op.LOGIN_CHALLENGE:
+            self._send(Op.LOGIN_RESPONSE, login_response(payload, self.client.password))
+        elif op == Op.LOGIN_OK:
+            self.state = NetworkInterfaceState.CONNECTED
+            self.client.post_connection_established()
+        elif op == Op.LOGIN_FAILED:
+            print(payload.decode("utf-8"))
+            self.disconnect()
+        elif op == Op.ERROR:
+            print(f"Server error: {payload.decode('utf-8')}")
+
+    def _send(self, op: int, payload: bytes = b"") -> None:
+        if self.transport is None:
+            self.connection_error(conn_err=NetworkInterfaceConnectionError.LOST)
+            return
+        self.transport.write(frame(encode_message(op, payload)))
+
+    # Functions called by client
+    def request_stats(self) -> None:
+        self._send(Op.REQUEST_STATS)
+
+    def start_queuing(self) -> None:
+        action_repeat = getattr(self.client, "action_repeat", 1)
+        if action_repeat != 1:
+            self._send(Op.START_QUEUING, pack_json({"action_repeat": action_repeat}))
+        else:
+            self._send(Op.START_QUEUING)
+
+    def stop_queueing(self) -> None:
+        self._send(Op.STOP_QUEUEING)
+
+    # Game loop function
+    def send_action(self, ac: np.ndarray) -> None:
+        self._send(Op.RECEIVE_ACTION, pack_array(ac))
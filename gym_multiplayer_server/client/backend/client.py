@@ -59,6 +59,14 @@ def parseOptions():
         default=None,
         help="Number of runs per queuing",
     )
+    parser.add_argument(
+        "--action-repeat",
+        action="store",
+        type=int,
+        dest="action_repeat",
+        default=1,
+        help="Apply every action for this many env steps (capped by the server)",
+    )
     args = parser.parse_args()
     return args
 
@@ -87,6 +95,7 @@ class Client:
         num_games: Optional[int] = None,
         server_addr: str = "al-hockey.is.tuebingen.mpg.de",
         server_port: str = "33000",
+        action_repeat: int = 1,
     ):
 
         self.state = ClientOperationState.IDLE
@@ -98,6 +107,7 @@ class Client:
         self.password = password
         self.controller = controller
         self.output_path = output_path
+        self.action_repeat = action_repeat
 
         try:
             import termios
@@ -231,7 +241,7 @@ escape.
             self.waiting_for_game_loop.stop()
             del self.waiting_for_game_loop
 
-        action = self.controller.remote_act(np.asarray(ob)).tolist()
+        action = self.controller.remote_act(np.asarray(ob))
 
         self.current_game = Game(
             identifier=info["id"],
@@ -251,7 +261,7 @@ escape.
         info: Optional[Dict] = None,
     ) -> None:
 
-        action = self.controller.remote_act(np.asarray(ob)).tolist()
+        action = self.controller.remote_act(np.asarray(ob))
 
         try:
             self.current_game.add_transition(
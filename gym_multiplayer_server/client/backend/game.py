@@ -3,7 +3,9 @@ import os
 from typing import List, Dict
 import time
 
-import numpy as np
+
+from gym_multiplayer_server.common.game_record import save_game_record
+from gym_multiplayer_server.common.transition_buffer import TransitionBuffer
 
 
 class Game:
@@ -24,7 +26,7 @@ class Game:
         self.last_observation = fst_obs
         self.last_action = fst_action
 
-        self.transition_buffer = []
+        self.transition_buffer = TransitionBuffer()
 
     def add_transition(
         self,
@@ -37,7 +39,7 @@ class Game:
     ) -> None:
 
         self.transition_buffer.append(
-            [self.last_observation, self.last_action, next_obs, r, done, info]
+            self.last_observation, self.last_action, next_obs, r, done, info
         )
 
         self.last_observation = next_obs
@@ -50,14 +52,12 @@ class Game:
         path = os.path.join(
             output_path, "games", str(now.year), str(now.month), str(now.day)
         )
-        os.makedirs(path, exist_ok=True)
-        np.savez(
+        save_game_record(
             os.path.join(path, self.identifier),
-            {
-                "identifier": self.identifier,
-                "player_one": self.player_one,
-                "player_two": self.player_two,
-                "transitions": self.transition_buffer,
-                "timestamp": time.time(),
-            },
+            self.transition_buffer.columns(),
+            identifier=self.identifier,
+            player_one=self.player_one,
+            player_two=self.player_two,
+            timestamp=time.time(),
+            episode_infos=self.transition_buffer.infos,
         )
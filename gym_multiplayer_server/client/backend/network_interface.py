@@ -1,10 +1,19 @@
 from typing import Optional, List, Dict
 
+import numpy as np
+
 from twisted.spread import pb
 from twisted.internet import reactor, defer
 from twisted.cred import credentials, error as cred_error
 
 from gym_multiplayer_server.common.error import ServerClientVersionMissmatchError
+from gym_multiplayer_server.common.wire import (
+    SUPPORTED_WIRE_FORMATS,
+    WireFormat,
+    pack_array,
+    unpack_array,
+    unpack_step,
+)
 
 
 class NotConnectedError(Exception):
@@ -30,9 +39,11 @@ class NetworkInterface(pb.Referenceable):
         client,
         server: str = "al-hockey.is.tuebingen.mpg.de",
         port: str = "33000",
+        wire_formats: List[str] = SUPPORTED_WIRE_FORMATS,
     ):
 
         self.client = client
+        self.wire_formats = list(wire_formats)
 
         self.server = server
         self.port = port
@@ -43,11 +54,16 @@ class NetworkInterface(pb.Referenceable):
         self.remote_avatar = None
         self.remote_client = None
         self.server_version = None
+        self.wire_format = WireFormat.LIST
 
         self.state = NetworkInterfaceState.DISCONNECTED
 
     # Functions to establish/close connection to server
     def connect(self) -> None:
+        self.login()
+        reactor.run()
+
+    def login(self) -> defer.Deferred:
         d = self.factory.login(
             credentials.UsernamePassword(
                 self.client.username.encode("utf-8"),
@@ -64,7 +80,8 @@ class NetworkInterface(pb.Referenceable):
         d.addErrback(
             self.connection_error, conn_err=NetworkInterfaceConnectionError.CONNECTING
         )
-        reactor.run()
+
+        return d
 
     def disconnect(self) -> None:
         try:
@@ -87,11 +104,33 @@ class NetworkInterface(pb.Referenceable):
 
     def check_server_client_compatibility(self, *args) -> defer.Deferred:
         d = self.remote_avatar.callRemote(
-            "check_server_client_compatibility", self.client.__VERSION__
+            "check_server_client_compatibility",
+            self.client.__VERSION__,
+            wire_formats=self.wire_formats,
+            mind=self,
         )
+        d.addErrback(self.check_server_client_compatibility_without_wire_formats)
+        d.addCallback(self.set_wire_format)
 
         return d
 
+    def check_server_client_compatibility_without_wire_formats(
+        self, e
+    ) -> defer.Deferred:
+        # Servers without wire format negotiation do not take the keyword
+        # arguments, ask them again the way they expect
+        e.trap(TypeError)
+        return self.remote_avatar.callRemote(
+            "check_server_client_compatibility", self.client.__VERSION__
+        )
+
+    def set_wire_format(self, wire_format) -> None:
+        # Servers without wire format negotiation answer True to the retried
+        # call, they only understand lists
+        if wire_format not in SUPPORTED_WIRE_FORMATS:
+            wire_format = WireFormat.LIST
+        self.wire_format = wire_format
+
     def connected(self, *args):
         self.state = NetworkInterfaceState.CONNECTED
         self.client.post_connection_established()
@@ -116,6 +155,8 @@ class NetworkInterface(pb.Referenceable):
 
     # Remote functions called by server
     def remote_game_starts(self, ob: List[float], info: Dict) -> None:
+        if isinstance(ob, bytes):
+            ob = unpack_array(ob).copy()
 
         self.client.game_starts(ob, info)
 
@@ -124,14 +165,27 @@ class NetworkInterface(pb.Referenceable):
         self.client.game_aborted(msg)
 
     def remote_game_done(
-        self, ob: List[float], r: int, done: int, info: Dict, result: Dict
+        self,
+        ob: List[float],
+        result: Dict,
+        r: Optional[int] = None,
+        done: Optional[int] = None,
+        info: Optional[Dict] = None,
     ) -> None:
+        if isinstance(ob, bytes):
+            ob, r, done, info = unpack_step(ob)
 
         self.client.game_done(ob, r, done, info, result)
 
     def remote_receive_observation(
-        self, ob: List[float], r: int, done: int, info: Dict
+        self,
+        ob: List[float],
+        r: Optional[int] = None,
+        done: Optional[int] = None,
+        info: Optional[Dict] = None,
     ) -> None:
+        if isinstance(ob, bytes):
+            ob, r, done, info = unpack_step(ob)
 
         self.client.step(ob, r, done, info)
 
@@ -149,7 +203,13 @@ class NetworkInterface(pb.Referenceable):
 
     def start_queuing(self) -> None:
         try:
-            d = self.remote_client.callRemote("start_queuing")
+            action_repeat = getattr(self.client, "action_repeat", 1)
+            if action_repeat != 1:
+                d = self.remote_client.callRemote(
+                    "start_queuing", action_repeat=action_repeat
+                )
+            else:
+                d = self.remote_client.callRemote("start_queuing")
             d.addCallback(self.client.waiting_for_game_to_start)
             d.addErrback(
                 self.connection_error, conn_err=NetworkInterfaceConnectionError.LOST
@@ -168,7 +228,11 @@ class NetworkInterface(pb.Referenceable):
             self.connection_error(None, conn_err=NetworkInterfaceConnectionError.LOST)
 
     # Game loop function
-    def send_action(self, ac: List[float]) -> None:
+    def send_action(self, ac: np.ndarray) -> None:
+        if self.wire_format == WireFormat.BINARY:
+            ac = pack_array(ac)
+        else:
+            ac = np.asarray(ac).tolist()
 
         try:
             d = self.remote_client.callRemote("receive_action", ac=ac)
@@ -0,0 +1,105 @@
+import hashlib
+import hmac
+import json
+import struct
+
+from gym_multiplayer_server.common.wire import pack_array, pack_step
+
+# Frames are prefixed by their length as 4 byte unsigned big-endian int
+# (the layout of twisted's Int32StringReceiver), followed by one opcode byte
+FRAME_PREFIX = struct.Struct("!I")
+MAX_FRAME_LENGTH = 1 << 20
+
+_JSON_LENGTH = struct.Struct("<H")
+
+
+class Op:
+    # client -> server
+    LOGIN = 1
+    START_QUEUING = 2
+    STOP_QUEUEING = 3
+    RECEIVE_ACTION = 4
+    REQUEST_STATS = 5
+    LOGIN_RESPONSE = 6
+
+    # server -> client
+    LOGIN_OK = 64
+    LOGIN_FAILED = 65
+    QUEUING = 66
+    GAME_STARTS = 67
+    RECEIVE_OBSERVATION = 68
+    GAME_DONE = 69
+    GAME_ABORTED = 70
+    STATS = 71
+    LOGIN_CHALLENGE = 72
+    ERROR = 99
+
+
+class BinaryProtocolError(Exception):
+    pass
+
+
+def login_response(challenge, password):
+    """
+    Answer to the login challenge of the server, the password itself never
+    crosses the wire
+    """
+    if isinstance(password, str):
+        password = password.encode("utf-8")
+    return hmac.new(password, challenge, hashlib.sha256).digest()
+
+
+def encode_message(op, payload=b""):
+    return bytes((op,)) + payload
+
+
+def decode_message(data):
+    if not data:
+        raise BinaryProtocolError("Empty message")
+    return data[0], data[1:]
+
+
+def frame(message):
+    return FRAME_PREFIX.pack(len(message)) + message
+
+
+def pack_json(obj):
+    return json.dumps(obj).encode("utf-8")
+
+
+def unpack_json(payload):
+    return json.loads(payload.decode("utf-8"))
+
+
+def pack_json_and_bytes(obj, data):
+    encoded = pack_json(obj)
+    return _JSON_LENGTH.pack(len(encoded)) + encoded + data
+
+
+def unpack_json_and_bytes(payload):
+    (length,) = _JSON_LENGTH.unpack_from(payload)
+    offset = _JSON_LENGTH.size
+    return unpack_json(payload[offset : offset + length]), payload[offset + length :]
+
+
+# Encoders for the server -> client calls issued by the server side Client
+def encode_game_starts(ob, info):
+    if not isinstance(ob, bytes):
+        ob = pack_array(ob)
+    return encode_message(Op.GAME_STARTS, pack_json_and_bytes(info, ob))
+
+
+def encode_receive_observation(ob, r=None, done=None, info=None):
+    if not isinstance(ob, bytes):
+        ob = pack_step(ob, r, done, info)
+    return encode_message(Op.RECEIVE_OBSERVATION, ob)
+
+
+def encode_game_done(ob, result, r=None, done=None, info=None):
+    if not isinstance(ob, bytes):
+        ob = pack_step(ob, r, done, info)
+    return encode_message(Op.GAME_DONE, pack_json_and_bytes(result, ob))
+
+
+def encode_game_aborted(msg):
+    return encode_message(Op.GAME_ABORTED, msg.encode("utf-8"))
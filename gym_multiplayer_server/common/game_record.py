@@ -0,0 +1,410 @@
+import json
+import os
+from glob import glob
+from numbers import Number
+
+import numpy as np
+
+GAME_RECORD_VERSION = 1
+META_FILE = "meta.json"
+SEGMENT_SUFFIX = ".seg"
+# fields and known meta of an in-progress record, needed to seal it after a crash
+SEGMENTS_FILE = "segments.json"
+# in-progress records are listed by a marker file in this directory below
+# games/, so they are found after a crash without walking all records
+OPEN_RECORDS_DIR = ".open"
+
+# dtype of every known column, unknown columns are stored as they are
+FIELD_DTYPES = dict(
+    last_ob=np.float32,
+    action=np.float32,
+    ob=np.float32,
+    reward=np.float32,
+    done=np.int8,
+    winner=np.int8,
+)
+
+
+class GameRecordError(Exception):
+    pass
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {str(k): _to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, Number):
+        return value.item() if isinstance(value, np.generic) else value
+    return value
+
+
+def save_game_record(path, columns, **meta):
+    """
+    Stores a match as a directory with one .npy file per column and a small
+    json header. The header is written last, a directory without it is an
+    incomplete record.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    fields = {}
+    for name, column in columns.items():
+        column = np.asarray(column, dtype=FIELD_DTYPES.get(name))
+        np.save(os.path.join(path, name + ".npy"), column)
+        fields[name] = dict(dtype=column.dtype.str, shape=list(column.shape))
+
+    num_transitions = len(columns["done"]) if "done" in columns else 0
+    write_game_record_meta(path, fields, num_transitions, **meta)
+
+    return path
+
+
+def open_records_index(games_path):
+    return os.path.join(games_path, OPEN_RECORDS_DIR)
+
+
+def _open_record_marker(index_path, path):
+    return os.path.join(index_path, os.path.basename(os.path.normpath(path)))
+
+
+def append_game_record_chunk(path, columns, index_path=None, **meta):
+    """
+    Appends the raw bytes of a chunk of columns to the segment files of an
+    in-progress record. Returns the dtype and row shape of every column, which
+    are needed to seal the record. The first chunk also stores them together
+    with meta in SEGMENTS_FILE, so the record can be sealed after a crash, and
+    lists the record in index_path if given.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    columns = {
+        name: np.ascontiguousarray(column, dtype=FIELD_DTYPES.get(name))
+        for name, column in columns.items()
+    }
+    fields = {
+        name: dict(dtype=column.dtype.str, shape=list(column.shape[1:]))
+        for name, column in columns.items()
+    }
+
+    segments_path = os.path.join(path, SEGMENTS_FILE)
+    if not os.path.exists(segments_path):
+        if index_path is not None:
+            os.makedirs(index_path, exist_ok=True)
+            with open(_open_record_marker(index_path, path), "w") as f:
+                f.write(os.path.relpath(path, index_path))
+        with open(segments_path, "w") as f:
+            json.dump(dict(fields=fields, meta=_to_json(meta)), f)
+
+    for name, column in columns.items():
+        with open(os.path.join(path, name + SEGMENT_SUFFIX), "ab") as f:
+            f.write(column.tobytes())
+
+    return fields
+
+
+def _row_size(field):
+    return np.dtype(field["dtype"]).itemsize * int(np.prod(field["shape"]))
+
+
+def _written_rows(segment_path, field):
+    if not os.path.exists(segment_path):
+        return 0
+    return os.path.getsize(segment_path) // _row_size(field)
+
+
+def seal_game_record(path, fields, num_transitions, index_path=None, **meta):
+    """
+    Turns the segment files of an in-progress record into the .npy columns of a
+    complete record and writes the header. The number of transitions is taken
+    from the bytes on disk, if a chunk could not be written the header says how
+    many are missing. The record is removed from index_path if given.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    segment_paths = {name: os.path.join(path, name + SEGMENT_SUFFIX) for name in fields}
+    written = min(
+        (_written_rows(segment_paths[name], field) for name, field in fields.items()),
+        default=0,
+    )
+    if num_transitions is not None and written != num_transitions:
+        meta["missing_transitions"] = num_transitions - written
+
+    sealed_fields = {}
+    for name, field in fields.items():
+        shape = tuple([written] + field["shape"])
+        npy_path = os.path.join(path, name + ".npy")
+        with open(npy_path, "wb") as f:
+            np.lib.format.write_array_header_1_0(
+                f,
+                dict(descr=field["dtype"], fortran_order=False, shape=shape),
+            )
+            if os.path.exists(segment_paths[name]):
+                # a partially written chunk is cut off
+                with open(segment_paths[name], "rb") as segment:
+                    _copy_bytes(segment, f, written * _row_size(field))
+        sealed_fields[name] = dict(dtype=field["dtype"], shape=list(shape))
+
+    write_game_record_meta(path, sealed_fields, written, **meta)
+
+    for segment_path in list(segment_paths.values()) + [
+        os.path.join(path, SEGMENTS_FILE)
+    ]:
+        if os.path.exists(segment_path):
+            os.remove(segment_path)
+    if index_path is not None:
+        _remove_open_record_marker(index_path, path)
+
+    return path
+
+
+def _remove_open_record_marker(index_path, path):
+    marker_path = _open_record_marker(index_path, path)
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+
+
+def _copy_bytes(src, dst, num_bytes, buffer_size=1 << 20):
+    while num_bytes > 0:
+        data = src.read(min(buffer_size, num_bytes))
+        if not data:
+            break
+        dst.write(data)
+        num_bytes -= len(data)
+
+
+def find_unsealed_game_records(games_path, scan=False):
+    """
+    Returns the in-progress records below games_path, after a crash these are
+    the matches that were running. They are taken from the index of open
+    records, all of games_path is only walked with scan or if there is no
+    index yet. Markers of records that were sealed anyway are removed.
+    """
+    index_path = open_records_index(games_path)
+    if scan or not os.path.isdir(index_path):
+        return [
+            os.path.dirname(segments_path)
+            for segments_path in glob(
+                os.path.join(games_path, "**", SEGMENTS_FILE), recursive=True
+            )
+        ]
+
+    paths = []
+    for name in os.listdir(index_path):
+        marker_path = os.path.join(index_path, name)
+        with open(marker_path) as f:
+            path = os.path.normpath(os.path.join(index_path, f.read()))
+        if os.path.exists(os.path.join(path, SEGMENTS_FILE)):
+            paths.append(path)
+        else:
+            os.remove(marker_path)
+    return paths
+
+
+def seal_unsealed_game_record(path, index_path=None):
+    """
+    Seals the segments left behind by a server that stopped during a match as
+    an aborted record
+    """
+    segments_path = os.path.join(path, SEGMENTS_FILE)
+    if is_game_record(path):
+        # sealed, but the segments were not removed anymore
+        for name in os.listdir(path):
+            if name.endswith(SEGMENT_SUFFIX) or name == SEGMENTS_FILE:
+                os.remove(os.path.join(path, name))
+        if index_path is not None:
+            _remove_open_record_marker(index_path, path)
+        return path
+
+    with open(segments_path) as f:
+        segments = json.load(f)
+
+    meta = segments["meta"]
+    # the end of the match is not known, the last write is the best guess
+    meta.setdefault(
+        "timestamp",
+        max(os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)),
+    )
+    return seal_game_record(
+        path,
+        segments["fields"],
+        None,
+        index_path=index_path,
+        aborted=True,
+        abort_message="Game aborted, the server stopped during the match",
+        **meta,
+    )
+
+
+def write_game_record_meta(path, fields, num_transitions, **meta):
+    header = _to_json(meta)
+    header.update(
+        version=GAME_RECORD_VERSION,
+        num_transitions=num_transitions,
+        fields=fields,
+    )
+
+    tmp_path = os.path.join(path, META_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(header, f)
+    os.replace(tmp_path, os.path.join(path, META_FILE))
+
+
+def is_game_record(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def find_game_records(games_path, identifier="*"):
+    return [
+        os.path.dirname(meta_path)
+        for meta_path in glob(
+            os.path.join(games_path, "**", identifier, META_FILE), recursive=True
+        )
+    ]
+
+
+def find_legacy_game_archives(games_path, identifier="*"):
+    return glob(os.path.join(games_path, "**", f"{identifier}.npz"), recursive=True)
+
+
+class GameRecord:
+    """
+    Read access to a stored match. Columns are loaded lazily with mmap_mode, so
+    reading a single field does not touch the rest of the match.
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        self.mmap_mode = mmap_mode
+
+        try:
+            with open(os.path.join(path, META_FILE), "r") as f:
+                self.meta = json.load(f)
+        except FileNotFoundError:
+            raise GameRecordError(f"{path} is not a game record")
+
+        if self.meta["version"] > GAME_RECORD_VERSION:
+            raise GameRecordError(
+                f"Game record version {self.meta['version']} not supported, "
+                f"please update"
+            )
+
+        self._columns = {}
+
+    @property
+    def fields(self):
+        return list(self.meta["fields"].keys())
+
+    def __len__(self):
+        return self.meta["num_transitions"]
+
+    @property
+    def identifier(self):
+        return self.meta["identifier"]
+
+    @property
+    def player_one(self):
+        return self.meta["player_one"]
+
+    @property
+    def player_two(self):
+        return self.meta["player_two"]
+
+    @property
+    def timestamp(self):
+        return self.meta["timestamp"]
+
+    @property
+    def game_outcomes(self):
+        """
+        Winners of the finished episodes, derived from the columns for records
+        written without them. None if the record has neither.
+        """
+        if self.meta.get("game_outcomes") is not None:
+            return self.meta["game_outcomes"]
+        if "done" in self and "winner" in self:
+            return outcomes_from_columns(self)
+        return None
+
+    def __getitem__(self, field):
+        if field not in self._columns:
+            if field not in self.meta["fields"]:
+                raise KeyError(field)
+            self._columns[field] = np.load(
+                os.path.join(self.path, field + ".npy"), mmap_mode=self.mmap_mode
+            )
+        return self._columns[field]
+
+    def __contains__(self, field):
+        return field in self.meta["fields"]
+
+
+def load_game_record(path, mmap_mode="r"):
+    return GameRecord(path, mmap_mode=mmap_mode)
+
+
+def columns_from_transitions(transitions):
+    """
+    Converts transitions in the old (last_ob, action, ob, r, done, info) layout
+    into record columns and the infos of the transitions that end an episode
+    """
+    last_ob, action, ob, reward, done, winner = [], [], [], [], [], []
+    episode_infos = {}
+    for i, (t_last_ob, t_action, t_ob, t_r, t_done, t_info) in enumerate(transitions):
+        last_ob.append(np.asarray(t_last_ob, dtype=np.float32))
+        if isinstance(t_action, (tuple, list)) and len(t_action) == 2:
+            t_action = np.concatenate(t_action)
+        action.append(np.asarray(t_action, dtype=np.float32))
+        ob.append(np.asarray(t_ob, dtype=np.float32))
+        reward.append(np.nan if t_r is None else t_r)
+        done.append(bool(t_done))
+        winner.append(t_info.get("winner", 0) if t_info else 0)
+        if t_done and t_info:
+            episode_infos[i] = t_info
+
+    columns = dict(
+        last_ob=np.asarray(last_ob, dtype=np.float32),
+        action=np.asarray(action, dtype=np.float32),
+        ob=np.asarray(ob, dtype=np.float32),
+        reward=np.asarray(reward, dtype=np.float32),
+        done=np.asarray(done, dtype=np.int8),
+        winner=np.asarray(winner, dtype=np.int8),
+    )
+
+    return columns, episode_infos
+
+
+def outcomes_from_columns(columns):
+    """
+    Returns the winner of every finished episode, like the game_outcomes the
+    server stores in the header of a record
+    """
+    done = np.asarray(columns["done"]) == 1
+    return np.asarray(columns["winner"])[done].tolist()
+
+
+def convert_legacy_game_archive(npz_path, output_path=None):
+    """
+    Converts a match stored with np.savez(path, {dict}) into a game record next
+    to it (or at output_path) and returns the path of the record
+    """
+    match = np.load(npz_path, allow_pickle=True)["arr_0"].item()
+
+    if output_path is None:
+        output_path = os.path.splitext(npz_path)[0]
+
+    columns, episode_infos = columns_from_transitions(match["transitions"])
+
+    return save_game_record(
+        output_path,
+        columns,
+        identifier=match["identifier"],
+        player_one=match["player_one"],
+        player_two=match["player_two"],
+        timestamp=match["timestamp"],
+        game_outcomes=outcomes_from_columns(columns),
+        episode_infos=episode_infos,
+    )
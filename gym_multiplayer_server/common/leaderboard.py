@@ -0,0 +1,224 @@
+import io
+
+import numpy as np
+
+LEADERBOARD_FILE = "leaderboard.npz"
+
+WINS = 0
+LOSSES = 1
+DRAWS = 2
+RESULT_KEYS = ("wins", "losses", "draws")
+
+
+def _grown(array, size):
+    """
+    Returns array with room for at least size rows, doubling its capacity
+    """
+    if size <= len(array):
+        return array
+    grown = np.zeros((max(size, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+def dumps_snapshot(snapshot):
+    """
+    Serializes a Leaderboard.snapshot, only the pairs that played are stored
+    """
+    players, pairs, results = snapshot
+    f = io.BytesIO()
+    np.savez(f, players=np.array(players, dtype=str), pairs=pairs, results=results)
+    return f.getvalue()
+
+
+class Leaderboard:
+    """
+    Pairwise results of all players. Usernames are interned to integer ids and
+    the wins, losses and draws of player i against player j are kept in one row
+    of a growable (m, 3) int32 array for every pair that played, so memory grows
+    with the number of pairings and not with the square of the number of
+    players.
+    """
+
+    def __init__(self, capacity=16):
+        self.players = []
+        self.ids = {}
+        # row of every (player id, opponent id) pair that played
+        self.rows = {}
+        self._pairs = np.zeros((capacity, 2), dtype=np.int32)
+        self._pair_results = np.zeros((capacity, 3), dtype=np.int32)
+        self._totals = np.zeros((capacity, 3), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.players)
+
+    def __contains__(self, player):
+        return player in self.ids
+
+    def intern(self, player):
+        player_id = self.ids.get(player)
+        if player_id is None:
+            player_id = len(self.players)
+            self._totals = _grown(self._totals, player_id + 1)
+            self.players.append(player)
+            self.ids[player] = player_id
+        return player_id
+
+    def _row(self, player_id, opponent_id):
+        row = self.rows.get((player_id, opponent_id))
+        if row is None:
+            row = len(self.rows)
+            self._pairs = _grown(self._pairs, row + 1)
+            self._pair_results = _grown(self._pair_results, row + 1)
+            self._pairs[row] = player_id, opponent_id
+            self.rows[(player_id, opponent_id)] = row
+        return row
+
+    def _add(self, player_id, opponent_id, result):
+        row = self._row(player_id, opponent_id)
+        self._pair_results[row, result] += 1
+        self._totals[player_id, result] += 1
+
+    def record(self, player_one, player_two, winner):
+        """
+        Adds the outcome of one game, winner is 0 for a draw, 1 if player one won
+        and anything else if player two won
+        """
+        one = self.intern(player_one)
+        two = self.intern(player_two)
+        if winner == 0:
+            self._add(one, two, DRAWS)
+            self._add(two, one, DRAWS)
+        elif winner == 1:
+            self._add(one, two, WINS)
+            self._add(two, one, LOSSES)
+        else:
+            self._add(one, two, LOSSES)
+            self._add(two, one, WINS)
+
+    def result(self, player, opponent):
+        """
+        Returns wins, losses and draws of player against opponent
+        """
+        row = self.rows.get((self.ids[player], self.ids[opponent]))
+        if row is None:
+            return (0, 0, 0)
+        return tuple(int(x) for x in self._pair_results[row])
+
+    def pairs(self):
+        """
+        Returns the (player id, opponent id) of every pair that played as an
+        (m, 2) array and their wins, losses and draws as an (m, 3) array
+        """
+        m = len(self.rows)
+        return self._pairs[:m], self._pair_results[:m]
+
+    @property
+    def results(self):
+        """
+        Dense (n, n, 3) matrix of the pairwise results, only meant for showing
+        the full leaderboard matrix
+        """
+        n = len(self.players)
+        results = np.zeros((n, n, 3), dtype=np.int32)
+        pairs, pair_results = self.pairs()
+        results[pairs[:, 0], pairs[:, 1]] = pair_results
+        return results
+
+    def played(self):
+        """
+        Boolean (n, n) matrix, true where two players played against each other
+        """
+        n = len(self.players)
+        played = np.zeros((n, n), dtype=bool)
+        pairs, pair_results = self.pairs()
+        played[pairs[:, 0], pairs[:, 1]] = pair_results.sum(axis=1) > 0
+        return played
+
+    def totals(self):
+        """
+        (n, 3) wins, losses and draws of every player against all opponents
+        """
+        return self._totals[: len(self.players)].copy()
+
+    def ranking(self):
+        """
+        Player ids sorted by the fraction of games won, best first
+        """
+        totals = self.totals()
+        num_games = np.maximum(totals.sum(axis=1), 1)
+        return np.argsort(-totals[:, WINS] / num_games, kind="stable")
+
+    def _set_pairs(self, pairs, pair_results):
+        self._pairs = _grown(np.asarray(pairs, dtype=np.int32), 16)
+        self._pair_results = _grown(np.asarray(pair_results, dtype=np.int32), 16)
+        self.rows = {(i, j): row for row, (i, j) in enumerate(pairs.tolist())}
+        self._totals[:] = 0
+        np.add.at(self._totals, pairs[:, 0], pair_results)
+
+    # Conversion from/to the nested dicts of older servers
+    def to_dict(self):
+        leaderboard = {}
+        totals = self.totals()
+        for i, player in enumerate(self.players):
+            leaderboard[player] = {"total": dict(zip(RESULT_KEYS, totals[i].tolist()))}
+        pairs, pair_results = self.pairs()
+        for (i, j), result in zip(pairs.tolist(), pair_results.tolist()):
+            if any(result):
+                leaderboard[self.players[i]][self.players[j]] = dict(
+                    zip(RESULT_KEYS, result)
+                )
+        return leaderboard
+
+    @classmethod
+    def from_dict(cls, leaderboard):
+        converted = cls()
+        for player in leaderboard:
+            converted.intern(player)
+        pairs, pair_results = [], []
+        for player, opponents in leaderboard.items():
+            for opponent, result in opponents.items():
+                if opponent == "total":
+                    continue
+                pairs.append((converted.intern(player), converted.intern(opponent)))
+                pair_results.append([result[key] for key in RESULT_KEYS])
+        converted._set_pairs(
+            np.array(pairs, dtype=np.int32).reshape(-1, 2),
+            np.array(pair_results, dtype=np.int32).reshape(-1, 3),
+        )
+        return converted
+
+    # Binary dump
+    def snapshot(self):
+        """
+        Copy of the players and pairwise results that is cheap enough to take on
+        the reactor thread, serialize it in another thread with dumps_snapshot
+        """
+        pairs, pair_results = self.pairs()
+        return list(self.players), pairs.copy(), pair_results.copy()
+
+    def dumps(self):
+        return dumps_snapshot(self.snapshot())
+
+    @classmethod
+    def loads(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as f:
+            players = f["players"].tolist()
+            results = f["results"]
+            if "pairs" in f.files:
+                pairs = f["pairs"]
+            else:
+                # dense (n, n, 3) results written by earlier servers
+                pairs = np.argwhere(results.sum(axis=2) > 0)
+                results = results[pairs[:, 0], pairs[:, 1]]
+
+        leaderboard = cls(capacity=max(16, len(players)))
+        for player in players:
+            leaderboard.intern(player)
+        leaderboard._set_pairs(pairs.reshape(-1, 2), results.reshape(-1, 3))
+        return leaderboard
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.loads(f.read())
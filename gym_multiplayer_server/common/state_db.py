@@ -0,0 +1,316 @@
+import json
+import math
+import sqlite3
+
+STATE_DB_FILE = "state.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS avatars (
+    username TEXT PRIMARY KEY,
+    finished_games INTEGER NOT NULL DEFAULT 0,
+    games_won INTEGER NOT NULL DEFAULT 0,
+    games_lost INTEGER NOT NULL DEFAULT 0,
+    games_drawn INTEGER NOT NULL DEFAULT 0,
+    rating_mu REAL NOT NULL,
+    rating_sigma REAL NOT NULL,
+    last_saved REAL
+);
+CREATE INDEX IF NOT EXISTS avatars_lcb ON avatars (rating_mu - rating_sigma);
+
+CREATE TABLE IF NOT EXISTS avatar_games (
+    username TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    PRIMARY KEY (username, identifier)
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    player TEXT NOT NULL,
+    opponent TEXT NOT NULL,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (player, opponent)
+);
+
+CREATE TABLE IF NOT EXISTS rating_history (
+    username TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    rating_mu REAL NOT NULL,
+    rating_sigma REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rating_history_username
+    ON rating_history (username, timestamp);
+
+CREATE TABLE IF NOT EXISTS stats (
+    stat_group TEXT NOT NULL,
+    stat_key TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS stats_key ON stats (stat_group, stat_key, timestamp);
+
+CREATE TABLE IF NOT EXISTS games (
+    identifier TEXT PRIMARY KEY,
+    player_one TEXT NOT NULL,
+    player_two TEXT NOT NULL,
+    timestamp REAL,
+    game_outcomes TEXT,
+    path TEXT
+);
+CREATE INDEX IF NOT EXISTS games_players ON games (player_one, player_two, timestamp);
+CREATE INDEX IF NOT EXISTS games_timestamp ON games (timestamp);
+
+CREATE TABLE IF NOT EXISTS misc (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+AVATAR_COLUMNS = (
+    "username",
+    "finished_games",
+    "games_won",
+    "games_lost",
+    "games_drawn",
+    "rating_mu",
+    "rating_sigma",
+    "last_saved",
+)
+
+GAME_COLUMNS = (
+    "identifier",
+    "player_one",
+    "player_two",
+    "timestamp",
+    "game_outcomes",
+    "path",
+)
+
+
+class StateDB:
+    """
+    SQLite database holding the server state. It runs in WAL mode, so readers
+    like the web frontend can query it while the server writes.
+
+    A StateDB must only be used by one thread at a time, the server writes to it
+    from a thread pool thread but never concurrently.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(_SCHEMA)
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    # Writes, every call is one transaction
+    def write(
+        self,
+        avatars=(),
+        avatar_games=(),
+        results=(),
+        rating_history=(),
+        stats=(),
+        games=(),
+        misc=None,
+    ):
+        """
+        avatars: avatar states as returned by Avatar.get_state
+        avatar_games: (username, identifier)
+        results: (player, opponent, wins, losses, draws), replaces the row
+        rating_history: (username, timestamp, mu, sigma)
+        stats: (group, key, timestamp, value)
+        games: dicts with identifier, player_one, player_two, timestamp,
+            game_outcomes and path
+        misc: dict of json serializable values
+        """
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO avatars ({', '.join(AVATAR_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(AVATAR_COLUMNS))})",
+                [tuple(state.get(c) for c in AVATAR_COLUMNS) for state in avatars],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO avatar_games VALUES (?, ?)", avatar_games
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", results
+            )
+            self.conn.executemany(
+                "INSERT INTO rating_history VALUES (?, ?, ?, ?)", rating_history
+            )
+            self.conn.executemany("INSERT INTO stats VALUES (?, ?, ?, ?)", stats)
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO games ({', '.join(GAME_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(GAME_COLUMNS))})",
+                [
+                    tuple(
+                        json.dumps(g.get(c)) if c == "game_outcomes" else g.get(c)
+                        for c in GAME_COLUMNS
+                    )
+                    for g in games
+                ],
+            )
+            if misc:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO misc VALUES (?, ?)",
+                    [(key, json.dumps(value)) for key, value in misc.items()],
+                )
+
+    def replace_ratings(self, ratings, rating_history):
+        """
+        Overwrites the ratings and the rating history of the given avatars in one
+        transaction, used after recomputing the ratings offline. The history of
+        other avatars is kept.
+
+        ratings: (username, mu, sigma)
+        rating_history: (username, timestamp, mu, sigma)
+        """
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE avatars SET rating_mu = ?, rating_sigma = ? WHERE username = ?",
+                [(mu, sigma, username) for username, mu, sigma in ratings],
+            )
+            self.conn.executemany(
+                "DELETE FROM rating_history WHERE username = ?",
+                [(username,) for username, _, _ in ratings],
+            )
+            self.conn.executemany(
+                "INSERT INTO rating_history VALUES (?, ?, ?, ?)", rating_history
+            )
+
+    # Reads
+    def load_avatars(self):
+        """
+        Returns the avatar states keyed by username, in the layout of
+        Avatar.get_state
+        """
+        avatars = {}
+        for row in self.conn.execute(
+            f"SELECT {', '.join(AVATAR_COLUMNS)} FROM avatars"
+        ):
+            state = dict(zip(AVATAR_COLUMNS, row))
+            state["finished_games_ids"] = []
+            avatars[state["username"]] = state
+        for username, identifier in self.conn.execute(
+            "SELECT username, identifier FROM avatar_games ORDER BY rowid"
+        ):
+            if username in avatars:
+                avatars[username]["finished_games_ids"].append(identifier)
+        return avatars
+
+    def load_misc(self):
+        return {
+            key: json.loads(value)
+            for key, value in self.conn.execute("SELECT key, value FROM misc")
+        }
+
+    def load_stats(self, since=None):
+        """
+        Returns the (group, key, timestamp, value) stats samples since the given
+        time, ordered by stat and timestamp
+        """
+        return self.conn.execute(
+            "SELECT stat_group, stat_key, timestamp, value FROM stats "
+            "WHERE timestamp >= ? ORDER BY stat_group, stat_key, timestamp",
+            (since if since is not None else float("-inf"),),
+        ).fetchall()
+
+    def load_leaderboard(self):
+        """
+        Returns the pairwise results as nested dicts, see Leaderboard.from_dict
+        """
+        leaderboard = {}
+        for player, opponent, wins, losses, draws in self.conn.execute(
+            "SELECT player, opponent, wins, losses, draws FROM results"
+        ):
+            leaderboard.setdefault(player, {})[opponent] = {
+                "wins": wins,
+                "losses": losses,
+                "draws": draws,
+            }
+        for player, wins, losses, draws in self.conn.execute(
+            "SELECT player, SUM(wins), SUM(losses), SUM(draws) FROM results "
+            "GROUP BY player"
+        ):
+            leaderboard[player]["total"] = {
+                "wins": wins,
+                "losses": losses,
+                "draws": draws,
+            }
+        return leaderboard
+
+    def ranking(self):
+        """
+        Returns (username, mu, sigma) sorted by mu - sigma, best first
+        """
+        return self.conn.execute(
+            "SELECT username, rating_mu, rating_sigma FROM avatars "
+            "ORDER BY rating_mu - rating_sigma DESC"
+        ).fetchall()
+
+    def rating_history(self, username, since=None):
+        return self.conn.execute(
+            "SELECT timestamp, rating_mu, rating_sigma FROM rating_history "
+            "WHERE username = ? AND timestamp >= ? ORDER BY timestamp",
+            (username, since if since is not None else float("-inf")),
+        ).fetchall()
+
+    def stats(self, group, key, start=None, resolution=None):
+        """
+        Returns the [timestamp, value] samples of a stat since start, oldest
+        first. With resolution the samples are averaged into buckets of that
+        many seconds like MultiResolutionStats.query, timestamps are the bucket
+        starts and only buckets starting after start are returned.
+        """
+        start = start if start is not None else float("-inf")
+        if resolution is not None and start != float("-inf"):
+            start = math.ceil(start / resolution) * resolution
+        if resolution is None:
+            rows = self.conn.execute(
+                "SELECT timestamp, value FROM stats WHERE stat_group = ? "
+                "AND stat_key = ? AND timestamp >= ? ORDER BY timestamp",
+                (group, key, start),
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT CAST(timestamp / ? AS INTEGER) * ? AS bucket, AVG(value) "
+                "FROM stats WHERE stat_group = ? AND stat_key = ? AND timestamp >= ? "
+                "GROUP BY bucket ORDER BY bucket",
+                (resolution, resolution, group, key, start),
+            )
+        return [list(row) for row in rows]
+
+    def games(self, player_one=None, player_two=None, identifier=None):
+        """
+        Returns the finished games as dicts, optionally filtered by identifier or
+        by the players (in either order)
+        """
+        query = f"SELECT {', '.join(GAME_COLUMNS)} FROM games"
+        args = ()
+        if identifier is not None:
+            query += " WHERE identifier = ?"
+            args = (identifier,)
+        elif player_one is not None and player_two is not None:
+            query += (
+                " WHERE (player_one = ? AND player_two = ?)"
+                " OR (player_one = ? AND player_two = ?)"
+            )
+            args = (player_one, player_two, player_two, player_one)
+        query += " ORDER BY timestamp, identifier"
+
+        games = []
+        for row in self.conn.execute(query, args):
+            game = dict(zip(GAME_COLUMNS, row))
+            game["game_outcomes"] = json.loads(game["game_outcomes"])
+            games.append(game)
+        return games
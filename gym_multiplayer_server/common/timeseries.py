@@ -0,0 +1,161 @@
+import numpy as np
+
+# (seconds per bucket, number of buckets): 1 hour of 10 s, 1 day of 1 min and
+# 30 days of 1 h buckets
+DEFAULT_RESOLUTIONS = ((10, 360), (60, 1440), (3600, 720))
+
+
+def resolution_for_span(span, max_points, resolutions=DEFAULT_RESOLUTIONS):
+    """
+    Returns the finest resolution whose ring buffer reaches span seconds back
+    with at most max_points buckets, the coarsest one if none does
+    """
+    for resolution, size in resolutions:
+        if resolution * size >= span and span / resolution <= max_points:
+            return resolution
+    return resolutions[-1][0]
+
+
+class RingBufferLevel:
+    """
+    Fixed-size ring buffer of time buckets of one resolution, every bucket holds
+    min, max, sum and count of the samples that fell into it.
+    """
+
+    def __init__(self, resolution, size):
+        self.resolution = resolution
+        self.size = size
+
+        self.start = np.zeros(size, dtype=np.float64)
+        self.min = np.zeros(size, dtype=np.float64)
+        self.max = np.zeros(size, dtype=np.float64)
+        self.sum = np.zeros(size, dtype=np.float64)
+        self.count = np.zeros(size, dtype=np.int64)
+
+        # index of the newest (still open) bucket
+        self.head = -1
+        self.length = 0
+
+    def add(self, t, value):
+        bucket_start = np.floor(t / self.resolution) * self.resolution
+
+        # samples older than the newest bucket are counted into it
+        if self.length == 0 or bucket_start > self.start[self.head]:
+            self.head = (self.head + 1) % self.size
+            self.length = min(self.length + 1, self.size)
+            self.start[self.head] = bucket_start
+            self.min[self.head] = value
+            self.max[self.head] = value
+            self.sum[self.head] = value
+            self.count[self.head] = 1
+        else:
+            self.min[self.head] = min(self.min[self.head], value)
+            self.max[self.head] = max(self.max[self.head], value)
+            self.sum[self.head] += value
+            self.count[self.head] += 1
+
+    @property
+    def oldest(self):
+        if self.length == 0:
+            return None
+        return self.start[(self.head - self.length + 1) % self.size]
+
+    def query(self, start=None, end=None):
+        """
+        Returns the buckets with start <= bucket start < end, oldest first
+        """
+        idx = np.arange(self.head - self.length + 1, self.head + 1) % self.size
+        mask = np.ones(len(idx), dtype=bool)
+        if start is not None:
+            mask &= self.start[idx] >= start
+        if end is not None:
+            mask &= self.start[idx] < end
+        idx = idx[mask]
+
+        return dict(
+            time=self.start[idx].copy(),
+            min=self.min[idx].copy(),
+            mean=self.sum[idx] / self.count[idx],
+            max=self.max[idx].copy(),
+        )
+
+
+class MultiResolutionSeries:
+    """
+    RRD-style time series: every sample is added to a ring buffer per
+    resolution, so memory is bounded while coarse history reaches far back.
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS):
+        self.levels = [RingBufferLevel(res, size) for res, size in resolutions]
+
+    @property
+    def resolutions(self):
+        return [level.resolution for level in self.levels]
+
+    def add(self, t, value):
+        for level in self.levels:
+            level.add(t, value)
+
+    def level(self, resolution):
+        for level in self.levels:
+            if level.resolution == resolution:
+                return level
+        raise KeyError(f"No resolution of {resolution} s")
+
+    def query(self, start=None, end=None, resolution=None):
+        """
+        Returns dict(time, min, mean, max) arrays of the buckets in [start, end).
+        Without resolution the finest one still covering start is used.
+        """
+        if resolution is not None:
+            return self.level(resolution).query(start, end)
+
+        level = self.levels[0]
+        if start is not None:
+            for level in self.levels:
+                if level.oldest is not None and level.oldest <= start:
+                    break
+        return level.query(start, end)
+
+
+class MultiResolutionStats:
+    """
+    The server stats: one MultiResolutionSeries per (group, key)
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS):
+        self.resolutions = resolutions
+        self.series = {}
+
+    def add(self, group, key, t, value):
+        series = self.series.get((group, key))
+        if series is None:
+            series = self.series[(group, key)] = MultiResolutionSeries(self.resolutions)
+        series.add(t, value)
+
+    def add_all(self, group, t, values):
+        for key, value in values.items():
+            self.add(group, key, t, value)
+
+    def __contains__(self, group_key):
+        return group_key in self.series
+
+    def keys(self):
+        return list(self.series.keys())
+
+    def query(self, group, key, start=None, end=None, resolution=None):
+        return self.series[(group, key)].query(start, end, resolution)
+
+    @classmethod
+    def from_samples(cls, stats, resolutions=DEFAULT_RESOLUTIONS):
+        """
+        Converts the stats of older servers, lists of [time, value] samples in a
+        dict of dicts keyed by group and key
+        """
+        converted = cls(resolutions)
+        for group, group_stats in stats.items():
+            for key, samples in group_stats.items():
+                for t, value in samples:
+                    converted.add(group, key, t, value)
+        return converted
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class TransitionBuffer:
+    """
+    Columnar storage for the transitions of a match. Observations and actions are
+    kept in preallocated float32 arrays that grow geometrically, reward, done and
+    winner in compact per step arrays. Info dicts are only kept for transitions
+    that end an episode, unless keep_info is set.
+    """
+
+    def __init__(self, capacity=256, keep_info=False):
+        self.capacity = capacity
+        self.keep_info = keep_info
+
+        self.size = 0
+        self.last_ob = None
+        self.action = None
+        self.ob = None
+        self.reward = np.empty(capacity, dtype=np.float32)
+        self.done = np.empty(capacity, dtype=np.int8)
+        self.winner = np.empty(capacity, dtype=np.int8)
+        self.infos = {}
+
+    def __len__(self):
+        return self.size
+
+    def _allocate(self, ob_dim, action_dim):
+        self.last_ob = np.empty((self.capacity, ob_dim), dtype=np.float32)
+        self.action = np.empty((self.capacity, action_dim), dtype=np.float32)
+        self.ob = np.empty((self.capacity, ob_dim), dtype=np.float32)
+
+    def _grow(self):
+        self.capacity *= 2
+        for field in ("last_ob", "action", "ob", "reward", "done", "winner"):
+            old = getattr(self, field)
+            new = np.empty((self.capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, field, new)
+
+    def append(self, last_ob, action, ob, reward, done, info):
+        if self.ob is None:
+            self._allocate(len(ob), len(action))
+        elif self.size == self.capacity:
+            self._grow()
+
+        i = self.size
+        self.last_ob[i] = last_ob
+        self.action[i] = action
+        self.ob[i] = ob
+        self.reward[i] = np.nan if reward is None else reward
+        self.done[i] = bool(done)
+        self.winner[i] = info.get("winner", 0) if info else 0
+        if info and (done or self.keep_info):
+            self.infos[i] = info
+
+        self.size += 1
+
+    def clear(self):
+        self.size = 0
+        self.infos = {}
+
+    def columns(self):
+        """
+        Returns views on the filled part of all columns
+        """
+        n = self.size
+        columns = dict(
+            reward=self.reward[:n],
+            done=self.done[:n],
+            winner=self.winner[:n],
+        )
+        if self.ob is not None:
+            columns.update(
+                last_ob=self.last_ob[:n], action=self.action[:n], ob=self.ob[:n]
+            )
+        return columns
+
+    @property
+    def nbytes(self):
+        return sum(
+            getattr(self, field).nbytes
+            for field in ("last_ob", "action", "ob", "reward", "done", "winner")
+            if getattr(self, field) is not None
+        )
@@ -0,0 +1,77 @@
+import math
+import struct
+
+import numpy as np
+
+
+class WireFormat:
+    LIST = "list"
+    BINARY = "binary"
+
+
+# Ordered by preference, the server picks the first format it supports
+SUPPORTED_WIRE_FORMATS = (WireFormat.BINARY, WireFormat.LIST)
+
+# Keys of the HockeyEnv info dict that are transferred in binary mode
+INFO_KEYS = (
+    "winner",
+    "reward_closeness_to_puck",
+    "reward_touch_puck",
+    "reward_puck_direction",
+)
+
+# reward (NaN if None), done (-1 if None), number of packed info values (0 if None)
+_STEP_HEADER = struct.Struct("<fbB")
+_INFO = struct.Struct(f"<{len(INFO_KEYS)}f")
+
+
+def negotiate_wire_format(client_formats):
+    if not client_formats:
+        return WireFormat.LIST
+    for wire_format in SUPPORTED_WIRE_FORMATS:
+        if wire_format in client_formats:
+            return wire_format
+    return WireFormat.LIST
+
+
+def pack_array(x) -> bytes:
+    return np.asarray(x, dtype=np.float32).tobytes()
+
+
+def unpack_array(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.float32)
+
+
+def pack_step(ob, r, done, info) -> bytes:
+    header = _STEP_HEADER.pack(
+        math.nan if r is None else r,
+        -1 if done is None else int(bool(done)),
+        0 if info is None else len(INFO_KEYS),
+    )
+    if info is not None:
+        header += _INFO.pack(*[info.get(key, math.nan) for key in INFO_KEYS])
+    return header + pack_array(ob)
+
+
+def unpack_step(data: bytes):
+    r, done, num_info = _STEP_HEADER.unpack_from(data)
+    offset = _STEP_HEADER.size
+
+    info = None
+    if num_info:
+        values = _INFO.unpack_from(data, offset)
+        offset += _INFO.size
+        info = {
+            key: value for key, value in zip(INFO_KEYS, values) if not math.isnan(value)
+        }
+        if "winner" in info:
+            info["winner"] = int(info["winner"])
+
+    ob = np.frombuffer(data, dtype=np.float32, offset=offset).copy()
+
+    return (
+        ob,
+        None if math.isnan(r) else r,
+        None if done < 0 else bool(done),
+        info,
+    )
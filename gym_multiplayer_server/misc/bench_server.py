@@ -0,0 +1,464 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from trueskill import Rating
+from twisted.internet import defer, reactor
+
+from gym_multiplayer_server.server.game import Game, GameStates
+from gym_multiplayer_server.server.player import Avatar, ClientState
+from gym_multiplayer_server.server.server import GameServer
+from gym_multiplayer_server.server.state_store import StateStores
+
+OB_DIM = 18
+ACTION_DIM = 4
+
+
+class StubBroker:
+    disconnected = False
+
+    def notifyOnDisconnect(self, notifier):
+        pass
+
+    def dontNotifyOnDisconnect(self, notifier):
+        pass
+
+
+class StubMind:
+    """
+    Stands in for the PB mind of a client, every remote call succeeds at once
+    """
+
+    def __init__(self):
+        self.broker = StubBroker()
+
+    def callRemote(self, name, **kwargs):
+        return defer.succeed(None)
+
+
+class StubEnvBackend:
+    """
+    Synchronous env backend returning fixed observations, so the benchmarks
+    measure the server and not the physics of the env
+    """
+
+    def __init__(self, episode_length=None):
+        self.episode_length = episode_length
+        self.ob = np.zeros(OB_DIM)
+        self.steps = {}
+
+    def make(self, game_id):
+        self.steps[game_id] = 0
+        return defer.succeed(None)
+
+    def reset(self, game_id, one_starting):
+        self.steps[game_id] = 0
+        return defer.succeed((self.ob, self.ob))
+
+    def _step(self, game_id):
+        self.steps[game_id] += 1
+        done = self.episode_length is not None and (
+            self.steps[game_id] >= self.episode_length
+        )
+        info = dict(
+            winner=1 if done else 0,
+            reward_closeness_to_puck=0.0,
+            reward_touch_puck=0.0,
+            reward_puck_direction=0.0,
+        )
+        return (self.ob, self.ob, 0.0, done, info, [])
+
+    def step(self, game_id, action, repeat=1):
+        return defer.succeed(self._step(game_id))
+
+    def step_batch(self, game_ids, actions, repeats):
+        return defer.succeed([(True, self._step(game_id)) for game_id in game_ids])
+
+    def close(self, game_id):
+        self.steps.pop(game_id, None)
+        return defer.succeed(None)
+
+    def shutdown(self):
+        pass
+
+
+def make_server(working_dir, **kwargs):
+    # no envs are built, the stub backend never takes one from the pool
+    return GameServer(
+        working_dir,
+        interactive=False,
+        env_pool_size=0,
+        env_backend=StubEnvBackend(),
+        **kwargs,
+    )
+
+
+def close_server(server):
+    """
+    Stops everything the server started, many servers are created per run
+    """
+    reactor.removeSystemEventTrigger(server.shutdown_trigger)
+    server.maintainance_call.stop()
+    if server.stall_detector is not None:
+        server.stall_detector.stop()
+    if server.tick_scheduler is not None:
+        server.tick_scheduler.stop()
+    if server.batch_matchmaker is not None:
+        server.batch_matchmaker.stop()
+    server.record_writer.close()
+    server.state_store.close()
+
+
+def random_rating(rng):
+    return Rating(rng.normal(25, 5), rng.uniform(1, 8))
+
+
+def add_avatar(server, username, rating):
+    avatar = Avatar(username, server)
+    avatar.rating = rating
+    server.avatars[username.encode("utf-8")] = avatar
+    return avatar
+
+
+def add_client(server, avatar):
+    avatar.attached(StubMind())
+    return avatar.clients[-1]
+
+
+def add_waiting_game(server, client):
+    # remote_start_queuing without the matchmaking
+    client.state = ClientState.WAITING_FOR_GAME
+    server.client_registry.move(client, ClientState.WAITING_FOR_GAME)
+    client.game = Game(server=server)
+    client.game.add_player(client)
+
+
+def fill_server_state(server, num_avatars, rng):
+    """
+    num_avatars avatars with ratings, 10 games per avatar in the leaderboard
+    and one day of stats
+    """
+    usernames = [f"player{i}" for i in range(num_avatars)]
+    for username in usernames:
+        avatar = add_avatar(server, username, random_rating(rng))
+        avatar.finished_games_ids = [f"{i:08x}" for i in range(10)]
+        avatar.finished_games = 10
+
+    for _ in range(10 * num_avatars):
+        one, two = rng.choice(num_avatars, 2, replace=False)
+        server.leaderboard.record(usernames[one], usernames[two], rng.integers(-1, 2))
+    players = server.leaderboard.players
+    server.dirty_results = {
+        (players[i], players[j]) for i, j in server.leaderboard.pairs()[0].tolist()
+    }
+
+    now = time.time()
+    for t in np.arange(now - 24 * 3600, now, 10.0):
+        server.stats.add_all("games", t, dict(total=t, running=5, waiting=2))
+        server.stats.add_all(
+            "player",
+            t,
+            dict(
+                active_player=10,
+                total_clients=20,
+                idle_clients=3,
+                waiting_clients=2,
+                playing_clients=15,
+            ),
+        )
+    server.total_num_played_games = 10 * num_avatars
+    return usernames
+
+
+# Benchmarks, each returns the seconds per operation of one run
+def bench_game_step(num_steps):
+    with tempfile.TemporaryDirectory() as working_dir:
+        server = make_server(working_dir)
+        rng = np.random.default_rng(0)
+        one = add_client(server, add_avatar(server, "one", Rating()))
+        two = add_client(server, add_avatar(server, "two", Rating()))
+        one.remote_start_queuing()
+        two.remote_start_queuing()
+        assert one.game.state == GameStates.GAME_RUNNING
+
+        actions = rng.uniform(-1, 1, (num_steps, 2, ACTION_DIM)).tolist()
+        start = time.perf_counter()
+        for action_one, action_two in actions:
+            one.remote_receive_action(action_one)
+            two.remote_receive_action(action_two)
+        duration = time.perf_counter() - start
+
+        one.game.abort("Benchmark done")
+        close_server(server)
+    return duration / num_steps
+
+
+def bench_join_game(queue_size, num_joins):
+    with tempfile.TemporaryDirectory() as working_dir:
+        server = make_server(working_dir)
+        rng = np.random.default_rng(0)
+        np.random.seed(0)
+        names = (f"player{i}" for i in range(queue_size + 2 * num_joins))
+
+        for _ in range(queue_size):
+            avatar = add_avatar(server, next(names), random_rating(rng))
+            add_waiting_game(server, add_client(server, avatar))
+
+        duration = 0.0
+        for _ in range(num_joins):
+            avatar = add_avatar(server, next(names), random_rating(rng))
+            client = add_client(server, avatar)
+
+            start = time.perf_counter()
+            client.remote_start_queuing()
+            duration += time.perf_counter() - start
+
+            # restore the queue size
+            game = client.game
+            clients = [c for c in game.clients if c is not None]
+            game.abort("Benchmark")
+            for c in clients:
+                c.avatar.detached(c.mind)
+            if len(clients) == 2:
+                avatar = add_avatar(server, next(names), random_rating(rng))
+                add_waiting_game(server, add_client(server, avatar))
+
+        close_server(server)
+    return duration / num_joins
+
+
+def bench_game_done(num_avatars, num_games):
+    with tempfile.TemporaryDirectory() as working_dir:
+        server = make_server(working_dir)
+        rng = np.random.default_rng(0)
+        avatars = [
+            add_avatar(server, f"player{i}", random_rating(rng))
+            for i in range(num_avatars)
+        ]
+        games = []
+        for i in range(num_games):
+            one, two = rng.choice(num_avatars, 2, replace=False)
+            games.append(
+                SimpleNamespace(
+                    identifier=f"{i:08x}",
+                    clients=(
+                        SimpleNamespace(avatar=avatars[one]),
+                        SimpleNamespace(avatar=avatars[two]),
+                    ),
+                    game_outcomes=rng.integers(-1, 2, 4).tolist(),
+                    recorder=SimpleNamespace(path=None),
+                )
+            )
+
+        start = time.perf_counter()
+        for game in games:
+            server.game_done(game)
+        duration = time.perf_counter() - start
+        close_server(server)
+    return duration / num_games
+
+
+def bench_save(state_store, num_avatars, dirty_fraction, repeat):
+    """
+    Blocking saves with dirty_fraction of the avatars (and their results)
+    changed, returns the seconds of every save
+    """
+    durations = []
+    with tempfile.TemporaryDirectory() as working_dir:
+        server = make_server(working_dir, state_store=state_store)
+        rng = np.random.default_rng(0)
+        usernames = fill_server_state(server, num_avatars, rng)
+        server._save(blocking=True)
+
+        players = server.leaderboard.players
+        all_results = [
+            (players[i], players[j]) for i, j in server.leaderboard.pairs()[0].tolist()
+        ]
+        num_dirty = max(1, int(dirty_fraction * num_avatars))
+        for _ in range(repeat):
+            dirty = {
+                usernames[i] for i in rng.choice(num_avatars, num_dirty, replace=False)
+            }
+            for username in dirty:
+                server.avatars[username.encode("utf-8")].dirty = True
+            server.dirty_results = {
+                (player, opponent)
+                for player, opponent in all_results
+                if player in dirty or opponent in dirty
+            }
+
+            start = time.perf_counter()
+            server._save(blocking=True)
+            durations.append(time.perf_counter() - start)
+        close_server(server)
+    return durations
+
+
+def bench_render(state_store, num_avatars, repeat):
+    from gym_multiplayer_server.web_frontend.gen_html import Fronend
+
+    durations = []
+    with tempfile.TemporaryDirectory() as working_dir:
+        server = make_server(working_dir, state_store=state_store)
+        fill_server_state(server, num_avatars, np.random.default_rng(0))
+        server._save(blocking=True)
+        close_server(server)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                Fronend(working_dir, output_dir).render()
+                durations.append(time.perf_counter() - start)
+    return durations
+
+
+def benchmarks(args):
+    """
+    (name, fn) of all benchmarks, fn returns the seconds per operation of every
+    repetition
+    """
+
+    def repeated(fn, *fn_args):
+        return lambda: [fn(*fn_args) for _ in range(args.repeat)]
+
+    yield "game_step", repeated(bench_game_step, args.num_steps)
+    for queue_size in args.queue_sizes:
+        yield f"join_game[queue={queue_size}]", repeated(
+            bench_join_game, queue_size, args.num_joins
+        )
+    yield f"game_done[avatars={args.num_avatars}]", repeated(
+        bench_game_done, args.num_avatars, args.num_games
+    )
+    for state_store in (StateStores.PICKLE, StateStores.SQLITE):
+        yield f"save_full[{state_store},avatars={args.num_avatars}]", (
+            lambda s=state_store: bench_save(s, args.num_avatars, 1.0, args.repeat)
+        )
+        yield f"save_incremental[{state_store},avatars={args.num_avatars}]", (
+            lambda s=state_store: bench_save(s, args.num_avatars, 0.01, args.repeat)
+        )
+        yield f"frontend_render[{state_store},avatars={args.render_avatars}]", (
+            lambda s=state_store: bench_render(s, args.render_avatars, args.repeat)
+        )
+
+
+def run(args):
+    results = {}
+    for name, fn in benchmarks(args):
+        if args.filter and args.filter not in name:
+            continue
+        random.seed(0)
+        durations = fn()
+        seconds_per_op = float(np.median(durations))
+        results[name] = dict(
+            seconds_per_op=seconds_per_op,
+            ops_per_second=1.0 / seconds_per_op if seconds_per_op > 0 else None,
+            runs=durations,
+        )
+        print(f"{name:50}{seconds_per_op * 1e6:>15.1f} us/op", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of every benchmark against the baseline and returns the
+    names of the ones that got slower by more than threshold
+    """
+    regressions = []
+    print(
+        "{:50}{:>15}{:>15}{:>10}".format(
+            "Benchmark", "Baseline us", "Current us", "Change"
+        )
+    )
+    print("-" * 90)
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:50}{'':>15}{result['seconds_per_op'] * 1e6:>15.1f}")
+            continue
+        base = baseline[name]["seconds_per_op"]
+        ratio = result["seconds_per_op"] / base
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = "  faster"
+        print(
+            f"{name:50}{base * 1e6:>15.1f}{result['seconds_per_op'] * 1e6:>15.1f}"
+            f"{(ratio - 1) * 100:>+9.1f}%{flag}"
+        )
+    return regressions
+
+
+def main(args):
+    results = run(args)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                dict(
+                    meta=dict(
+                        python=platform.python_version(),
+                        numpy=np.__version__,
+                        machine=platform.platform(),
+                        timestamp=time.time(),
+                        args=vars(args),
+                    ),
+                    benchmarks=results,
+                ),
+                f,
+                indent=2,
+            )
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)["benchmarks"]
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(
+                f"{len(regressions)} benchmark(s) regressed by more than "
+                f"{args.threshold * 100:.0f}%"
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks of the server hot paths with stubbed PB minds "
+        "and env backend, results can be stored as baseline and compared against"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark")
+    parser.add_argument(
+        "--filter", default=None, help="Only run benchmarks containing this string"
+    )
+    parser.add_argument("--num-steps", type=int, default=10000)
+    parser.add_argument("--queue-sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--num-joins", type=int, default=200)
+    parser.add_argument("--num-games", type=int, default=2000)
+    parser.add_argument(
+        "--num-avatars", type=int, default=5000, help="Avatars for game_done and save"
+    )
+    parser.add_argument(
+        "--render-avatars",
+        type=int,
+        default=200,
+        help="Avatars for the frontend, the leaderboard page grows quadratically",
+    )
+    parser.add_argument("--output", default=None, help="Write results as json")
+    parser.add_argument(
+        "--compare", default=None, help="Json results of an earlier run to compare to"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown reported as regression in compare mode",
+    )
+
+    main(parser.parse_args())
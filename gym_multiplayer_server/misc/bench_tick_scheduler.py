@@ -0,0 +1,71 @@
+import argparse
+
+from gym_multiplayer_server.common.wire import WireFormat
+from gym_multiplayer_server.misc.load_test import run_load_test
+
+
+def configs(tick_intervals, env_workers):
+    for workers in sorted({0, env_workers}):
+        worker_args = ["--env-workers", str(workers)] if workers else []
+        yield f"workers={workers}, immediate", worker_args
+        for tick_interval in tick_intervals:
+            yield (
+                f"workers={workers}, tick={tick_interval * 1000:g}ms",
+                worker_args + ["--tick-interval", str(tick_interval)],
+            )
+
+
+def main(num_clients, num_workers, duration, tick_intervals, env_workers):
+    num_clients += num_clients % 2
+    print(f"{num_clients} clients in {num_workers} processes, {duration:g}s per run")
+    print(
+        "{:30}{:>12}{:>12}{:>12}{:>12}".format(
+            "Server", "steps/s", "rtt p50", "rtt p95", "rtt p99"
+        )
+    )
+    print("-" * 78)
+    for name, server_args in configs(tick_intervals, env_workers):
+        summary = run_load_test(
+            num_clients, num_workers, 0.0, duration, WireFormat.BINARY, server_args
+        )
+        print(
+            "{:30}{:>12.1f}{:>10.1f}ms{:>10.1f}ms{:>10.1f}ms".format(
+                name,
+                summary["steps_per_second"],
+                summary["rtt_p50_ms"] or float("nan"),
+                summary["rtt_p95_ms"] or float("nan"),
+                summary["rtt_p99_ms"] or float("nan"),
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Env steps/s and action round-trip times of the server with "
+        "and without the tick scheduler, measured with the load test"
+    )
+    parser.add_argument("--num-clients", type=int, default=16)
+    parser.add_argument("--num-workers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--tick-intervals",
+        type=float,
+        nargs="+",
+        default=[0.005, 0.01],
+        help="Tick intervals in seconds",
+    )
+    parser.add_argument(
+        "--env-workers",
+        type=int,
+        default=2,
+        help="Env worker processes of the second set of runs, 0 to skip them",
+    )
+
+    args = parser.parse_args()
+    main(
+        args.num_clients,
+        args.num_workers,
+        args.duration,
+        args.tick_intervals,
+        args.env_workers,
+    )
@@ -0,0 +1,106 @@
+import argparse
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+
+from gym_multiplayer_server.common.transition_buffer import TransitionBuffer
+
+OB_DIM = 18
+ACTION_DIM = 4
+
+
+def synthetic_match(num_episodes, episode_length, seed=0):
+    rng = np.random.default_rng(seed)
+    last_ob = rng.standard_normal(OB_DIM)
+    for episode in range(num_episodes):
+        for t in range(episode_length):
+            ob = rng.standard_normal(OB_DIM)
+            action = (
+                rng.uniform(-1, 1, ACTION_DIM).tolist(),
+                rng.uniform(-1, 1, ACTION_DIM).tolist(),
+            )
+            done = t == episode_length - 1
+            info = dict(
+                winner=int(rng.integers(-1, 2)) if done else 0,
+                reward_closeness_to_puck=float(rng.standard_normal()),
+                reward_touch_puck=0.0,
+                reward_puck_direction=float(rng.standard_normal()),
+            )
+            yield last_ob, action, ob, float(rng.standard_normal()), done, info
+            last_ob = ob
+
+
+def fill_list(transitions):
+    buffer = []
+    for last_ob, action, ob, r, done, info in transitions:
+        buffer.append((last_ob, action, ob, r, done, info))
+    return buffer
+
+
+def fill_columnar(transitions):
+    buffer = TransitionBuffer()
+    for last_ob, action, ob, r, done, info in transitions:
+        buffer.append(last_ob, np.concatenate(action), ob, r, done, info)
+    return buffer
+
+
+def measure(fill_fn, num_games, num_episodes, episode_length):
+    # Transitions are generated while filling, exactly like a running game produces
+    # them, so the traced memory after filling is what the buffers retain
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+
+    buffers = [
+        fill_fn(synthetic_match(num_episodes, episode_length, seed=i))
+        for i in range(num_games)
+    ]
+
+    duration = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del buffers
+
+    return dict(
+        bytes_per_game=(current - baseline) / num_games,
+        peak_per_game=(peak - baseline) / num_games,
+        seconds_per_game=duration / num_games,
+    )
+
+
+def main(num_games, num_episodes, episode_length):
+    print(
+        f"{num_games} games, {num_episodes} episodes of {episode_length} steps per game"
+    )
+    print(
+        "{:15}{:>20}{:>20}{:>15}".format(
+            "Buffer", "retained kB/game", "peak kB/game", "ms/game"
+        )
+    )
+    print("-" * 70)
+    for name, fill_fn in (("list", fill_list), ("columnar", fill_columnar)):
+        result = measure(fill_fn, num_games, num_episodes, episode_length)
+        print(
+            "{:15}{:>20.1f}{:>20.1f}{:>15.2f}".format(
+                name,
+                result["bytes_per_game"] / 1024,
+                result["peak_per_game"] / 1024,
+                result["seconds_per_game"] * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Memory per game of the transition buffer"
+    )
+    parser.add_argument("--num-games", type=int, default=20)
+    parser.add_argument("--num-episodes", type=int, default=4)
+    parser.add_argument("--episode-length", type=int, default=250)
+
+    args = parser.parse_args()
+    main(args.num_games, args.num_episodes, args.episode_length)
@@ -0,0 +1,319 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from gym_multiplayer_server.common.wire import WireFormat
+
+SERVER_VERSION = "1.0"
+MODES = ("pb-list", "pb-binary", "binary")
+
+
+class BenchClient:
+    """
+    Client side of the benchmark: plays num_matches matches with random actions
+    as fast as possible and records the time from sending an action to receiving
+    the next observation.
+    """
+
+    __VERSION__ = SERVER_VERSION
+
+    def __init__(self, username, password, num_matches, on_finished, seed=0):
+        self.username = username
+        self.password = password
+        self.num_matches = num_matches
+        self.on_finished = on_finished
+        self.rng = np.random.default_rng(seed)
+
+        self.network_interface = None
+        self.played_matches = 0
+        self.num_steps = 0
+        self.latencies = []
+        self.sent_at = None
+        self.error = None
+        self.finished = False
+
+    def _act(self):
+        self.sent_at = time.perf_counter()
+        self.network_interface.send_action(self.rng.uniform(-1, 1, 4))
+
+    def _finish(self):
+        if not self.finished:
+            self.finished = True
+            self.on_finished(self)
+
+    # Callbacks called by the network interface
+    def post_connection_established(self):
+        self.network_interface.start_queuing()
+
+    def waiting_for_game_to_start(self, *args, **kwargs):
+        pass
+
+    def game_starts(self, ob, info):
+        self._act()
+
+    def step(self, ob, r=None, done=None, info=None):
+        self.latencies.append(time.perf_counter() - self.sent_at)
+        self.num_steps += 1
+        self._act()
+
+    def game_done(self, ob, r, done, info, result):
+        self.played_matches += 1
+        if self.played_matches < self.num_matches:
+            self.network_interface.start_queuing()
+        else:
+            self._finish()
+
+    def game_aborted(self, msg):
+        self.error = msg
+        self._finish()
+
+    def connection_error(self, conn_err):
+        self.error = f"connection error {conn_err}"
+        self._finish()
+
+    def show_stats(self, stats):
+        pass
+
+
+def summarize(mode, clients, duration):
+    latencies = np.concatenate([c.latencies for c in clients]) * 1000
+    # Both players of a match observe every env step
+    env_steps = sum(c.num_steps for c in clients) / 2
+    return dict(
+        mode=mode,
+        num_clients=len(clients),
+        matches=sum(c.played_matches for c in clients) // 2,
+        env_steps=env_steps,
+        duration=duration,
+        steps_per_second=env_steps / duration if duration > 0 else 0.0,
+        latency_p50_ms=float(np.percentile(latencies, 50)) if len(latencies) else None,
+        latency_p99_ms=float(np.percentile(latencies, 99)) if len(latencies) else None,
+        errors=[c.error for c in clients if c.error is not None],
+    )
+
+
+def run_pb(mode, host, port, users, num_matches):
+    from twisted.internet import reactor
+
+    from gym_multiplayer_server.client.backend.network_interface import (
+        NetworkInterface,
+    )
+
+    wire_formats = [WireFormat.BINARY if mode == "pb-binary" else WireFormat.LIST]
+    clients = []
+    finished = []
+
+    def on_finished(client):
+        finished.append(client)
+        if len(finished) == len(clients):
+            reactor.stop()
+
+    for i, (username, password) in enumerate(users):
+        client = BenchClient(username, password, num_matches, on_finished, seed=i)
+        client.network_interface = NetworkInterface(
+            client=client, server=host, port=port, wire_formats=wire_formats
+        )
+        clients.append(client)
+
+    start = time.perf_counter()
+    for client in clients:
+        client.network_interface.login()
+    reactor.run()
+
+    return summarize(mode, clients, time.perf_counter() - start)
+
+
+def run_binary(mode, host, port, users, num_matches):
+    from gym_multiplayer_server.client.backend.binary_network_interface import (
+        BinaryNetworkInterface,
+    )
+
+    async def run():
+        all_finished = asyncio.Event()
+        clients = []
+        finished = []
+
+        def on_finished(client):
+            finished.append(client)
+            if len(finished) == len(clients):
+                all_finished.set()
+
+        for i, (username, password) in enumerate(users):
+            client = BenchClient(username, password, num_matches, on_finished, seed=i)
+            client.network_interface = BinaryNetworkInterface(
+                client=client, server=host, port=port
+            )
+            clients.append(client)
+
+        start = time.perf_counter()
+        for client in clients:
+            await client.network_interface.connect()
+        await all_finished.wait()
+        duration = time.perf_counter() - start
+
+        for client in clients:
+            client.network_interface.disconnect()
+
+        return summarize(mode, clients, duration)
+
+    return asyncio.run(run())
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("localhost", port), timeout=1.0):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+def start_server(working_dir, num_users, server_args):
+    users = [(f"bench{i}", f"bench{i}") for i in range(num_users)]
+    users_db = os.path.join(working_dir, "users.db")
+    with open(users_db, "w") as f:
+        f.write("".join(f"{u}:{p}\n" for u, p in users))
+
+    port, binary_port = _free_port(), _free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from gym_multiplayer_server.server.server import main, parseOptions; "
+            "main(parseOptions())",
+            "--non-interactive",
+            "--working-dir",
+            working_dir,
+            "--users-db",
+            users_db,
+            "--port",
+            str(port),
+            "--binary-port",
+            str(binary_port),
+        ]
+        + server_args,
+        stdout=subprocess.DEVNULL,
+    )
+    _wait_for_port(port)
+    _wait_for_port(binary_port)
+
+    return process, users, port, binary_port
+
+
+def main(modes, num_pairs, num_matches, output, server_args):
+    results = []
+    for mode in modes:
+        # Fresh server per mode, so that no mode profits from a warm server
+        with tempfile.TemporaryDirectory() as working_dir:
+            process, users, port, binary_port = start_server(
+                working_dir, 2 * num_pairs, server_args
+            )
+            try:
+                # Every mode runs in its own process, twisted's reactor can't be
+                # restarted and must not share the process with asyncio
+                result = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "gym_multiplayer_server.misc.bench_transport",
+                        "--run-mode",
+                        mode,
+                        "--port",
+                        str(binary_port if mode == "binary" else port),
+                        "--users",
+                        json.dumps(users),
+                        "--num-matches",
+                        str(num_matches),
+                    ],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                )
+                results.append(json.loads(result.stdout.strip().splitlines()[-1]))
+            finally:
+                process.terminate()
+                process.wait()
+
+    print(
+        "{:12}{:>10}{:>12}{:>15}{:>15}{:>15}".format(
+            "Transport", "Matches", "Env steps", "Steps/s", "p50 [ms]", "p99 [ms]"
+        )
+    )
+    print("-" * 79)
+    for r in results:
+        print(
+            "{:12}{:>10}{:>12.0f}{:>15.1f}{:>15.3f}{:>15.3f}".format(
+                r["mode"],
+                r["matches"],
+                r["env_steps"],
+                r["steps_per_second"],
+                r["latency_p50_ms"] or float("nan"),
+                r["latency_p99_ms"] or float("nan"),
+            )
+        )
+        for error in r["errors"]:
+            print(f"  error: {error}")
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare steps per second and step latency of PB and the "
+        "binary transport against a local server"
+    )
+    parser.add_argument(
+        "--modes", nargs="+", default=list(MODES), choices=MODES, help="Transports"
+    )
+    parser.add_argument("--num-pairs", type=int, default=1, help="Concurrent matches")
+    parser.add_argument(
+        "--num-matches", type=int, default=2, help="Matches played per client"
+    )
+    parser.add_argument("--output", default=None, help="Write results as json")
+    parser.add_argument(
+        "--server-args",
+        default="",
+        help="Additional arguments passed to the server, e.g. '--env-workers 2'",
+    )
+    # Used internally to run one mode in a separate process
+    parser.add_argument("--run-mode", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--users", default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.run_mode is not None:
+        run_fn = run_binary if args.run_mode == "binary" else run_pb
+        result = run_fn(
+            args.run_mode,
+            "localhost",
+            args.port,
+            [tuple(u) for u in json.loads(args.users)],
+            args.num_matches,
+        )
+        print(json.dumps(result))
+    else:
+        main(
+            args.modes,
+            args.num_pairs,
+            args.num_matches,
+            args.output,
+            args.server_args.split(),
+        )
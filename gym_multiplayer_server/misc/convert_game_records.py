@@ -0,0 +1,78 @@
+import argparse
+import os
+
+from gym_multiplayer_server.common.game_record import (
+    convert_legacy_game_archive,
+    find_legacy_game_archives,
+    find_unsealed_game_records,
+    is_game_record,
+    open_records_index,
+    seal_unsealed_game_record,
+)
+
+
+def seal_unsealed(games_path, verbose):
+    # walks all records, also finds the ones written before the index existed
+    paths = find_unsealed_game_records(games_path, scan=True)
+    print(f"Found {len(paths)} unsealed game records in {games_path}")
+    for path in paths:
+        try:
+            seal_unsealed_game_record(path, index_path=open_records_index(games_path))
+        except Exception as e:
+            print(f"Could not seal {path}: {e}")
+            continue
+        if verbose:
+            print(f"Sealed {path}")
+
+
+def main(games_path, remove, seal, verbose):
+    if seal:
+        seal_unsealed(games_path, verbose)
+
+    archives = find_legacy_game_archives(games_path)
+    print(f"Found {len(archives)} game archives in {games_path}")
+
+    num_converted = 0
+    num_failed = 0
+    for npz_path in archives:
+        record_path = os.path.splitext(npz_path)[0]
+        if is_game_record(record_path):
+            if verbose:
+                print(f"Skipping {npz_path}, already converted")
+        else:
+            try:
+                convert_legacy_game_archive(npz_path, record_path)
+            except Exception as e:
+                print(f"Could not convert {npz_path}: {e}")
+                num_failed += 1
+                continue
+            num_converted += 1
+            if verbose:
+                print(f"Converted {npz_path}")
+
+        if remove:
+            os.remove(npz_path)
+
+    print(f"Converted {num_converted} archives, {num_failed} failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert np.savez game archives into the columnar game record format"
+    )
+    parser.add_argument("--games-path", help="Path to games")
+    parser.add_argument(
+        "--remove",
+        action="store_true",
+        help="Remove the old archives after successful conversion",
+    )
+    parser.add_argument(
+        "--seal-unsealed",
+        action="store_true",
+        help="Also seal the records of matches that were running when a server "
+        "stopped, the server does this on start as well",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print more info")
+
+    args = parser.parse_args()
+    main(args.games_path, args.remove, args.seal_unsealed, args.verbose)
@@ -0,0 +1,132 @@
+import argparse
+import os
+import pathlib
+import pickle
+from glob import glob
+
+from gym_multiplayer_server.common.game_record import (
+    GameRecordError,
+    find_game_records,
+    load_game_record,
+)
+from gym_multiplayer_server.common.leaderboard import LEADERBOARD_FILE, Leaderboard
+from gym_multiplayer_server.common.state_db import STATE_DB_FILE, StateDB
+
+
+def _load_pickle(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def main(working_dir, db_path, force, verbose):
+    if db_path is None:
+        db_path = os.path.join(working_dir, STATE_DB_FILE)
+    db = StateDB(db_path)
+
+    if db.load_avatars() and not force:
+        print(f"{db_path} already contains avatars, use --force to import anyway")
+        return
+
+    avatars = []
+    avatar_games = []
+    for avatar_state_file in glob(os.path.join(working_dir, "avatars", "*.pkl")):
+        state = _load_pickle(avatar_state_file, {})
+        state["username"] = pathlib.Path(avatar_state_file).stem
+        avatars.append(state)
+        avatar_games.extend(
+            (state["username"], identifier)
+            for identifier in state.get("finished_games_ids", [])
+        )
+    print(f"Found {len(avatars)} avatars")
+
+    results = []
+    if os.path.exists(os.path.join(working_dir, LEADERBOARD_FILE)):
+        leaderboard = Leaderboard.load(os.path.join(working_dir, LEADERBOARD_FILE))
+    else:
+        leaderboard = Leaderboard.from_dict(
+            _load_pickle(os.path.join(working_dir, "leaderboard.pkl"), {})
+        )
+    pairs, pair_results = leaderboard.pairs()
+    for (i, j), result in zip(pairs.tolist(), pair_results.tolist()):
+        if any(result):
+            results.append(
+                (leaderboard.players[i], leaderboard.players[j]) + tuple(result)
+            )
+    print(f"Found {len(results)} pairwise results")
+
+    stats = []
+    pickled_stats = _load_pickle(os.path.join(working_dir, "stats.pkl"), {})
+    if isinstance(pickled_stats, dict):
+        for group, group_stats in pickled_stats.items():
+            for key, samples in group_stats.items():
+                stats.extend((group, key, t, value) for t, value in samples)
+    else:
+        # multi-resolution stats, the finest resolution is imported
+        for group, key in pickled_stats.keys():
+            buckets = pickled_stats.query(
+                group, key, resolution=pickled_stats.resolutions[0][0]
+            )
+            stats.extend(
+                (group, key, float(t), float(value))
+                for t, value in zip(buckets["time"], buckets["mean"])
+            )
+    print(f"Found {len(stats)} stats samples")
+
+    games = []
+    for record_path in find_game_records(os.path.join(working_dir, "games")):
+        try:
+            record = load_game_record(record_path)
+        except GameRecordError as e:
+            print(f"Skipping {record_path}: {e}")
+            continue
+        # aborted games did not count
+        if record.meta.get("aborted"):
+            continue
+        games.append(
+            dict(
+                identifier=record.identifier,
+                player_one=record.player_one,
+                player_two=record.player_two,
+                timestamp=record.timestamp,
+                game_outcomes=record.game_outcomes,
+                path=record_path,
+            )
+        )
+        if verbose:
+            print(f"Found game {record.identifier}")
+    print(f"Found {len(games)} finished games")
+
+    misc = _load_pickle(os.path.join(working_dir, "misc.pkl"), {})
+
+    db.write(
+        avatars=avatars,
+        avatar_games=avatar_games,
+        results=results,
+        stats=stats,
+        games=games,
+        misc=misc,
+    )
+    db.close()
+    print(f"Imported the server state into {db_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="One-shot import of the pickled server state into the SQLite "
+        "state store (run the server with --state-store sqlite afterwards)"
+    )
+    parser.add_argument("--working-dir", help="Working dir of the server")
+    parser.add_argument(
+        "--db-path", default=None, help="Database to write, defaults to working dir"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Import even if the database already contains avatars",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print more info")
+
+    args = parser.parse_args()
+    main(args.working_dir, args.db_path, args.force, args.verbose)
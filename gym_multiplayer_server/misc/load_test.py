@@ -0,0 +1,387 @@
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from gym_multiplayer_server.client.remoteControllerInterface import (
+    RemoteControllerInterface,
+)
+from gym_multiplayer_server.common.wire import WireFormat
+from gym_multiplayer_server.misc.bench_transport import SERVER_VERSION, start_server
+
+PERCENTILES = (50, 95, 99)
+
+
+class RandomController(RemoteControllerInterface):
+    def __init__(self, seed=0):
+        super().__init__(identifier="LoadTestRandom")
+        self.rng = np.random.default_rng(seed)
+
+    def remote_act(self, obs):
+        return self.rng.uniform(-1, 1, 4)
+
+
+class LoadClient:
+    """
+    Simulated player: queues, answers every observation with the action of its
+    controller after think_time seconds and queues again after every match
+    until the end of the run.
+    """
+
+    __VERSION__ = SERVER_VERSION
+
+    def __init__(self, username, password, controller, think_time):
+        self.username = username
+        self.password = password
+        self.controller = controller
+        self.think_time = think_time
+
+        self.network_interface = None
+        self.queued_at = None
+        self.sent_at = None
+
+        self.matches = 0
+        self.aborted = 0
+        self.observations = 0
+        self.queue_waits = []
+        self.rtts = []
+        self.error = None
+        # cleared at the end of the run, lost connections are expected then
+        self.running = True
+
+    def _queue(self):
+        self.queued_at = time.perf_counter()
+        self.network_interface.start_queuing()
+
+    def _act(self, ob):
+        action = self.controller.remote_act(np.asarray(ob))
+        if self.think_time > 0:
+            from twisted.internet import reactor
+
+            reactor.callLater(self.think_time, self._send, action)
+        else:
+            self._send(action)
+
+    def _send(self, action):
+        self.sent_at = time.perf_counter()
+        self.network_interface.send_action(action)
+
+    # Callbacks called by the network interface
+    def post_connection_established(self):
+        self._queue()
+
+    def waiting_for_game_to_start(self, *args, **kwargs):
+        pass
+
+    def game_starts(self, ob, info):
+        self.queue_waits.append(time.perf_counter() - self.queued_at)
+        self.controller.before_game_starts()
+        self._act(ob)
+
+    def step(self, ob, r=None, done=None, info=None):
+        # the think time is not part of the round trip
+        self.rtts.append(time.perf_counter() - self.sent_at)
+        self.observations += 1
+        self._act(ob)
+
+    def game_done(self, ob, r, done, info, result):
+        self.matches += 1
+        self.controller.after_game_ends()
+        self._queue()
+
+    def game_aborted(self, msg):
+        self.aborted += 1
+        self._queue()
+
+    def connection_error(self, conn_err):
+        if self.running:
+            self.error = f"connection error {conn_err}"
+
+    def show_stats(self, stats):
+        pass
+
+
+def run_worker(port, users, think_time, duration, seed, wire_format):
+    """
+    Runs the clients of one worker process for duration seconds and returns
+    their raw measurements
+    """
+    from twisted.internet import reactor
+
+    from gym_multiplayer_server.client.backend.network_interface import (
+        NetworkInterface,
+        NetworkInterfaceState,
+    )
+
+    class WorkerNetworkInterface(NetworkInterface):
+        """
+        Drops only its own connection on errors, the NetworkInterface of the
+        client stops the reactor and with it all clients of the worker
+        """
+
+        def disconnect(self):
+            self.factory.disconnect()
+            self.state = NetworkInterfaceState.DISCONNECTED
+
+    clients = []
+    for i, (username, password) in enumerate(users):
+        client = LoadClient(
+            username, password, RandomController(seed=seed + i), think_time
+        )
+        client.network_interface = WorkerNetworkInterface(
+            client=client, server="localhost", port=port, wire_formats=[wire_format]
+        )
+        clients.append(client)
+
+    def stop():
+        for client in clients:
+            client.running = False
+        reactor.stop()
+
+    for client in clients:
+        client.network_interface.login()
+    reactor.callLater(duration, stop)
+    reactor.run()
+
+    return dict(
+        matches=sum(c.matches for c in clients),
+        aborted=sum(c.aborted for c in clients),
+        observations=sum(c.observations for c in clients),
+        queue_waits=[w for c in clients for w in c.queue_waits],
+        rtts=[rtt for c in clients for rtt in c.rtts],
+        errors=[c.error for c in clients if c.error is not None],
+    )
+
+
+def _percentiles(values, prefix):
+    values = np.asarray(values) * 1000
+    return {
+        f"{prefix}_p{p}_ms": float(np.percentile(values, p)) if len(values) else None
+        for p in PERCENTILES
+    }
+
+
+def summarize(workers, num_clients, duration):
+    matches = sum(w["matches"] for w in workers) / 2
+    # both players of a match observe every env step
+    env_steps = sum(w["observations"] for w in workers) / 2
+    queue_waits = np.concatenate([w["queue_waits"] for w in workers] + [[]])
+    rtts = np.concatenate([w["rtts"] for w in workers] + [[]])
+
+    summary = dict(
+        num_clients=num_clients,
+        duration=duration,
+        matches=matches,
+        aborted_matches=sum(w["aborted"] for w in workers) / 2,
+        matches_per_minute=matches / duration * 60,
+        env_steps=env_steps,
+        steps_per_second=env_steps / duration,
+        queue_wait_mean_ms=(
+            float(queue_waits.mean() * 1000) if len(queue_waits) else None
+        ),
+    )
+    summary.update(_percentiles(queue_waits, "queue_wait"))
+    summary.update(_percentiles(rtts, "rtt"))
+    summary["errors"] = [e for w in workers for e in w["errors"]]
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    keys = [
+        "matches_per_minute",
+        "steps_per_second",
+        "queue_wait_mean_ms",
+        "queue_wait_p50_ms",
+        "queue_wait_p95_ms",
+        "rtt_p50_ms",
+        "rtt_p95_ms",
+        "rtt_p99_ms",
+    ]
+    header = "{:22}{:>15}".format("Metric", "Value")
+    if baseline is not None:
+        header += "{:>15}{:>10}".format("Baseline", "Change")
+    print(header)
+    print("-" * len(header))
+    for key in keys:
+        value = summary[key]
+        line = "{:22}{:>15.3f}".format(
+            key, value if value is not None else float("nan")
+        )
+        if baseline is not None:
+            base = baseline["results"].get(key)
+            change = (
+                f"{(value - base) / base * 100:+.1f}%"
+                if value is not None and base
+                else ""
+            )
+            line += "{:>15.3f}{:>10}".format(
+                base if base is not None else float("nan"), change
+            )
+        print(line)
+    print(
+        f"{summary['matches']:.0f} matches ({summary['aborted_matches']:.0f} aborted) "
+        f"of {summary['num_clients']} clients in {summary['duration']:.0f}s"
+    )
+    for error in summary["errors"][:10]:
+        print(f"  error: {error}")
+
+
+def run_load_test(
+    num_clients, num_workers, think_time, duration, wire_format, server_args
+):
+    """
+    Starts a server with server_args, runs the clients in num_workers processes
+    and returns the summary of their measurements
+    """
+    with tempfile.TemporaryDirectory() as working_dir:
+        process, users, port, _ = start_server(working_dir, num_clients, server_args)
+        try:
+            # one reactor per process, the clients are spread round robin
+            workers = []
+            for i in range(num_workers):
+                workers.append(
+                    subprocess.Popen(
+                        [
+                            sys.executable,
+                            "-m",
+                            "gym_multiplayer_server.misc.load_test",
+                            "--run-worker",
+                            "--port",
+                            str(port),
+                            "--users",
+                            json.dumps(users[i::num_workers]),
+                            "--think-time",
+                            str(think_time),
+                            "--duration",
+                            str(duration),
+                            "--seed",
+                            str(i * num_clients),
+                            "--wire-format",
+                            wire_format,
+                        ],
+                        stdout=subprocess.PIPE,
+                        text=True,
+                    )
+                )
+            results = []
+            for worker in workers:
+                stdout, _ = worker.communicate()
+                if worker.returncode != 0:
+                    raise RuntimeError(f"Worker failed with code {worker.returncode}")
+                results.append(json.loads(stdout.strip().splitlines()[-1]))
+        finally:
+            process.terminate()
+            process.wait()
+
+    return summarize(results, num_clients, duration)
+
+
+def main(
+    num_clients,
+    num_workers,
+    think_time,
+    duration,
+    wire_format,
+    output,
+    baseline,
+    server_args,
+):
+    num_clients += num_clients % 2
+    summary = run_load_test(
+        num_clients, num_workers, think_time, duration, wire_format, server_args
+    )
+    if baseline is not None:
+        with open(baseline) as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(
+                dict(
+                    config=dict(
+                        num_clients=num_clients,
+                        num_workers=num_workers,
+                        think_time=think_time,
+                        duration=duration,
+                        wire_format=wire_format,
+                        server_args=server_args,
+                    ),
+                    results=summary,
+                ),
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test: simulated clients with random controllers play "
+        "against a local server, reports matches/min, env steps/s, queue wait and "
+        "action round-trip times"
+    )
+    parser.add_argument(
+        "--num-clients", type=int, default=100, help="Number of simulated clients"
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=4,
+        help="Number of client processes the clients are spread over",
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="Seconds a client waits before answering an observation",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60.0, help="Length of the run in seconds"
+    )
+    parser.add_argument(
+        "--wire-format",
+        default=WireFormat.LIST,
+        choices=[WireFormat.LIST, WireFormat.BINARY],
+        help="Wire format the clients ask for",
+    )
+    parser.add_argument("--output", default=None, help="Write results as json")
+    parser.add_argument(
+        "--baseline", default=None, help="Json results of an earlier run to compare to"
+    )
+    parser.add_argument(
+        "--server-args",
+        default="",
+        help="Additional arguments passed to the server, e.g. '--env-workers 2'",
+    )
+    # Used internally to run the clients of one worker process
+    parser.add_argument("--run-worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--users", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=int, default=0, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.run_worker:
+        result = run_worker(
+            args.port,
+            [tuple(u) for u in json.loads(args.users)],
+            args.think_time,
+            args.duration,
+            args.seed,
+            args.wire_format,
+        )
+        print(json.dumps(result))
+    else:
+        main(
+            args.num_clients,
+            args.num_workers,
+            args.think_time,
+            args.duration,
+            args.wire_format,
+            args.output,
+            args.baseline,
+            args.server_args.split(),
+        )
@@ -0,0 +1,182 @@
+import argparse
+import os
+import pathlib
+import pickle
+import time
+from glob import glob
+
+import trueskill
+
+from gym_multiplayer_server.common.game_record import (
+    GameRecordError,
+    find_game_records,
+    load_game_record,
+)
+from gym_multiplayer_server.common.state_db import STATE_DB_FILE, StateDB
+from gym_multiplayer_server.server.persistence import atomic_pickle_dump
+from gym_multiplayer_server.server.rating import recompute_ratings
+from gym_multiplayer_server.server.state_store import StateStores
+
+
+def load_games_from_records(working_dir, verbose):
+    games = []
+    for record_path in find_game_records(os.path.join(working_dir, "games")):
+        try:
+            record = load_game_record(record_path)
+        except GameRecordError as e:
+            print(f"Skipping {record_path}: {e}")
+            continue
+        # aborted games did not count
+        if record.meta.get("aborted"):
+            continue
+        games.append(
+            dict(
+                identifier=record.identifier,
+                player_one=record.player_one,
+                player_two=record.player_two,
+                timestamp=record.timestamp,
+                game_outcomes=record.game_outcomes,
+            )
+        )
+        if verbose:
+            print(f"Found game {record.identifier}")
+    games.sort(key=lambda game: (game["timestamp"], game["identifier"]))
+    return games
+
+
+def fill_outcomes_from_records(games):
+    """
+    Games imported without outcomes get them from their game record, if it can
+    still be found
+    """
+    for game in games:
+        if game["game_outcomes"] is None and game.get("path"):
+            try:
+                game["game_outcomes"] = load_game_record(game["path"]).game_outcomes
+            except GameRecordError as e:
+                print(f"Could not read {game['path']}: {e}")
+
+
+def write_pickle_state(working_dir, ratings):
+    ranking = {}
+    for avatar_state_file in glob(os.path.join(working_dir, "avatars", "*.pkl")):
+        username = pathlib.Path(avatar_state_file).stem
+        with open(avatar_state_file, "rb") as f:
+            state = pickle.load(f)
+        state["rating_mu"], state["rating_sigma"] = ratings[username]
+        atomic_pickle_dump(state, avatar_state_file)
+        ranking[username.encode("utf-8")] = ratings[username]
+    atomic_pickle_dump(ranking, os.path.join(working_dir, "trueskill-ranking.pkl"))
+    return len(ranking)
+
+
+def print_changes(old_ratings, ratings, top):
+    changes = sorted(
+        (
+            (abs(mu - old_ratings[username][0]), username, old_ratings[username], mu)
+            for username, (mu, _) in ratings.items()
+            if username in old_ratings
+        ),
+        reverse=True,
+    )
+    for change, username, (old_mu, old_sigma), mu in changes[:top]:
+        print(f"{username}: mu {old_mu:.3f} -> {mu:.3f} ({change:.3f})")
+
+
+def main(working_dir, state_store, dry_run, top, verbose):
+    db = None
+    if state_store == StateStores.SQLITE:
+        db = StateDB(os.path.join(working_dir, STATE_DB_FILE))
+        games = db.games()
+        fill_outcomes_from_records(games)
+        old_ratings = {username: (mu, sigma) for username, mu, sigma in db.ranking()}
+    else:
+        games = load_games_from_records(working_dir, verbose)
+        old_ratings = {}
+        for avatar_state_file in glob(os.path.join(working_dir, "avatars", "*.pkl")):
+            with open(avatar_state_file, "rb") as f:
+                state = pickle.load(f)
+            old_ratings[pathlib.Path(avatar_state_file).stem] = (
+                state["rating_mu"],
+                state["rating_sigma"],
+            )
+    print(f"Found {len(games)} finished games and {len(old_ratings)} avatars")
+
+    # the ratings of players with games of unknown outcome can not be recomputed,
+    # they keep their current rating
+    unknown = [game for game in games if game["game_outcomes"] is None]
+    kept = {game[p] for game in unknown for p in ("player_one", "player_two")}
+    if unknown:
+        print(
+            f"WARNING: {len(unknown)} games have no outcomes, the ratings of "
+            f"{len(kept)} players are kept: {', '.join(sorted(kept))}"
+        )
+        games = [game for game in games if game["game_outcomes"] is not None]
+
+    start = time.time()
+    usernames, mu, sigma, rating_history = recompute_ratings(games)
+    print(
+        f"Recomputed the ratings of {len(usernames)} players in "
+        f"{time.time() - start:.2f}s"
+    )
+
+    # avatars without finished games start from scratch
+    env = trueskill.global_env()
+    ratings = {username: (env.mu, env.sigma) for username in old_ratings}
+    ratings.update(zip(usernames, zip(mu.tolist(), sigma.tolist())))
+    ratings.update(
+        {
+            username: old_ratings[username]
+            for username in kept
+            if username in old_ratings
+        }
+    )
+    rating_history = [entry for entry in rating_history if entry[0] not in kept]
+
+    if verbose or dry_run:
+        print_changes(old_ratings, ratings, top)
+    if dry_run:
+        return
+
+    if db is not None:
+        db.replace_ratings(
+            [
+                (username, mu, sigma)
+                for username, (mu, sigma) in ratings.items()
+                if username not in kept
+            ],
+            rating_history,
+        )
+        db.close()
+        print(f"Wrote {len(ratings)} ratings and {len(rating_history)} history entries")
+    else:
+        num_avatars = write_pickle_state(working_dir, ratings)
+        print(f"Wrote {num_avatars} avatars")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recomputes all TrueSkill ratings from the finished games in "
+        "chronological order and writes them into the state store. Stop the "
+        "server first, it would overwrite the ratings with the ones it holds."
+    )
+    parser.add_argument("--working-dir", help="Working dir of the server")
+    parser.add_argument(
+        "--state-store",
+        default=StateStores.PICKLE,
+        choices=[StateStores.PICKLE, StateStores.SQLITE],
+        help="State store of the server, with pickle the games are read from the "
+        "game records",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print the largest rating changes, do not write anything",
+    )
+    parser.add_argument(
+        "--top", type=int, default=20, help="Number of rating changes to print"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print more info")
+
+    args = parser.parse_args()
+    main(args.working_dir, args.state_store, args.dry_run, args.top, args.verbose)
@@ -12,6 +12,14 @@ import pandas
 
 from laserhockey.hockey_env import HockeyEnv, FPS, CENTER_X, CENTER_Y
 
+from gym_multiplayer_server.common.game_record import (
+    columns_from_transitions,
+    find_game_records,
+    find_legacy_game_archives,
+    load_game_record,
+)
+from gym_multiplayer_server.common.state_db import GAME_COLUMNS, StateDB
+
 
 def set_env_state_from_observation(env, observation):
     env.player1.position = (observation[[0, 1]] + [CENTER_X, CENTER_Y]).tolist()
@@ -39,44 +47,67 @@ def setup_video(output_path, id, fps):
     )
 
 
-def main(games_path, games_db_path, id, record, render, output_path, verbose, players):
+def load_match(games_path, identifier):
+    record_paths = find_game_records(games_path, identifier)
+    if record_paths:
+        record = load_game_record(record_paths[0])
+        match = dict(record.meta)
+        match.update({field: record[field] for field in ("last_ob", "done", "winner")})
+        return match
 
-    if players is not None:
-        players = ast.literal_eval(players)
+    # matches stored before the game record format was introduced
+    match_path = find_legacy_game_archives(games_path, identifier)[0]
+    match = np.load(match_path, allow_pickle=True)["arr_0"].item()
+    columns, _ = columns_from_transitions(match.pop("transitions"))
+    match.update(columns)
+    return match
 
-    env = HockeyEnv()
 
-    selected_matches = pandas.read_csv(games_db_path)
+def load_games_db(games_db_path):
+    if games_db_path.endswith(".db"):
+        # SQLite state store of the server
+        state_db = StateDB(games_db_path, readonly=True)
+        games = pandas.DataFrame(state_db.games(), columns=list(GAME_COLUMNS))
+        state_db.close()
+        return games
+    return pandas.read_csv(games_db_path)
 
-    matches_path = glob(os.path.join(games_path, "**", "*.npz"), recursive=True)
 
+def select_matches(matches, id, players):
     if players is not None:
-        selected_matches = selected_matches[
+        matches = matches[
             (
-                (selected_matches["player_one"] == players[0])
-                & (selected_matches["player_two"] == players[1])
+                (matches["player_one"] == players[0])
+                & (matches["player_two"] == players[1])
             )
             | (
-                (selected_matches["player_one"] == players[1])
-                & (selected_matches["player_two"] == players[0])
+                (matches["player_one"] == players[1])
+                & (matches["player_two"] == players[0])
             )
         ]
-    if not id is None:
-        selected_matches = selected_matches[selected_matches["identifier"] == id]
+    if id is not None:
+        matches = matches[matches["identifier"] == id]
     if players is None and id is None:
-        selected_matches = selected_matches.drop_duplicates(
+        matches = matches.drop_duplicates(
             subset=["player_one", "player_two"], keep="last"
         )
+    return matches
+
+
+def main(games_path, games_db_path, id, record, render, output_path, verbose, players):
+
+    if players is not None:
+        players = ast.literal_eval(players)
+
+    env = HockeyEnv()
+
+    selected_matches = select_matches(load_games_db(games_db_path), id, players)
 
     print(selected_matches)
 
     for index, selected_match in selected_matches.iterrows():
 
-        match_path = glob(
-            os.path.join(games_path, "**", f'{selected_match["identifier"]}.npz'),
-            recursive=True,
-        )[0]
-        match = np.load(match_path, allow_pickle=True)["arr_0"].item()
+        match = load_match(games_path, selected_match["identifier"])
 
         if verbose:
             print("Match id: ", match["identifier"])
@@ -102,20 +133,22 @@ def main(games_path, games_db_path, id, record, render, output_path, verbose, pl
 
         player_one_score = 0
         player_two_score = 0
-        for transition in match["transitions"]:
-            set_env_state_from_observation(env, np.asfarray(transition[0]))
+        for last_ob, done, winner in zip(
+            match["last_ob"], match["done"], match["winner"]
+        ):
+            set_env_state_from_observation(env, np.asarray(last_ob, dtype=np.float64))
 
-            if transition[4]:
-                if transition[5]["winner"] == 1:
+            if done:
+                if winner == 1:
                     player_one_score += 1
-                if transition[5]["winner"] == -1:
+                if winner == -1:
                     player_two_score += 1
 
             if verbose:
-                if transition[4]:
-                    if transition[5]["winner"] == 0:
+                if done:
+                    if winner == 0:
                         print("Game end in a draw")
-                    elif transition[5]["winner"] == 1:
+                    elif winner == 1:
                         print(f'{match["player_one"]} scored.')
                     else:
                         print(f'{match["player_two"]} scored.')
@@ -157,7 +190,9 @@ def main(games_path, games_db_path, id, record, render, output_path, verbose, pl
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--games-path", help="Path to games")
-    parser.add_argument("--games-db-path", help="Path to games db")
+    parser.add_argument(
+        "--games-db-path", help="Path to games db (csv or the server's state.db)"
+    )
     parser.add_argument(
         "--record", action="store_true", help="Whether to record video or not"
     )
@@ -0,0 +1,217 @@
+import time
+
+import numpy as np
+from twisted.internet import task, threads
+from twisted.python import log
+
+from gym_multiplayer_server.server.game import GameStates
+from gym_multiplayer_server.server.matchmaking import (
+    is_basic_opponent,
+    match_qualities,
+    waiting_time_bonus,
+)
+
+
+class BatchMatchmaker:
+    """
+    Alternative to matching a client the moment it starts queuing. Every interval
+    seconds all waiting players are paired at once: the match quality plus
+    waiting time bonus of every pair is computed as one matrix and the pairs are
+    picked greedily by descending weight, an approximation of a max-weight
+    matching that is within a factor of two of the optimum. The pairing runs in
+    a thread pool thread, it takes too long for the reactor with thousands of
+    waiting players.
+
+    Only the candidates_per_player opponents closest in rating are considered for
+    every player and the matrix is computed in blocks of block_size rows, which
+    keeps time and memory manageable with thousands of waiting players.
+    """
+
+    def __init__(self, server, interval, candidates_per_player=16, block_size=1024):
+        self.server = server
+        self.interval = interval
+        self.candidates_per_player = candidates_per_player
+        self.block_size = block_size
+
+        self.num_matches = 0
+        self.window_start = time.time()
+        self.window_matches = 0
+        self.qualities = []
+        self.waiting_times = []
+        self.durations = []
+
+        self.loop = task.LoopingCall(self.match)
+        self.loop.start(self.interval, now=False)
+
+    def _candidate_edges(self, mu, sigma, bonus, avatar_ids, basic):
+        """
+        Returns (i, j, weight, quality) of the candidate pairs, ordered by
+        descending weight
+        """
+        n = len(mu)
+        k = min(self.candidates_per_player, n - 1)
+        edges = []
+        for start in range(0, n, self.block_size):
+            rows = slice(start, min(start + self.block_size, n))
+
+            q = match_qualities(mu[rows, None], sigma[rows, None], mu, sigma)
+            # no games against yourself (incl. the diagonal), not strong against weak
+            same_avatar = avatar_ids[rows, None] == avatar_ids
+            q[same_avatar | (basic[rows, None] & basic)] = -np.inf
+            w = q + np.maximum(bonus[rows, None], bonus)
+
+            # Candidates are the players closest in mu. Choosing them by weight
+            # or quality would make every player pick the same few long waiting
+            # or low sigma players and leave most players unmatched.
+            distance = np.abs(mu[rows, None] - mu)
+            distance[~np.isfinite(q)] = np.inf
+            cols = np.argpartition(distance, k - 1, axis=1)[:, :k].ravel()
+            block_rows = np.repeat(np.arange(rows.stop - rows.start), k)
+            edges.append(
+                (block_rows + start, cols, w[block_rows, cols], q[block_rows, cols])
+            )
+
+        i, j, w, q = (np.concatenate(column) for column in zip(*edges))
+        valid = np.isfinite(w)
+        order = np.argsort(-w[valid], kind="stable")
+        return i[valid][order], j[valid][order], q[valid][order]
+
+    @staticmethod
+    def _ratings(games, now):
+        """
+        Copies everything the pairing needs out of the games into arrays
+        """
+        avatars = [g.clients[0].avatar for g in games]
+
+        mu = np.array([a.rating.mu for a in avatars], dtype=np.float32)
+        sigma = np.array([a.rating.sigma for a in avatars], dtype=np.float32)
+        bonus = waiting_time_bonus(
+            now - np.array([g.last_op_timestamp for g in games])
+        ).astype(np.float32)
+
+        avatar_idx = {}
+        avatar_ids = np.array(
+            [avatar_idx.setdefault(a, len(avatar_idx)) for a in avatars]
+        )
+        basic = np.array([is_basic_opponent(a) for a in avatars])
+        return mu, sigma, bonus, avatar_ids, basic
+
+    def _pair_ratings(self, mu, sigma, bonus, avatar_ids, basic):
+        """
+        Returns (i, j, quality) for every pair matched, only works on the arrays
+        so that it can run outside of the reactor thread
+        """
+        # Players with a low sigma are the best candidates of many players, so the
+        # greedy matching is repeated for the players left unmatched by a round
+        pairs = []
+        active = np.arange(len(mu))
+        while len(active) > 1:
+            edges_i, edges_j, edges_q = self._candidate_edges(
+                mu[active],
+                sigma[active],
+                bonus[active],
+                avatar_ids[active],
+                basic[active],
+            )
+
+            matched = np.zeros(len(active), dtype=bool)
+            num_pairs = len(pairs)
+            for i, j, q in zip(edges_i.tolist(), edges_j.tolist(), edges_q.tolist()):
+                if matched[i] or matched[j]:
+                    continue
+                matched[i] = matched[j] = True
+                pairs.append((int(active[i]), int(active[j]), q))
+
+            if len(pairs) == num_pairs:
+                break
+            active = active[~matched]
+
+        return pairs
+
+    def _pair(self, games, now):
+        """
+        Returns (i, j, quality) for every pair of games matched
+        """
+        return self._pair_ratings(*self._ratings(games, now))
+
+    def match(self):
+        """
+        Pairs the waiting games in a thread pool thread, the reactor only copies
+        the ratings and applies the pairs. The LoopingCall waits for the returned
+        Deferred, so rounds never overlap.
+        """
+        games = self.server.game_registry.snapshot(GameStates.WAITING_FOR_PLAYER)
+        if len(games) < 2:
+            return
+
+        now = time.time()
+        d = threads.deferToThread(self._pair_ratings, *self._ratings(games, now))
+        # starting thousands of games takes a while as well, the cooperator
+        # spreads it over several reactor iterations
+        d.addCallback(
+            lambda pairs: task.coiterate(self._start_games(pairs, games, now))
+        )
+        d.addErrback(log.err, "Batch matchmaking failed")
+        return d
+
+    def _start_games(self, pairs, games, now):
+        """
+        Starts the games of the pairs, yields after every game
+        """
+        for i, j, quality in pairs:
+            # the player waiting longer hosts the game
+            host, other = games[i], games[j]
+            if other.last_op_timestamp < host.last_op_timestamp:
+                host, other = other, host
+            # games may have been aborted or joined while pairing
+            if not (self._waiting(host) and self._waiting(other)):
+                continue
+
+            self.waiting_times.append(now - host.last_op_timestamp)
+            self.waiting_times.append(now - other.last_op_timestamp)
+            self.qualities.append(quality)
+
+            client = other.clients[0]
+            other._close()
+            client.game = host
+            host.add_player(client)
+            self.num_matches += 1
+            self.window_matches += 1
+            yield
+
+        self.durations.append(time.time() - now)
+
+    @staticmethod
+    def _waiting(game):
+        return game.state == GameStates.WAITING_FOR_PLAYER and not game.closed
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def get_stats(self):
+        """
+        Returns the matchmaking metrics since the last call and starts a new window
+        """
+        now = time.time()
+        window, self.window_start = now - self.window_start, now
+        window_matches, self.window_matches = self.window_matches, 0
+        qualities, self.qualities = self.qualities, []
+        waiting_times, self.waiting_times = self.waiting_times, []
+        durations, self.durations = self.durations, []
+
+        if waiting_times:
+            wait_p50, wait_p90, wait_p99 = np.percentile(waiting_times, [50, 90, 99])
+        else:
+            wait_p50 = wait_p90 = wait_p99 = 0.0
+
+        return dict(
+            matches=self.num_matches,
+            matches_per_second=window_matches / window if window > 0 else 0.0,
+            mean_quality=float(np.mean(qualities)) if qualities else 0.0,
+            waiting_time_p50=float(wait_p50),
+            waiting_time_p90=float(wait_p90),
+            waiting_time_p99=float(wait_p99),
+            mean_duration=float(np.mean(durations)) if durations else 0.0,
+            max_duration=float(np.max(durations)) if durations else 0.0,
+        )
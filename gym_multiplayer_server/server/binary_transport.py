@@ -0,0 +1,221 @@
+import hmac
+import os
+
+from twisted.cred import credentials, error as cred_error
+from twisted.internet import defer, protocol
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python import log
+from twisted.spread import pb
+from zope.interface import implementer
+
+from gym_multiplayer_server.common.binary_protocol import (
+    MAX_FRAME_LENGTH,
+    BinaryProtocolError,
+    Op,
+    decode_message,
+    encode_game_aborted,
+    encode_game_done,
+    encode_game_starts,
+    encode_message,
+    encode_receive_observation,
+    login_response,
+    pack_json,
+    unpack_json,
+)
+from gym_multiplayer_server.common.wire import WireFormat
+
+CHALLENGE_SIZE = 32
+
+
+@implementer(credentials.IUsernameHashedPassword)
+class ChallengeResponse:
+    """
+    Credentials of a binary login, checked against the plaintext password of
+    the checker like the challenge of PB's _PortalAuthChallenger
+    """
+
+    def __init__(self, username, challenge, response):
+        self.username = username
+        self.challenge = challenge
+        self.response = response
+
+    def checkPassword(self, password):
+        return hmac.compare_digest(
+            login_response(self.challenge, password), self.response
+        )
+
+
+class BinaryMind:
+    """
+    Stands in for the PB mind of a client connected through the binary
+    transport. The server side Client issues its callRemote calls on it, they are
+    encoded into frames and written to the connection.
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        # Client and Avatar identify the connection of a mind by its broker
+        self.broker = protocol
+
+    _encoders = {
+        "game_starts": encode_game_starts,
+        "receive_observation": encode_receive_observation,
+        "game_done": encode_game_done,
+        "game_aborted": encode_game_aborted,
+    }
+
+    def callRemote(self, name, **kwargs):
+        if self.protocol.disconnected:
+            raise pb.DeadReferenceError("Calling Stale Broker")
+
+        try:
+            message = self._encoders[name](**kwargs)
+        except KeyError:
+            return defer.fail(BinaryProtocolError(f"Unknown remote method {name}"))
+
+        self.protocol.sendString(message)
+        return defer.succeed(None)
+
+
+class BinaryServerProtocol(Int32StringReceiver):
+    """
+    Length-prefixed binary protocol exposing the operations of the server side
+    Client (start_queuing, stop_queueing, receive_action, request_stats) next
+    to Perspective Broker. Logins answer a challenge of the server, passwords
+    are never sent.
+    """
+
+    MAX_LENGTH = MAX_FRAME_LENGTH
+
+    def __init__(self, portal, server_version):
+        self.portal = portal
+        self.server_version = server_version
+        self.mind = BinaryMind(self)
+        self.client = None
+        self.logout = None
+        self.username = None
+        self.challenge = None
+        self.disconnected = False
+        self.disconnects = []
+
+    def connectionMade(self):
+        # see NoDelayBroker in server.py
+        self.transport.setTcpNoDelay(True)
+
+    def stringReceived(self, data):
+        try:
+            op, payload = decode_message(data)
+            if op == Op.LOGIN:
+                self._login(payload)
+                return
+            if op == Op.LOGIN_RESPONSE:
+                self._login_response(payload)
+                return
+
+            if self.client is None:
+                raise BinaryProtocolError("Not logged in")
+
+            if op == Op.RECEIVE_ACTION:
+                self.client.remote_receive_action(payload)
+            elif op == Op.START_QUEUING:
+                # optional json payload carrying the queuing options
+                options = unpack_json(payload) if payload else {}
+                self.client.remote_start_queuing(**options)
+                self.sendString(encode_message(Op.QUEUING))
+            elif op == Op.STOP_QUEUEING:
+                self.client.remote_stop_queueing()
+            elif op == Op.REQUEST_STATS:
+                stats = self.client.remote_request_stats()
+                self.sendString(encode_message(Op.STATS, pack_json(stats)))
+            else:
+                raise BinaryProtocolError(f"Unknown operation {op}")
+        except Exception as e:
+            self.sendString(
+                encode_message(Op.ERROR, f"{type(e).__name__}: {e}".encode("utf-8"))
+            )
+
+    def _login(self, payload):
+        if self.client is not None:
+            raise BinaryProtocolError("Already logged in")
+
+        login = unpack_json(payload)
+        if login.get("client_version") != self.server_version:
+            self.sendString(
+                encode_message(
+                    Op.LOGIN_FAILED,
+                    f"Client vers. {login.get('client_version')} and server vers."
+                    f"{self.server_version} incompatible, please update".encode(
+                        "utf-8"
+                    ),
+                )
+            )
+            return
+
+        self.username = login["username"].encode("utf-8")
+        self.challenge = os.urandom(CHALLENGE_SIZE)
+        self.sendString(encode_message(Op.LOGIN_CHALLENGE, self.challenge))
+
+    def _login_response(self, payload):
+        if self.challenge is None:
+            raise BinaryProtocolError("No login challenge pending")
+
+        # a challenge is answered only once
+        challenge, self.challenge = self.challenge, None
+        d = self.portal.login(
+            ChallengeResponse(self.username, challenge, payload),
+            self.mind,
+            pb.IPerspective,
+        )
+        d.addCallbacks(self._logged_in, self._login_failed)
+
+    def _logged_in(self, result):
+        _, avatar, self.logout = result
+        if self.disconnected:
+            self.logout()
+            return
+
+        self.client = avatar._client_for_mind(self.mind)
+        self.client.wire_format = WireFormat.BINARY
+        self.sendString(
+            encode_message(
+                Op.LOGIN_OK, pack_json({"server_version": self.server_version})
+            )
+        )
+
+    def _login_failed(self, failure):
+        if failure.check(cred_error.UnauthorizedLogin, cred_error.UnhandledCredentials):
+            msg = "Username or password not known."
+        else:
+            msg = failure.getErrorMessage()
+        self.sendString(encode_message(Op.LOGIN_FAILED, msg.encode("utf-8")))
+
+    # Same interface as pb.Broker, so Client can watch both kinds of connections
+    def notifyOnDisconnect(self, notifier):
+        self.disconnects.append(notifier)
+
+    def dontNotifyOnDisconnect(self, notifier):
+        if notifier in self.disconnects:
+            self.disconnects.remove(notifier)
+
+    def connectionLost(self, reason=protocol.connectionDone):
+        self.disconnected = True
+        for notifier in self.disconnects[:]:
+            try:
+                notifier()
+            except Exception:
+                log.err()
+        self.disconnects = []
+        if self.logout is not None:
+            logout, self.logout = self.logout, None
+            logout()
+
+
+class BinaryServerFactory(protocol.ServerFactory):
+    def __init__(self, portal, server_version):
+        self.portal = portal
+        self.server_version = server_version
+
+    def buildProtocol(self, addr):
+        p = BinaryServerProtocol(self.portal, self.server_version)
+        p.factory = self
+        return p
@@ -0,0 +1,402 @@
+import multiprocessing
+import signal
+from itertools import count
+
+import gym
+import numpy as np
+import laserhockey.hockey_env  # registers Hockey-v0
+from twisted.internet import defer, reactor
+from twisted.internet.interfaces import IReadDescriptor
+from zope.interface import implementer
+
+ENV_ID = "Hockey-v0"
+
+
+class EnvOp:
+    MAKE = 0
+    RESET = 1
+    STEP = 2
+    CLOSE = 3
+    STEP_BATCH = 4
+    SHUTDOWN = 99
+
+
+class EnvWorkerError(Exception):
+    pass
+
+
+class EnvPool:
+    """
+    Bounded pool of pre-built environments. Envs released by a finished game are
+    handed to the next game instead of being closed, as long as the pool is not
+    full. Every game resets its env before the first step, the pool does not.
+    """
+
+    def __init__(self, max_size=16, env_id=ENV_ID):
+        self.max_size = max_size
+        self.env_id = env_id
+        self.free_envs = []
+        # false if the envs live in worker processes and only hits and misses
+        # are recorded here
+        self.holds_envs = True
+
+        self.hits = 0
+        self.misses = 0
+
+    def prefill(self):
+        while len(self.free_envs) < self.max_size:
+            self.free_envs.append(gym.envs.make(self.env_id))
+
+    def acquire(self):
+        if self.free_envs:
+            self.record(hit=True)
+            return self.free_envs.pop(), True
+
+        self.record(hit=False)
+        return gym.envs.make(self.env_id), False
+
+    def release(self, env):
+        if len(self.free_envs) < self.max_size:
+            self.free_envs.append(env)
+        else:
+            env.close()
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def close(self):
+        for env in self.free_envs:
+            env.close()
+        self.free_envs = []
+
+    def get_stats(self):
+        stats = dict(max_size=self.max_size, hits=self.hits, misses=self.misses)
+        if self.holds_envs:
+            stats["size"] = len(self.free_envs)
+        return stats
+
+
+class EnvHost:
+    """
+    Holds the environments of a set of games and executes env operations on them.
+    Used directly on the reactor thread by LocalEnvBackend and inside every
+    worker process of EnvWorkerPool.
+    """
+
+    def __init__(self, env_pool):
+        self.env_pool = env_pool
+        self.envs = {}
+
+    def make(self, game_id):
+        self.envs[game_id], hit = self.env_pool.acquire()
+        return hit
+
+    def reset(self, game_id, one_starting):
+        env = self.envs[game_id]
+        ob = env.reset(one_starting=one_starting)
+        return ob, env.obs_agent_two()
+
+    def step(self, game_id, action, repeat=1):
+        """
+        Applies the action for repeat env steps or until the episode ends. Returns
+        the last observations, the accumulated reward, done and info of the last
+        step and, if more than one step was taken, (ob, r, done, info) of every
+        step.
+        """
+        env = self.envs[game_id]
+        if repeat == 1:
+            ob, r, done, info = env.step(action)
+            return ob, env.obs_agent_two(), r, done, info, []
+
+        steps = []
+        for _ in range(repeat):
+            ob, r, done, info = env.step(action)
+            steps.append((ob, r, done, info))
+            if done:
+                break
+        total_r = sum(step[1] for step in steps)
+        return ob, env.obs_agent_two(), total_r, done, info, steps
+
+    def step_batch(self, game_ids, actions, repeats):
+        results = []
+        for game_id, action, repeat in zip(game_ids, actions, repeats):
+            try:
+                results.append((True, self.step(game_id, action, repeat)))
+            except Exception as e:
+                results.append((False, f"{type(e).__name__}: {e}"))
+        return results
+
+    def close(self, game_id):
+        env = self.envs.pop(game_id, None)
+        if env is not None:
+            self.env_pool.release(env)
+
+    def close_all(self):
+        for env in self.envs.values():
+            env.close()
+        self.envs = {}
+        self.env_pool.close()
+
+    def execute(self, op, game_id, args):
+        if op == EnvOp.MAKE:
+            return self.make(game_id)
+        elif op == EnvOp.RESET:
+            return self.reset(game_id, *args)
+        elif op == EnvOp.STEP:
+            return self.step(game_id, *args)
+        elif op == EnvOp.CLOSE:
+            return self.close(game_id)
+        elif op == EnvOp.STEP_BATCH:
+            return self.step_batch(*args)
+        raise EnvWorkerError(f"Unknown env operation {op}")
+
+
+class LocalEnvBackend:
+    """
+    Steps the environments on the reactor thread, all results are returned
+    as already fired Deferreds.
+    """
+
+    def __init__(self, env_pool):
+        self.env_pool = env_pool
+        self.env_pool.prefill()
+        self.host = EnvHost(env_pool)
+
+    def _call(self, op, game_id, *args):
+        return defer.maybeDeferred(self.host.execute, op, game_id, args)
+
+    def make(self, game_id):
+        return self._call(EnvOp.MAKE, game_id)
+
+    def reset(self, game_id, one_starting):
+        return self._call(EnvOp.RESET, game_id, one_starting)
+
+    def step(self, game_id, action, repeat=1):
+        return self._call(EnvOp.STEP, game_id, action, repeat)
+
+    def step_batch(self, game_ids, actions, repeats):
+        return defer.succeed(self.host.step_batch(game_ids, actions, repeats))
+
+    def close(self, game_id):
+        return self._call(EnvOp.CLOSE, game_id)
+
+    def shutdown(self):
+        self.host.close_all()
+
+
+def _worker_main(conn, pool_size):
+    # Shutdown is coordinated by the server, ignore ctrl-c sent to the process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    env_pool = EnvPool(max_size=pool_size)
+    env_pool.prefill()
+    host = EnvHost(env_pool)
+    while True:
+        try:
+            request_id, op, game_id, args = conn.recv()
+        except EOFError:
+            break
+
+        if op == EnvOp.SHUTDOWN:
+            break
+
+        try:
+            result = host.execute(op, game_id, args)
+            conn.send((request_id, True, result))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+    host.close_all()
+    conn.close()
+
+
+@implementer(IReadDescriptor)
+class EnvWorker:
+    """
+    Server side handle of one env worker process. The pipe to the worker is
+    registered as reader with the reactor, replies fire the Deferreds of the
+    corresponding requests.
+    """
+
+    def __init__(self, pool, index, pool_size):
+        self.pool = pool
+        self.index = index
+        self.num_games = 0
+        self.pending = {}
+        # set once the process is gone, no new games are assigned to the worker
+        self.dead = False
+
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(child_conn, pool_size),
+            name=f"env-worker-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+        reactor.addReader(self)
+
+    def request(self, op, game_id, args=()):
+        request_id = next(self.pool.request_ids)
+        d = defer.Deferred()
+        self.pending[request_id] = d
+        try:
+            self.conn.send((request_id, op, game_id, args))
+        except (OSError, ValueError) as e:
+            del self.pending[request_id]
+            d.errback(EnvWorkerError(f"env worker {self.index} unavailable: {e}"))
+        return d
+
+    def shutdown(self):
+        reactor.removeReader(self)
+        try:
+            self.conn.send((None, EnvOp.SHUTDOWN, None, ()))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+    # IReadDescriptor
+    def fileno(self):
+        try:
+            return self.conn.fileno()
+        except (OSError, ValueError):
+            return -1
+
+    def doRead(self):
+        # a callback may shut the pool down while replies are being dispatched
+        while not self.conn.closed and self.conn.poll():
+            try:
+                request_id, success, result = self.conn.recv()
+            except (EOFError, OSError):
+                return self.connectionLost(None)
+
+            d = self.pending.pop(request_id, None)
+            if d is None:
+                continue
+            if success:
+                d.callback(result)
+            else:
+                d.errback(EnvWorkerError(result))
+
+    def connectionLost(self, reason):
+        reactor.removeReader(self)
+        if not self.dead:
+            self.dead = True
+            print(f"Env worker {self.index} died")
+        pending, self.pending = self.pending, {}
+        for d in pending.values():
+            d.errback(EnvWorkerError(f"env worker {self.index} died"))
+
+    def logPrefix(self):
+        return f"EnvWorker-{self.index}"
+
+
+class EnvWorkerPool:
+    """
+    Distributes the environments of all running games over N worker processes.
+    A game is pinned to the least loaded worker when its env is made, every
+    following operation of that game is sent to the same worker, workers that
+    died get no new games. Each worker keeps its own share of the env pool, hits
+    and misses are reported back into the server side env_pool.
+    """
+
+    def __init__(self, num_workers, env_pool):
+        self.env_pool = env_pool
+        self.env_pool.holds_envs = False
+        self.request_ids = count()
+        worker_pool_size = -(-env_pool.max_size // num_workers)
+        self.workers = [
+            EnvWorker(self, i, worker_pool_size) for i in range(num_workers)
+        ]
+        self.assignment = {}
+
+    def _worker(self, game_id):
+        try:
+            return self.assignment[game_id]
+        except KeyError:
+            raise EnvWorkerError(f"No env for game {game_id}")
+
+    def make(self, game_id):
+        workers = [worker for worker in self.workers if not worker.dead]
+        if not workers:
+            return defer.fail(EnvWorkerError("All env workers died"))
+        worker = min(workers, key=lambda w: w.num_games)
+        worker.num_games += 1
+        self.assignment[game_id] = worker
+        d = worker.request(EnvOp.MAKE, game_id)
+        d.addCallback(self.env_pool.record)
+        return d
+
+    def reset(self, game_id, one_starting):
+        return defer.maybeDeferred(self._worker, game_id).addCallback(
+            lambda worker: worker.request(EnvOp.RESET, game_id, (one_starting,))
+        )
+
+    def step(self, game_id, action, repeat=1):
+        return defer.maybeDeferred(self._worker, game_id).addCallback(
+            lambda worker: worker.request(EnvOp.STEP, game_id, (action, repeat))
+        )
+
+    def step_batch(self, game_ids, actions, repeats):
+        """
+        Steps the given games with one request per worker, actions are sent as one
+        stacked array. Returns a Deferred firing with a (success, result) pair per
+        game in the order of game_ids.
+        """
+        results = [None] * len(game_ids)
+        batches = {}
+        for i, game_id in enumerate(game_ids):
+            worker = self.assignment.get(game_id)
+            if worker is None:
+                results[i] = (False, f"No env for game {game_id}")
+            else:
+                batches.setdefault(worker, []).append(i)
+
+        def fill(worker_results, indices):
+            for i, result in zip(indices, worker_results):
+                results[i] = result
+
+        def fail(failure, indices):
+            for i in indices:
+                results[i] = (False, failure.getErrorMessage())
+
+        requests = []
+        for worker, indices in batches.items():
+            d = worker.request(
+                EnvOp.STEP_BATCH,
+                None,
+                (
+                    [game_ids[i] for i in indices],
+                    np.stack([actions[i] for i in indices]),
+                    [repeats[i] for i in indices],
+                ),
+            )
+            d.addCallbacks(fill, fail, callbackArgs=(indices,), errbackArgs=(indices,))
+            requests.append(d)
+
+        return defer.gatherResults(requests).addCallback(lambda _: results)
+
+    def close(self, game_id):
+        worker = self.assignment.pop(game_id, None)
+        if worker is None:
+            return defer.succeed(None)
+        worker.num_games -= 1
+        return worker.request(EnvOp.CLOSE, game_id)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+
+
+def create_env_backend(env_pool, num_workers=0):
+    if num_workers and num_workers > 0:
+        return EnvWorkerPool(num_workers, env_pool)
+    return LocalEnvBackend(env_pool)
@@ -1,14 +1,15 @@
 import datetime
 import os
 import time
-from laserhockey.hockey_env import HockeyEnv
 from numbers import Number
 from uuid import uuid4
 
-import gym
 import numpy as np
+from twisted.internet import reactor
 from twisted.spread import pb
 
+from gym_multiplayer_server.server.recorder import StreamingRecorder
+
 
 class GameStates:
     WAITING_FOR_PLAYER = 0
@@ -35,85 +36,122 @@ class Game(pb.Viewable):
         self.info = None
 
         self.last_op_timestamp = time.time()
+        # aborts the game if the current phase takes too long, see _refresh_timeout
+        self.timeout_call = None
 
         self.state = GameStates.WAITING_FOR_PLAYER
-        self.server.all_games.append(self)
-        self.server.waiting_games.append(self)
+        self.server.game_registry.add(self, self.state)
 
-        self.transition_buffer = []
+        self.recorder = None
+        self.action_repeat = 1
+        # perf_counter when the actions of the current step were complete
+        self.step_started = None
         self.num_games_played = 0
         self.MAX_GAMES = 4
 
-        self.env = None
+        self.env_backend = self.server.env_backend
+        self.has_env = False
+        # set once the game left the server, later aborts are ignored
+        self.closed = False
 
     def _start(self):
         self.state = GameStates.GAME_RUNNING
-        self.server.running_games.append(self)
+        self.server.game_registry.move(self, self.state)
+        self.server.matchmaking_index.discard(self)
 
-        self.env = gym.envs.make("Hockey-v0")
         self.game_outcomes = []
-        self.ob = self.env.reset(one_starting=self.num_games_played % 2)
 
-        self.player_two_ob = self.env.obs_agent_two()
+        # Every action is applied for the smallest repeat factor both clients asked for
+        self.action_repeat = min(client.action_repeat for client in self.clients)
+
+        now = datetime.datetime.now()
+        self.recorder = StreamingRecorder(
+            self.server.record_writer,
+            os.path.join(
+                self.server.working_dir,
+                "games",
+                str(now.year),
+                str(now.month),
+                str(now.day),
+                self.identifier,
+            ),
+            chunk_size=self.server.record_chunk_size,
+            identifier=self.identifier,
+            player_one=self.clients[0].avatar.username,
+            player_two=self.clients[1].avatar.username,
+        )
+
+        self.has_env = True
+        d = self.env_backend.make(self.identifier)
+        d.addCallback(
+            lambda _: self.env_backend.reset(
+                self.identifier, one_starting=self.num_games_played % 2
+            )
+        )
+        d.addCallback(self._on_start)
+        d.addErrback(self._env_error)
+
+    def _on_start(self, result):
+        if self.state != GameStates.GAME_RUNNING:
+            return
+
+        self.ob, self.player_two_ob = result
         self.last_ob = self.ob
         self.last_player_two_ob = self.player_two_ob
 
         info = dict(
             id=self.identifier,
             player=(self.clients[0].avatar.username, self.clients[1].avatar.username),
+            action_repeat=self.action_repeat,
         )
 
-        self.clients[0].game_starts(self.ob.tolist(), info)
-        self.clients[1].game_starts(self.player_two_ob.tolist(), info)
+        self.clients[0].game_starts(self.ob, info)
+        self.clients[1].game_starts(self.player_two_ob, info)
 
         self.last_op_timestamp = time.time()
+        self._refresh_timeout()
 
     def _done(self, ob, player_two_ob, r, done, info):
-        self.clients[0].game_done(ob.tolist(), r, done, info)
-        self.clients[1].game_done(player_two_ob.tolist(), r, done, info)
+        self.server.metrics.games_finished.inc()
+        self.clients[0].game_done(ob, r, done, info)
+        self.clients[1].game_done(player_two_ob, r, done, info)
         self._save()
         self.server.game_done(self)
         self._close()
 
-    def _save(self):
-        now = datetime.datetime.now()
-
-        path = os.path.join(
-            self.server.working_dir,
-            "games",
-            str(now.year),
-            str(now.month),
-            str(now.day),
-        )
-        os.makedirs(path, exist_ok=True)
-        np.savez(
-            os.path.join(path, self.identifier),
-            {
-                "identifier": self.identifier,
-                "player_one": self.clients[0].avatar.username,
-                "player_two": self.clients[1].avatar.username,
-                "transitions": self.transition_buffer,
-                "timestamp": time.time(),
-            },
+    def _save(self, **meta):
+        # the remaining transitions are written by the record writer thread
+        self.recorder.seal(
+            identifier=self.identifier,
+            player_one=self.clients[0].avatar.username,
+            player_two=self.clients[1].avatar.username,
+            timestamp=time.time(),
+            game_outcomes=self.game_outcomes,
+            **meta,
         )
 
     def _close(self):
-        if self in self.server.all_games:
-            self.server.all_games.remove(self)
-        if self in self.server.waiting_games:
-            self.server.waiting_games.remove(self)
-        if self in self.server.running_games:
-            self.server.running_games.remove(self)
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.timeout_call is not None and self.timeout_call.active():
+            self.timeout_call.cancel()
+        self.timeout_call = None
+
+        self.server.game_registry.discard(self)
+        self.server.matchmaking_index.discard(self)
 
         if self.clients[0] is not None:
-            del self.server.client_to_game_mapping[self.clients[0]]
+            self.server.client_to_game_mapping.pop(self.clients[0], None)
         if self.clients[1] is not None:
-            del self.server.client_to_game_mapping[self.clients[1]]
+            self.server.client_to_game_mapping.pop(self.clients[1], None)
 
-        del self.server.game_to_client_mapping[self]
+        self.server.game_to_client_mapping.pop(self, None)
 
-        if self.env:
-            self.env.close()
+        if self.has_env:
+            self.has_env = False
+            self.env_backend.close(self.identifier).addErrback(lambda _: None)
 
     # Functions called by server
     def add_player(self, client):
@@ -130,9 +168,49 @@ class Game(pb.Viewable):
 
         if self.clients[0] is not None and self.clients[1] is not None:
             self._start()
+        else:
+            self.server.matchmaking_index.add(self)
+
+        self._refresh_timeout()
+
+    def _refresh_timeout(self):
+        """
+        (Re)starts the timeout of the current phase: waiting for an opponent or
+        waiting for an action. Pushing the deadline back is O(1).
+        """
+        if self.state == GameStates.WAITING_FOR_PLAYER:
+            timeout = self.server.waiting_timeout
+        else:
+            timeout = self.server.action_timeout
+
+        if not timeout or timeout <= 0:
+            if self.timeout_call is not None and self.timeout_call.active():
+                self.timeout_call.cancel()
+            self.timeout_call = None
+        elif self.timeout_call is not None and self.timeout_call.active():
+            self.timeout_call.reset(timeout)
+        else:
+            self.timeout_call = reactor.callLater(timeout, self._timed_out)
+
+    def _timed_out(self):
+        self.timeout_call = None
+        if self.state == GameStates.WAITING_FOR_PLAYER:
+            self.abort(
+                "Game aborted, no opponent found within "
+                f"{self.server.waiting_timeout:g} s"
+            )
+        elif self.state == GameStates.GAME_RUNNING:
+            self.abort(
+                f"Game aborted due to timeout ({self.server.action_timeout:g} s "
+                "without an action)"
+            )
 
     @staticmethod
     def validate_action(action):
+        # actions received in binary wire format
+        if isinstance(action, np.ndarray):
+            return action.shape == (4,)
+
         is_valid = True
         if not isinstance(action, list):
             is_valid = False
@@ -150,8 +228,9 @@ class Game(pb.Viewable):
                 self.action = (ac, self.action[1])
             else:
                 print(f"Invalid action from player {self.clients[0].avatar.username}")
+                self.server.metrics.invalid_actions.inc()
                 self.clients[0].send_observation(
-                    self.ob.tolist(), self.reward, self.done, self.info
+                    self.ob, self.reward, self.done, self.info
                 )
                 return
         if client is self.clients[1]:
@@ -159,55 +238,111 @@ class Game(pb.Viewable):
                 self.action = (self.action[0], ac)
             else:
                 print(f"Invalid action from player {self.clients[1].avatar.username}")
+                self.server.metrics.invalid_actions.inc()
                 self.clients[1].send_observation(
-                    self.player_two_ob.tolist(), self.reward, self.done, self.info
+                    self.player_two_ob, self.reward, self.done, self.info
                 )
                 return
 
         self.last_op_timestamp = time.time()
+        self._refresh_timeout()
 
         if self.action[0] is not None and self.action[1] is not None:
-            self.ob, self.reward, self.done, self.info = self.env.step(
-                np.concatenate(self.action)
-            )
-            self.player_two_ob = self.env.obs_agent_two()
+            action = self.action
+            self.action = (None, None)
+            self.step_started = time.perf_counter()
 
-            # if self.state == GameStates.GAME_RUNNING:
-            # self.env.render()
+            if self.server.tick_scheduler is not None:
+                self.server.tick_scheduler.submit(self, action)
+                return
 
-            self.transition_buffer.append(
-                (self.last_ob, self.action, self.ob, self.reward, self.done, self.info)
+            d = self.env_backend.step(
+                self.identifier, np.concatenate(action), self.action_repeat
             )
+            d.addCallback(self._on_step, action)
+            d.addErrback(self._env_error)
 
-            self.last_ob = self.ob
-            self.last_player_two_ob = self.player_two_ob
+    def _on_step(self, result, action):
+        if self.state != GameStates.GAME_RUNNING:
+            return
 
-            self.action = (None, None)
-            do_reset = False
-            if self.done:
-                self.num_games_played += 1
-                self.game_outcomes.append(self.info["winner"])
-
-                if self.num_games_played >= self.MAX_GAMES:
-                    self._done(
-                        self.ob, self.player_two_ob, self.reward, self.done, self.info
-                    )
-                else:
-                    self.ob = self.env.reset(one_starting=self.num_games_played % 2)
-                    self.player_two_ob = self.env.obs_agent_two()
-                    do_reset = True
-
-            if not self.done or do_reset:
-                self.clients[0].send_observation(
-                    self.ob.tolist(), self.reward, self.done, self.info
+        self.ob, self.player_two_ob, self.reward, self.done, self.info, steps = result
+
+        metrics = self.server.metrics
+        metrics.env_step.observe(time.perf_counter() - self.step_started)
+        metrics.steps.inc(len(steps) or 1)
+
+        # if self.state == GameStates.GAME_RUNNING:
+        # self.env.render()
+
+        # With action repeat every env step is recorded, the clients only get the
+        # last observation and the accumulated reward
+        flat_action = np.concatenate(action)
+        last_ob = self.last_ob
+        for ob, r, done, info in steps or [
+            (self.ob, self.reward, self.done, self.info)
+        ]:
+            self.recorder.append(last_ob, flat_action, ob, r, done, info)
+            last_ob = ob
+
+        self.last_ob = self.ob
+        self.last_player_two_ob = self.player_two_ob
+
+        if self.done:
+            self.num_games_played += 1
+            self.game_outcomes.append(self.info["winner"])
+
+            if self.num_games_played >= self.MAX_GAMES:
+                self._done(
+                    self.ob, self.player_two_ob, self.reward, self.done, self.info
                 )
-                # TODO: Recompute info dict for player two
-                self.clients[1].send_observation(
-                    self.player_two_ob.tolist(), self.reward, self.done, self.info
+            else:
+                d = self.env_backend.reset(
+                    self.identifier, one_starting=self.num_games_played % 2
                 )
+                d.addCallback(self._on_reset)
+                d.addErrback(self._env_error)
+            return
+
+        self._send_observations()
+
+    def _on_reset(self, result):
+        if self.state != GameStates.GAME_RUNNING:
+            return
+
+        self.ob, self.player_two_ob = result
+        self._send_observations()
+
+    def _send_observations(self):
+        self.clients[0].send_observation(self.ob, self.reward, self.done, self.info)
+        # TODO: Recompute info dict for player two
+        self.clients[1].send_observation(
+            self.player_two_ob, self.reward, self.done, self.info
+        )
+
+        if self.step_started is not None:
+            self.server.metrics.game_step.observe(
+                time.perf_counter() - self.step_started
+            )
+            self.step_started = None
+
+    def _env_error(self, failure):
+        if self.state != GameStates.GAME_RUNNING:
+            return
+        print(
+            f"Environment error in game {self.identifier}: {failure.getErrorMessage()}"
+        )
+        self.abort("Game aborted due to an environment error")
 
     def abort(self, msg):
+        # clients that disconnect while being notified abort the game again
+        if self.closed or self.state == GameStates.ABORTED:
+            return
         self.state = GameStates.ABORTED
+        self.server.metrics.games_aborted.inc()
+
+        if self.recorder is not None:
+            self._save(aborted=True, abort_message=msg)
 
         if self.clients[0] is not None:
             self.clients[0].game_aborted(msg)
@@ -215,6 +350,3 @@ class Game(pb.Viewable):
             self.clients[1].game_aborted(msg)
 
         self._close()
-
-
-HockeyEnv
@@ -0,0 +1,170 @@
+import time
+
+import numpy as np
+import trueskill
+
+BASIC_OPPONENT_TAG = "BasicOpponent"
+
+# Waiting for this long adds 1.0 to the match quality of a game
+MAX_WAITING_TIME = 60.0 * 5
+
+
+def match_qualities(mu, sigma, mus, sigmas, beta=None):
+    """
+    Closed form of trueskill.quality_1vs1 between one rating (mu, sigma) and
+    arrays of ratings, broadcasts like numpy.
+    """
+    if beta is None:
+        beta = trueskill.global_env().beta
+    denom = 2 * beta ** 2 + sigma ** 2 + np.square(sigmas)
+    return np.sqrt(2 * beta ** 2 / denom) * np.exp(-np.square(mu - mus) / (2 * denom))
+
+
+def waiting_time_bonus(waiting_time):
+    # 5 minutes of waiting means you have a very high chance to be matched
+    return np.minimum(1.0, waiting_time / MAX_WAITING_TIME)
+
+
+def is_basic_opponent(avatar):
+    return BASIC_OPPONENT_TAG in avatar.username
+
+
+class MatchmakingIndex:
+    """
+    Waiting games indexed by the rating of the waiting player. Games are kept in
+    buckets of bucket_width mu, so a joining client only evaluates the match
+    quality for the waiting games closest to its own rating plus the games that
+    waited long enough for the waiting time bonus to dominate the quality. With
+    at most max_candidates eligible games every game is a candidate.
+    """
+
+    def __init__(self, bucket_width=None, max_candidates=64, long_waiting_time=None):
+        if bucket_width is None:
+            bucket_width = trueskill.global_env().beta
+        if long_waiting_time is None:
+            long_waiting_time = MAX_WAITING_TIME / 2
+
+        self.bucket_width = bucket_width
+        self.max_candidates = max_candidates
+        self.long_waiting_time = long_waiting_time
+
+        # dicts are used as insertion ordered sets, which keeps _games ordered by
+        # the time the games started waiting
+        self._games = {}
+        self._buckets = {}
+        self._num_games_per_avatar = {}
+        self._num_basic_opponent_games = 0
+
+    def _bucket(self, mu):
+        return int(np.floor(mu / self.bucket_width))
+
+    def add(self, game):
+        if game in self._games:
+            return
+        avatar = game.clients[0].avatar
+        bucket = self._bucket(avatar.rating.mu)
+
+        self._games[game] = bucket
+        self._buckets.setdefault(bucket, {})[game] = None
+        self._num_games_per_avatar[avatar] = (
+            self._num_games_per_avatar.get(avatar, 0) + 1
+        )
+        if is_basic_opponent(avatar):
+            self._num_basic_opponent_games += 1
+
+    def discard(self, game):
+        bucket = self._games.pop(game, None)
+        if bucket is None:
+            return
+        avatar = game.clients[0].avatar
+
+        del self._buckets[bucket][game]
+        if not self._buckets[bucket]:
+            del self._buckets[bucket]
+        self._num_games_per_avatar[avatar] -= 1
+        if self._num_games_per_avatar[avatar] == 0:
+            del self._num_games_per_avatar[avatar]
+        if is_basic_opponent(avatar):
+            self._num_basic_opponent_games -= 1
+
+    def __len__(self):
+        return len(self._games)
+
+    def __contains__(self, game):
+        return game in self._games
+
+    @staticmethod
+    def is_eligible(game, avatar):
+        other = game.clients[0].avatar
+        # not strong against weak
+        return other is not avatar and not (
+            is_basic_opponent(other) and is_basic_opponent(avatar)
+        )
+
+    def num_eligible(self, avatar):
+        if is_basic_opponent(avatar):
+            # the avatar's own games are basic opponent games as well
+            return len(self._games) - self._num_basic_opponent_games
+        return len(self._games) - self._num_games_per_avatar.get(avatar, 0)
+
+    def candidates(self, avatar, now=None):
+        """
+        Eligible games for avatar: up to max_candidates in the buckets nearest to
+        its rating and up to max_candidates waiting for longer than
+        long_waiting_time.
+        """
+        if now is None:
+            now = time.time()
+
+        if self.num_eligible(avatar) <= self.max_candidates:
+            return [g for g in self._games if self.is_eligible(g, avatar)]
+
+        # at most max_candidates from the nearest buckets, the ones that waited
+        # longest first, a bucket can hold all new players with the default rating
+        candidates = {}
+        own_bucket = self._bucket(avatar.rating.mu)
+        for bucket in sorted(self._buckets, key=lambda b: abs(b - own_bucket)):
+            for game in self._buckets[bucket]:
+                if self.is_eligible(game, avatar):
+                    candidates[game] = None
+                    if len(candidates) >= self.max_candidates:
+                        break
+            if len(candidates) >= self.max_candidates:
+                break
+
+        num_long_waiting = 0
+        for game in self._games:
+            if now - game.last_op_timestamp < self.long_waiting_time:
+                break
+            if self.is_eligible(game, avatar):
+                candidates[game] = None
+                num_long_waiting += 1
+                if num_long_waiting >= self.max_candidates:
+                    break
+
+        return list(candidates)
+
+    def choose(self, avatar, now=None):
+        """
+        Samples one of the candidate games with probability proportional to its
+        match quality plus waiting time bonus.
+        """
+        if now is None:
+            now = time.time()
+
+        candidates = self.candidates(avatar, now)
+        if not candidates:
+            return None
+
+        ratings = [g.clients[0].avatar.rating for g in candidates]
+        qualities = match_qualities(
+            avatar.rating.mu,
+            avatar.rating.sigma,
+            np.array([r.mu for r in ratings]),
+            np.array([r.sigma for r in ratings]),
+        )
+        qualities += waiting_time_bonus(
+            now - np.array([g.last_op_timestamp for g in candidates])
+        )
+        game_idx = np.random.choice(len(qualities), p=qualities / np.sum(qualities))
+        return candidates[game_idx]
@@ -0,0 +1,267 @@
+from bisect import bisect_left
+
+from twisted.web import resource
+
+from gym_multiplayer_server.server.game import GameStates
+from gym_multiplayer_server.server.player import ClientState
+
+# Upper bounds in seconds, from 100 us to 10 s
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+PROMETHEUS_CONTENT_TYPE = b"text/plain; version=0.0.4; charset=utf-8"
+
+
+def _state_names(states):
+    return {
+        value: name.lower() for name, value in vars(states).items() if name.isupper()
+    }
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = {
+        key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for key, value in labels.items()
+    }
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+
+def _quantile_samples(values, quantiles=(0.5, 0.9, 0.99, 1.0)):
+    """
+    (labels, value) samples of a Gauge with the given quantiles of values
+    """
+    if not values:
+        return []
+    values = sorted(values)
+    return [
+        ({"quantile": repr(q)}, values[min(len(values) - 1, int(q * len(values)))])
+        for q in quantiles
+    ]
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def expose(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {_format_value(self.value)}",
+        ]
+
+
+class Gauge:
+    """
+    Gauge read at scrape time, collect returns a number or a list of
+    (labels, value) pairs
+    """
+
+    def __init__(self, name, documentation, collect):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        samples = self.collect()
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, observe is a bisect and two additions
+    """
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = _format_value(bound)
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation, collect):
+        return self._register(Gauge(name, documentation, collect))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        """
+        Returns all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+class ServerMetrics(MetricsRegistry):
+    """
+    Metrics of the game server. Latencies are measured with time.perf_counter
+    on the reactor thread.
+    """
+
+    def __init__(self, server):
+        super().__init__()
+
+        self.env_step = self.histogram(
+            "gym_env_step_seconds",
+            "Time from submitting the actions of a game to the env step result, "
+            "includes the tick wait in lock-step mode",
+        )
+        self.game_step = self.histogram(
+            "gym_game_step_seconds",
+            "Time from the second action of a step to the observations being sent",
+        )
+        self.send_observation = self.histogram(
+            "gym_send_observation_seconds",
+            "Time to serialize and send one observation to a client",
+        )
+        self.reactor_lag = self.histogram(
+            "gym_reactor_lag_seconds",
+            "Delay of the stall detector heartbeat, the event-loop lag of the reactor",
+        )
+        self.client_rtt = self.histogram(
+            "gym_client_rtt_seconds",
+            "Time from sending an observation to a client until its action arrived",
+        )
+
+        self.steps = self.counter("gym_steps_total", "Env steps of all games")
+        self.actions = self.counter("gym_actions_total", "Actions received")
+        self.invalid_actions = self.counter(
+            "gym_invalid_actions_total", "Invalid actions received"
+        )
+        self.observations = self.counter(
+            "gym_observations_total", "Observations sent to clients"
+        )
+        self.games_finished = self.counter("gym_games_finished_total", "Finished games")
+        self.games_aborted = self.counter("gym_games_aborted_total", "Aborted games")
+        self.reactor_stalls = self.counter(
+            "gym_reactor_stalls_total",
+            "Times the event-loop lag exceeded the stall threshold",
+        )
+
+        client_states = _state_names(ClientState)
+        self.gauge(
+            "gym_clients",
+            "Connected clients by state",
+            lambda: [
+                ({"state": client_states[state]}, count)
+                for state, count in server.client_registry.counts().items()
+            ],
+        )
+        game_states = _state_names(GameStates)
+        self.gauge(
+            "gym_games",
+            "Open games by state",
+            lambda: [
+                ({"state": game_states[state]}, count)
+                for state, count in server.game_registry.counts().items()
+            ],
+        )
+        self.gauge(
+            "gym_record_writer_queue_size",
+            "Game record writes waiting for the disk, above --record-queue-size "
+            "the disk does not keep up",
+            lambda: server.record_writer.queue.qsize(),
+        )
+        # per-client values would need a label per connection, the spread of
+        # the moving averages shows slow clients with a fixed set of labels
+        self.gauge(
+            "gym_client_mean_rtt_seconds",
+            "Quantiles over the connected clients of the moving average of their "
+            "round-trip time",
+            lambda: _quantile_samples(
+                [
+                    client.rtt
+                    for client in server.client_registry.snapshot()
+                    if client.rtt is not None
+                ]
+            ),
+        )
+
+
+class MetricsResource(resource.Resource):
+    """
+    twisted.web resource serving the metrics to Prometheus
+    """
+
+    isLeaf = True
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", PROMETHEUS_CONTENT_TYPE)
+        return self.metrics.expose().encode("utf-8")
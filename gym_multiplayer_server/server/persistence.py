@@ -0,0 +1,29 @@
+import os
+import pickle
+from uuid import uuid4
+
+
+def atomic_write(path, data):
+    """
+    Writes data to a temporary file next to path and renames it to path, so
+    readers (e.g. gen_html) never see a partially written file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_pickle_dump(obj, path):
+    atomic_write(path, pickle.dumps(obj))
+
+
+def write_files(files):
+    for path, data in files:
+        atomic_write(path, data)
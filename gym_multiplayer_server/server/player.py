@@ -7,6 +7,14 @@ from trueskill import Rating
 from twisted.spread import pb
 
 from gym_multiplayer_server.common.error import ServerClientVersionMissmatchError
+from gym_multiplayer_server.server.persistence import atomic_pickle_dump
+from gym_multiplayer_server.common.wire import (
+    WireFormat,
+    negotiate_wire_format,
+    pack_array,
+    pack_step,
+    unpack_array,
+)
 
 
 class ClientState:
@@ -24,34 +32,25 @@ class Client(pb.Referenceable):
         self.avatar = avatar
         self.mind = mind
         self.game = None
+        self.wire_format = WireFormat.LIST
+        self.action_repeat = 1
 
-        self.state = ClientState.IDLE
-
-        self._add_to_server_list("idle", to_global_list=True)
+        # round-trip time of observation -> action, moving average in seconds
+        self.rtt = None
+        self.observation_sent_at = None
 
-    def _remove_from_server_list(self, from_global_list=False):
-        if from_global_list:
-            if self in self.server.all_connected_clients:
-                self.server.all_connected_clients.remove(self)
-        if self in self.server.idle_clients:
-            self.server.idle_clients.remove(self)
-        if self in self.server.waiting_clients:
-            self.server.waiting_clients.remove(self)
-        if self in self.server.playing_clients:
-            self.server.playing_clients.remove(self)
+        self.state = ClientState.IDLE
 
-    def _add_to_server_list(self, list_name, to_global_list=False):
-        self._remove_from_server_list()
+        self.server.client_registry.add(self, ClientState.IDLE)
 
-        if to_global_list:
-            self.server.all_connected_clients.append(self)
+        # detach as soon as the connection is lost instead of waiting for the
+        # next failing callRemote
+        self.mind.broker.notifyOnDisconnect(self._connection_error)
 
-        if list_name == "idle":
-            self.server.idle_clients.append(self)
-        elif list_name == "waiting":
-            self.server.waiting_clients.append(self)
-        elif list_name == "playing":
-            self.server.playing_clients.append(self)
+    def _move_in_server_registry(self, state):
+        # detached clients must not be re-registered by late game callbacks
+        if self in self.server.client_registry:
+            self.server.client_registry.move(self, state)
 
     def _connection_error(self, *args, **kwargs):
         self.avatar.detached(self.mind)
@@ -72,38 +71,75 @@ class Client(pb.Referenceable):
             key: value for key, value in self.avatar.get_state().items() if key in keys
         }
 
-    def remote_start_queuing(self):
+    def remote_start_queuing(self, action_repeat=1):
+        self.action_repeat = max(
+            1, min(int(action_repeat), self.server.max_action_repeat)
+        )
+
         self.state = ClientState.WAITING_FOR_GAME
-        self._add_to_server_list("waiting")
+        self._move_in_server_registry(ClientState.WAITING_FOR_GAME)
 
         self.game = self.server.join_game(self)
 
     def remote_stop_queueing(self):
-        self.game.abort("Stop queuing")
+        # the game may already be aborted by the waiting timeout
+        if self.game is not None:
+            self.game.abort("Stop queuing")
         self.game = None
         self.state = ClientState.IDLE
-        self._add_to_server_list("idle")
+        self._move_in_server_registry(ClientState.IDLE)
 
     def remote_receive_action(self, ac):
+        metrics = self.server.metrics
+        metrics.actions.inc()
+        if self.observation_sent_at is not None:
+            rtt = time.perf_counter() - self.observation_sent_at
+            self.observation_sent_at = None
+            metrics.client_rtt.observe(rtt)
+            self.rtt = rtt if self.rtt is None else 0.9 * self.rtt + 0.1 * rtt
+
+        # actions still in flight when the game was aborted are dropped
+        if self.game is None:
+            return
+        if isinstance(ac, bytes):
+            ac = unpack_array(ac)
         self.game.step(self, ac)
 
     # Functions called by game
     def game_starts(self, ob, info):
         self.state = ClientState.PLAYING
-        self._add_to_server_list("playing")
+        self._move_in_server_registry(ClientState.PLAYING)
+
+        if self.wire_format == WireFormat.BINARY:
+            ob = pack_array(ob)
+        else:
+            ob = ob.tolist()
 
         try:
             d = self.mind.callRemote("game_starts", ob=ob, info=info)
             d.addErrback(self._connection_error)
+            self.observation_sent_at = time.perf_counter()
         except pb.DeadReferenceError:
             self._connection_error()
 
     def send_observation(self, ob, r, done, info):
+        start = time.perf_counter()
         try:
-            d = self.mind.callRemote(
-                "receive_observation", ob=ob, r=r, done=done, info=info
-            )
+            if self.wire_format == WireFormat.BINARY:
+                d = self.mind.callRemote(
+                    "receive_observation", ob=pack_step(ob, r, done, info)
+                )
+            else:
+                d = self.mind.callRemote(
+                    "receive_observation", ob=ob.tolist(), r=r, done=done, info=info
+                )
             d.addErrback(self._connection_error)
+
+            self.observation_sent_at = time.perf_counter()
+            self.server.metrics.send_observation.observe(
+                self.observation_sent_at - start
+            )
+            self.server.metrics.observations.inc()
         except pb.DeadReferenceError:
             self._connection_error()
 
@@ -132,19 +168,27 @@ class Client(pb.Referenceable):
                     self.avatar.games_lost += 1
                     games_lost += 1
 
-            d = self.mind.callRemote(
-                "game_done",
-                ob=ob,
-                r=r,
-                done=done,
-                info=info,
-                result={
-                    "games_played": len(self.game.game_outcomes),
-                    "games_won": games_won,
-                    "games_lost": games_lost,
-                    "games_drawn": games_drawn,
-                },
-            )
+            self.avatar.dirty = True
+
+            result = {
+                "games_played": len(self.game.game_outcomes),
+                "games_won": games_won,
+                "games_lost": games_lost,
+                "games_drawn": games_drawn,
+            }
+            if self.wire_format == WireFormat.BINARY:
+                d = self.mind.callRemote(
+                    "game_done", ob=pack_step(ob, r, done, info), result=result
+                )
+            else:
+                d = self.mind.callRemote(
+                    "game_done",
+                    ob=ob.tolist(),
+                    r=r,
+                    done=done,
+                    info=info,
+                    result=result,
+                )
             d.addErrback(self._connection_error)
 
             self.avatar.finished_games_ids.append(self.game.identifier)
@@ -152,16 +196,18 @@ class Client(pb.Referenceable):
 
             self.game = None
             self.state = ClientState.IDLE
-            self._add_to_server_list("idle")
+            self._move_in_server_registry(ClientState.IDLE)
 
         except pb.DeadReferenceError:
             self._connection_error()
 
     def game_aborted(self, msg):
+        self.game = None
         try:
             d = self.mind.callRemote("game_aborted", msg=msg)
             d.addErrback(self._connection_error)
-            self._add_to_server_list("idle")
+            self.state = ClientState.IDLE
+            self._move_in_server_registry(ClientState.IDLE)
         except pb.DeadReferenceError:
             self._connection_error()
 
@@ -169,10 +215,14 @@ class Client(pb.Referenceable):
     def detached(self):
         self.state = ClientState.DETACHED
 
-        self._remove_from_server_list(from_global_list=True)
+        self.server.client_registry.discard(self)
+        if not self.mind.broker.disconnected:
+            self.mind.broker.dontNotifyOnDisconnect(self._connection_error)
 
-        if self in self.server.client_to_game_mapping:
-            game = self.game
+        # self.game is already cleared if the client left while its game was
+        # being aborted
+        game = self.server.client_to_game_mapping.get(self)
+        if game is not None:
             game.abort(f"Player {self.avatar.username} left the game")
 
 
@@ -190,6 +240,8 @@ class Avatar(pb.Avatar):
         self.rating = Rating()
         self.rating_mu = self.rating.mu
         self.rating_sigma = self.rating.sigma
+        # set whenever the state returned by get_state changes, cleared once saved
+        self.dirty = True
 
     def attached(self, mind):
         if len(self.clients) == 0:
@@ -210,15 +262,27 @@ class Avatar(pb.Avatar):
             pass
 
     # Functions called by remote client
-    def perspective_check_server_client_compatibility(self, client_version):
+    def perspective_check_server_client_compatibility(
+        self, client_version, wire_formats=None, mind=None
+    ):
         if client_version != self.server.__VERSION__:
             raise ServerClientVersionMissmatchError(
                 f"Client vers. {client_version} and server vers."
                 f"{self.server.__VERSION__} incompatible, please update"
             )
-        return True
+
+        # Old clients neither send their wire formats nor expect anything but True
+        if mind is None:
+            return True
+
+        wire_format = negotiate_wire_format(wire_formats)
+        self._client_for_mind(mind).wire_format = wire_format
+        return wire_format
 
     def perspective_request_remote_client(self, mind):
+        return self._client_for_mind(mind)
+
+    def _client_for_mind(self, mind):
         client = [
             client for client in self.clients if client.mind.broker is mind.broker
         ][0]
@@ -240,19 +304,20 @@ class Avatar(pb.Avatar):
         return state
 
     # Functions called by server
-    def save(self, path):
-        state = self.get_state()
+    def state_path(self, path):
+        return os.path.join(path, "avatars", self.username + ".pkl")
 
-        path = os.path.join(path, "avatars")
-        os.makedirs(path, exist_ok=True)
-        with open(os.path.join(path, self.username + ".pkl"), "wb") as f:
-            pickle.dump(state, f)
+    def save(self, path):
+        atomic_pickle_dump(self.get_state(), self.state_path(path))
+        self.dirty = False
 
     def load(self, path):
-        path = os.path.join(path, "avatars", self.username + ".pkl")
+        path = self.state_path(path)
         if os.path.exists(path):
             with open(path, "rb") as f:
-                state = pickle.load(f)
+                self.set_state(pickle.load(f))
 
-            self.__dict__.update(state)
-            self.rating = Rating(self.rating_mu, self.rating_sigma)
+    def set_state(self, state):
+        self.__dict__.update(state)
+        self.rating = Rating(self.rating_mu, self.rating_sigma)
+        self.dirty = False
@@ -0,0 +1,229 @@
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from twisted.internet import reactor
+
+
+def frame_name(frame):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """
+    Returns the stack of frame outermost first in the collapsed format of
+    flamegraph.pl, function names separated by semicolons
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame).replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread from a background thread. The sampled
+    thread is not instrumented, every sample only costs it the time the
+    sampler holds the GIL.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.num_samples = 0
+        self._stop = threading.Event()
+
+    def run(self, duration):
+        end = time.monotonic() + duration
+        while not self._stop.is_set() and time.monotonic() < end:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+                self.num_samples += 1
+            del frame
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def top_functions(self, n):
+        """
+        Returns (name, own samples, total samples) of the n functions that were
+        running most often, waiting in the poll of the reactor counts as well
+        """
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            names = stack.split(";")
+            own[names[-1]] += count
+            # recursive functions are counted once per sample
+            for name in set(names):
+                total[name] += count
+        names = sorted(total, key=lambda name: (own[name], total[name]), reverse=True)
+        return [(name, own[name], total[name]) for name in names[:n]]
+
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+class ServerProfiler:
+    """
+    Profiling of the running server, driven by the admin CLI. Only one
+    profiling session runs at a time, results are written to output_dir.
+    """
+
+    def __init__(self, output_dir, reactor_thread_id):
+        self.output_dir = output_dir
+        self.reactor_thread_id = reactor_thread_id
+
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.profile = None
+        self.stop_call = None
+
+        self.last_snapshot = None
+
+    def _output_path(self, kind, extension):
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        return os.path.join(self.output_dir, f"{kind}-{timestamp}.{extension}")
+
+    def _begin(self):
+        with self.lock:
+            if self.sampler is not None or self.profile is not None:
+                print("A profiling session is already running, stop it first")
+                return False
+            return True
+
+    # Sampling profiler
+    def start_sampling(self, duration, interval=0.005, top_n=20):
+        if not self._begin():
+            return
+        self.sampler = SamplingProfiler(self.reactor_thread_id, interval)
+        threading.Thread(
+            target=self._run_sampling,
+            args=(self.sampler, duration, top_n),
+            name="SamplingProfiler",
+            daemon=True,
+        ).start()
+        print(
+            f"Sampling the reactor thread every {interval * 1000:.1f}ms "
+            f"for {duration}s"
+        )
+
+    def _run_sampling(self, sampler, duration, top_n):
+        sampler.run(duration)
+
+        path = self._output_path("stacks", "collapsed")
+        sampler.write_collapsed(path)
+        print(f"\n{sampler.num_samples} samples, collapsed stacks written to {path}")
+        print("{:>10}{:>10}  {}".format("Own %", "Total %", "Function"))
+        for name, own, total in sampler.top_functions(top_n):
+            print(
+                "{:>10.1f}{:>10.1f}  {}".format(
+                    own / max(sampler.num_samples, 1) * 100,
+                    total / max(sampler.num_samples, 1) * 100,
+                    name,
+                )
+            )
+        with self.lock:
+            self.sampler = None
+
+    # cProfile, needs to be enabled on the reactor thread
+    def start_cprofile(self, duration, top_n=20):
+        if not self._begin():
+            return
+        self.profile = cProfile.Profile()
+        reactor.callFromThread(self._enable_cprofile, duration, top_n)
+        print(f"Running cProfile on the reactor thread for {duration}s")
+
+    def _enable_cprofile(self, duration, top_n):
+        self.profile.enable()
+        self.stop_call = reactor.callLater(duration, self._finish_cprofile, top_n)
+
+    def _finish_cprofile(self, top_n):
+        self.stop_call = None
+        self.profile.disable()
+
+        path = self._output_path("cprofile", "prof")
+        self.profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(
+            top_n
+        )
+        print(f"\nProfile written to {path}")
+        print(out.getvalue())
+        with self.lock:
+            self.profile = None
+
+    def stop(self):
+        """
+        Ends the running session early, its results are written as usual
+        """
+        with self.lock:
+            sampler = self.sampler
+        if sampler is not None:
+            sampler.stop()
+        reactor.callFromThread(self._stop_cprofile)
+
+    def _stop_cprofile(self):
+        if self.stop_call is not None and self.stop_call.active():
+            self.stop_call.reset(0)
+
+    # tracemalloc
+    def start_tracemalloc(self, num_frames=1):
+        if tracemalloc.is_tracing():
+            print("tracemalloc is already running")
+            return
+        tracemalloc.start(num_frames)
+        self.last_snapshot = None
+        print(f"Tracing allocations with {num_frames} frames per traceback")
+
+    def stop_tracemalloc(self):
+        tracemalloc.stop()
+        self.last_snapshot = None
+        print("Stopped tracing allocations")
+
+    def snapshot_tracemalloc(self, top_n=20):
+        """
+        Takes a snapshot and prints the biggest allocation sites, or the biggest
+        changes if there is an earlier snapshot
+        """
+        if not tracemalloc.is_tracing():
+            print("tracemalloc is not running, start it first")
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+        path = self._output_path("tracemalloc", "snapshot")
+        snapshot.dump(path)
+
+        current, peak = tracemalloc.get_traced_memory()
+        print(
+            f"Traced memory {current / 2**20:.1f}MiB (peak {peak / 2**20:.1f}MiB), "
+            f"snapshot written to {path}"
+        )
+        if self.last_snapshot is None:
+            for stat in snapshot.statistics("lineno")[:top_n]:
+                print(stat)
+        else:
+            for stat in snapshot.compare_to(self.last_snapshot, "lineno")[:top_n]:
+                print(stat)
+        self.last_snapshot = snapshot
@@ -0,0 +1,195 @@
+import numpy as np
+import trueskill
+from trueskill import Rating
+
+# Draws are not very informative, only this fraction of their update is applied
+DRAW_UPDATE_FRACTION = 0.1
+
+
+def interpolate_draw(rating_old, rating_new):
+    return Rating(
+        DRAW_UPDATE_FRACTION * rating_new.mu
+        + (1 - DRAW_UPDATE_FRACTION) * rating_old.mu,
+        DRAW_UPDATE_FRACTION * rating_new.sigma
+        + (1 - DRAW_UPDATE_FRACTION) * rating_old.sigma,
+    )
+
+
+_ERFC_COEFFICIENTS = (
+    1.00002368,
+    0.37409196,
+    0.09678418,
+    -0.18628806,
+    0.27886807,
+    -1.13520398,
+    1.48851587,
+    -0.82215223,
+    0.17087277,
+)
+
+
+def _erfc(x):
+    # same approximation as the builtin backend of trueskill, so batched and
+    # incremental ratings agree up to rounding
+    z = np.abs(x)
+    t = 1.0 / (1.0 + z / 2.0)
+    poly = 0.0
+    for coefficient in reversed(_ERFC_COEFFICIENTS):
+        poly = coefficient + t * poly
+    r = t * np.exp(-z * z - 1.26551223 + t * poly)
+    return np.where(x < 0, 2.0 - r, r)
+
+
+def _cdf(x):
+    return 0.5 * _erfc(-x / np.sqrt(2))
+
+
+def _pdf(x):
+    return np.exp(-(x ** 2) / 2) / np.sqrt(2 * np.pi)
+
+
+def rate_1vs1_batch(mu_one, sigma_one, mu_two, sigma_two, drawn, env=None):
+    """
+    Vectorized trueskill.rate_1vs1 for independent games, player one won every
+    game that is not drawn. Draw updates are interpolated like in
+    GameServer.game_done. Returns the new mu_one, sigma_one, mu_two, sigma_two.
+    """
+    if env is None:
+        env = trueskill.global_env()
+    draw_margin = trueskill.calc_draw_margin(env.draw_probability, 2, env)
+
+    var_one = np.square(sigma_one) + env.tau ** 2
+    var_two = np.square(sigma_two) + env.tau ** 2
+    c_squared = 2 * env.beta ** 2 + var_one + var_two
+    c = np.sqrt(c_squared)
+    diff = (mu_one - mu_two) / c
+    margin = draw_margin / c
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # player one won
+        x = diff - margin
+        denom = _cdf(x)
+        v_win = np.where(denom > 0, _pdf(x) / denom, -x)
+        w_win = v_win * (v_win + x)
+
+        # draw
+        a, b = margin - np.abs(diff), -margin - np.abs(diff)
+        denom = _cdf(a) - _cdf(b)
+        v_draw_abs = np.where(denom != 0, (_pdf(b) - _pdf(a)) / denom, a)
+        v_draw = np.where(diff < 0, -v_draw_abs, v_draw_abs)
+        w_draw = v_draw_abs ** 2 + (a * _pdf(a) - b * _pdf(b)) / denom
+
+    v = np.where(drawn, v_draw, v_win)
+    w = np.where(drawn, w_draw, w_win)
+
+    new_mu_one = mu_one + var_one / c * v
+    new_mu_two = mu_two - var_two / c * v
+    new_sigma_one = np.sqrt(var_one * (1 - var_one / c_squared * w))
+    new_sigma_two = np.sqrt(var_two * (1 - var_two / c_squared * w))
+
+    f = np.where(drawn, DRAW_UPDATE_FRACTION, 1.0)
+    return (
+        f * new_mu_one + (1 - f) * mu_one,
+        f * new_sigma_one + (1 - f) * sigma_one,
+        f * new_mu_two + (1 - f) * mu_two,
+        f * new_sigma_two + (1 - f) * sigma_two,
+    )
+
+
+def schedule_rounds(player_one, player_two, num_players):
+    """
+    Assigns chronologically ordered games between player ids to rounds. No
+    player plays twice in a round and the games of every player stay in order,
+    so rating the rounds one after another gives the same result as rating the
+    games one by one.
+    """
+    last_round = [-1] * num_players
+    rounds = np.empty(len(player_one), dtype=np.int64)
+    for i, (one, two) in enumerate(zip(player_one.tolist(), player_two.tolist())):
+        r = max(last_round[one], last_round[two]) + 1
+        last_round[one] = last_round[two] = rounds[i] = r
+    return rounds
+
+
+def recompute_ratings(games, env=None):
+    """
+    Recomputes the ratings of all players from scratch. games are dicts with
+    player_one, player_two, timestamp and game_outcomes, in chronological order.
+    Games without game_outcomes can not be rated and raise a ValueError.
+
+    Returns the usernames, arrays of their final mu and sigma and the rating
+    history, one (username, timestamp, mu, sigma) entry per player and game
+    like the server writes them.
+    """
+    if env is None:
+        env = trueskill.global_env()
+
+    # interning, every outcome of a game is rated separately
+    ids = {}
+    one, two, winners, game_index = [], [], [], []
+    for i, game in enumerate(games):
+        p1 = ids.setdefault(game["player_one"], len(ids))
+        p2 = ids.setdefault(game["player_two"], len(ids))
+        if game["game_outcomes"] is None:
+            raise ValueError(f"Game {game.get('identifier')} has no game_outcomes")
+        for winner in game["game_outcomes"]:
+            one.append(p1)
+            two.append(p2)
+            winners.append(winner)
+            game_index.append(i)
+    usernames = list(ids)
+
+    one = np.array(one, dtype=np.int64)
+    two = np.array(two, dtype=np.int64)
+    winners = np.array(winners, dtype=np.int64)
+    game_index = np.array(game_index, dtype=np.int64)
+
+    # the winner is rated as player one
+    player_two_won = (winners != 0) & (winners != 1)
+    winner_id = np.where(player_two_won, two, one)
+    loser_id = np.where(player_two_won, one, two)
+    drawn = winners == 0
+
+    mu = np.full(len(usernames), env.mu, dtype=np.float64)
+    sigma = np.full(len(usernames), env.sigma, dtype=np.float64)
+    history_mu = np.empty((len(games), 2))
+    history_sigma = np.empty((len(games), 2))
+    # the history entry of a game is taken after its last outcome
+    last_outcome = np.ones(len(game_index), dtype=bool)
+    last_outcome[:-1] = game_index[:-1] != game_index[1:]
+
+    rounds = schedule_rounds(one, two, len(usernames))
+    order = np.argsort(rounds, kind="stable")
+    bounds = np.flatnonzero(np.diff(rounds[order])) + 1
+    for idx in np.split(order, bounds) if len(order) else ():
+        winner, loser = winner_id[idx], loser_id[idx]
+        mu_w, sigma_w, mu_l, sigma_l = rate_1vs1_batch(
+            mu[winner], sigma[winner], mu[loser], sigma[loser], drawn[idx], env
+        )
+        # player two is assigned last like in game_done, which only matters if
+        # someone played against themselves
+        swapped = player_two_won[idx]
+        mu[one[idx]] = np.where(swapped, mu_l, mu_w)
+        sigma[one[idx]] = np.where(swapped, sigma_l, sigma_w)
+        mu[two[idx]] = np.where(swapped, mu_w, mu_l)
+        sigma[two[idx]] = np.where(swapped, sigma_w, sigma_l)
+
+        done = idx[last_outcome[idx]]
+        history_mu[game_index[done]] = np.stack([mu[one[done]], mu[two[done]]], 1)
+        history_sigma[game_index[done]] = np.stack(
+            [sigma[one[done]], sigma[two[done]]], 1
+        )
+
+    rating_history = []
+    for i in np.unique(game_index).tolist():
+        game = games[i]
+        for k, username in enumerate((game["player_one"], game["player_two"])):
+            rating_history.append(
+                (
+                    username,
+                    game["timestamp"],
+                    float(history_mu[i, k]),
+                    float(history_sigma[i, k]),
+                )
+            )
+    return usernames, mu, sigma, rating_history
@@ -0,0 +1,175 @@
+import os
+import queue
+import threading
+import time
+from functools import partial
+
+from gym_multiplayer_server.common.game_record import (
+    append_game_record_chunk,
+    seal_game_record,
+)
+
+_STOP = object()
+
+
+class RecordWriter:
+    """
+    Write-behind persistence of matches. Chunks of running matches and seal
+    requests are handed over from the reactor thread through a queue and
+    written in order by a background thread, which fsyncs the written files in
+    batches.
+
+    max_queue_size is a soft limit on purpose. A full bounded queue would have
+    to block the reactor, which stalls every game, or drop jobs, which leaves
+    broken records behind. Jobs beyond it are kept in memory until the writer
+    caught up, logged and counted as overflowed. While the disk stalls, the
+    queue grows by one chunk per running game every chunk_size steps, its size
+    is exported as a metric.
+
+    In-progress records are listed in index_path if given, see
+    find_unsealed_game_records.
+    """
+
+    def __init__(
+        self,
+        max_queue_size=256,
+        fsync_batch_size=16,
+        fsync_interval=1.0,
+        index_path=None,
+    ):
+        self.queue = queue.Queue()
+        self.index_path = index_path
+        self.max_queue_size = max_queue_size
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+
+        self.num_submitted = 0
+        self.num_written = 0
+        self.num_failed = 0
+        self.num_overflowed = 0
+        self.overflowing = False
+        self.num_fsyncs = 0
+        self.max_queue_size_seen = 0
+        self.write_time = 0.0
+
+        self._unsynced_paths = {}
+        self._last_fsync = time.time()
+
+        self.thread = threading.Thread(
+            target=self._run, name="record-writer", daemon=True
+        )
+        self.thread.start()
+
+    # Called on the reactor thread
+    def submit_chunk(self, path, columns, **meta):
+        self._put(
+            (
+                partial(append_game_record_chunk, index_path=self.index_path),
+                path,
+                (columns,),
+                meta,
+            )
+        )
+
+    def submit_seal(self, path, fields, num_transitions, **meta):
+        self._put(
+            (
+                partial(seal_game_record, index_path=self.index_path),
+                path,
+                (fields, num_transitions),
+                meta,
+            )
+        )
+
+    def _put(self, job):
+        self.num_submitted += 1
+        self.queue.put_nowait(job)
+
+        queue_size = self.queue.qsize()
+        self.max_queue_size_seen = max(self.max_queue_size_seen, queue_size)
+        if queue_size > self.max_queue_size:
+            self.num_overflowed += 1
+            if not self.overflowing:
+                print(
+                    f"Record writer queue exceeds {self.max_queue_size} jobs, "
+                    f"the disk does not keep up"
+                )
+        self.overflowing = queue_size > self.max_queue_size
+
+    def close(self):
+        """
+        Writes and fsyncs everything still queued and stops the writer thread
+        """
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def get_stats(self):
+        return dict(
+            queue_size=self.queue.qsize(),
+            max_queue_size=self.max_queue_size_seen,
+            submitted=self.num_submitted,
+            written=self.num_written,
+            failed=self.num_failed,
+            overflowed=self.num_overflowed,
+            fsyncs=self.num_fsyncs,
+            mean_write_time=(
+                self.write_time / self.num_written if self.num_written else 0.0
+            ),
+        )
+
+    # Writer thread
+    def _run(self):
+        while True:
+            try:
+                job = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self._fsync()
+                continue
+
+            if job is _STOP:
+                self._fsync()
+                return
+
+            self._write(*job)
+
+            if (
+                len(self._unsynced_paths) >= self.fsync_batch_size
+                or time.time() - self._last_fsync > self.fsync_interval
+            ):
+                self._fsync()
+
+    def _write(self, write_fn, path, args, kwargs):
+        start = time.time()
+        try:
+            write_fn(path, *args, **kwargs)
+        except Exception as e:
+            self.num_failed += 1
+            print(f"Could not write game record {path}: {e}")
+            return
+
+        self.write_time += time.time() - start
+        self.num_written += 1
+        self._unsynced_paths[path] = True
+
+    def _fsync(self):
+        self._last_fsync = time.time()
+        if not self._unsynced_paths:
+            return
+
+        paths, self._unsynced_paths = list(self._unsynced_paths), {}
+        for path in paths:
+            try:
+                for name in os.listdir(path):
+                    _fsync_path(os.path.join(path, name))
+                _fsync_path(path)
+            except OSError as e:
+                print(f"Could not fsync game record {path}: {e}")
+        self.num_fsyncs += 1
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
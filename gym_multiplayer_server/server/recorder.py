@@ -0,0 +1,68 @@
+from gym_multiplayer_server.common.transition_buffer import TransitionBuffer
+
+
+class StreamingRecorder:
+    """
+    Records the transitions of a running game. Transitions are collected in a
+    fixed-size chunk, full chunks are appended to the segment files of the
+    game record by the record writer, so the memory per game stays flat no
+    matter how long the episodes are. The record is sealed when the game ends.
+
+    meta is stored with the first chunk, a record left unsealed by a crash is
+    sealed with it on the next start of the server.
+    """
+
+    def __init__(self, record_writer, path, chunk_size=256, **meta):
+        self.record_writer = record_writer
+        self.path = path
+        self.chunk_size = chunk_size
+        self.meta = meta
+
+        self.chunk = TransitionBuffer(capacity=chunk_size)
+        self.num_transitions = 0
+        self.episode_infos = {}
+        self.fields = None
+        self.sealed = False
+
+    def __len__(self):
+        return self.num_transitions + len(self.chunk)
+
+    def append(self, last_ob, action, ob, reward, done, info):
+        self.chunk.append(last_ob, action, ob, reward, done, info)
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.chunk) == 0:
+            return
+
+        # The chunk is reused, hand copies to the writer thread
+        columns = {name: column.copy() for name, column in self.chunk.columns().items()}
+        meta = {}
+        if self.fields is None:
+            self.fields = {
+                name: dict(dtype=column.dtype.str, shape=list(column.shape[1:]))
+                for name, column in columns.items()
+            }
+            meta = self.meta
+
+        for i, info in self.chunk.infos.items():
+            self.episode_infos[self.num_transitions + i] = info
+
+        self.record_writer.submit_chunk(self.path, columns, **meta)
+        self.num_transitions += len(self.chunk)
+        self.chunk.clear()
+
+    def seal(self, **meta):
+        if self.sealed:
+            return
+        self.sealed = True
+
+        self.flush()
+        self.record_writer.submit_seal(
+            self.path,
+            self.fields or {},
+            self.num_transitions,
+            episode_infos=self.episode_infos,
+            **meta,
+        )
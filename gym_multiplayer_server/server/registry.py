@@ -0,0 +1,63 @@
+class Registry:
+    """
+    Set of items (clients or games) partitioned by state. Insert, remove, state
+    transition and per-state counts are O(1), iteration order is insertion order.
+    """
+
+    def __init__(self, states):
+        self._state_of = {}
+        # dicts are used as insertion ordered sets
+        self._members = {state: {} for state in states}
+
+    def add(self, item, state):
+        if item in self._state_of:
+            self.move(item, state)
+            return
+        self._state_of[item] = state
+        self._members[state][item] = None
+
+    def move(self, item, state):
+        old_state = self._state_of.get(item)
+        if old_state is None:
+            raise KeyError(item)
+        if old_state == state:
+            return
+        del self._members[old_state][item]
+        self._members[state][item] = None
+        self._state_of[item] = state
+
+    def discard(self, item):
+        state = self._state_of.pop(item, None)
+        if state is not None:
+            del self._members[state][item]
+
+    def state_of(self, item):
+        return self._state_of.get(item)
+
+    def __contains__(self, item):
+        return item in self._state_of
+
+    def __len__(self):
+        return len(self._state_of)
+
+    def count(self, state):
+        return len(self._members[state])
+
+    def counts(self):
+        return {state: len(members) for state, members in self._members.items()}
+
+    def members(self, state):
+        """
+        Live view on the items in state, must not be iterated while the registry
+        is modified.
+        """
+        return self._members[state].keys()
+
+    def snapshot(self, state=None):
+        """
+        Copy of all items (or the items in state) that is safe to iterate while
+        items are added, moved or removed, e.g. from the cmd thread.
+        """
+        if state is None:
+            return list(self._state_of)
+        return list(self._members[state])
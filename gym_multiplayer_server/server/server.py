@@ -1,25 +1,43 @@
-import pickle
 import sys
 import os
+import threading
 import time
 import datetime
 import argparse
-from glob import glob
-import pathlib
 import numpy as np
 from dateutil.relativedelta import relativedelta
-from collections import defaultdict
-from trueskill import quality_1vs1, rate_1vs1, Rating
+from trueskill import rate_1vs1
 
 from zope.interface import implementer
 
 from twisted.cred import portal, checkers
 from twisted.spread import pb
-from twisted.internet import reactor, task
-
-from gym_multiplayer_server.server.player import Avatar
-from gym_multiplayer_server.server.game import Game
+from twisted.internet import reactor, task, threads
+from twisted.python import log
+from twisted.web import server as web_server
+
+from gym_multiplayer_server.common.game_record import (
+    find_unsealed_game_records,
+    open_records_index,
+    seal_unsealed_game_record,
+)
+from gym_multiplayer_server.common.leaderboard import Leaderboard
+from gym_multiplayer_server.common.timeseries import MultiResolutionStats
+from gym_multiplayer_server.server.batch_matchmaker import BatchMatchmaker
+from gym_multiplayer_server.server.binary_transport import BinaryServerFactory
+from gym_multiplayer_server.server.player import Avatar, ClientState
+from gym_multiplayer_server.server.record_writer import RecordWriter
+from gym_multiplayer_server.server.registry import Registry
+from gym_multiplayer_server.server.env_backend import EnvPool, create_env_backend
+from gym_multiplayer_server.server.game import Game, GameStates
+from gym_multiplayer_server.server.matchmaking import MatchmakingIndex
+from gym_multiplayer_server.server.metrics import MetricsResource, ServerMetrics
+from gym_multiplayer_server.server.profiling import ServerProfiler
+from gym_multiplayer_server.server.rating import interpolate_draw
+from gym_multiplayer_server.server.state_store import StateStores, create_state_store
 from gym_multiplayer_server.server.server_cmd import ServerCMD
+from gym_multiplayer_server.server.stall_detector import StallDetector
+from gym_multiplayer_server.server.tick_scheduler import TickScheduler
 
 
 def parseOptions():
@@ -40,6 +58,124 @@ def parseOptions():
         dest="working_dir",
         default="/tmp/laser-hockey-rl/server/logs",
     )
+    parser.add_argument(
+        "--users-db",
+        type=str,
+        dest="users_db",
+        default="./users.db",
+        help="Password file with username:password lines",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        dest="port",
+        default=33000,
+        help="Port of the Perspective Broker transport",
+    )
+    parser.add_argument(
+        "--binary-port",
+        type=int,
+        dest="binary_port",
+        default=None,
+        help="Port of the length-prefixed binary transport, disabled if not given. "
+        "Logins answer a random challenge with an HMAC-SHA256 keyed by the "
+        "password, so passwords never cross the wire, but the game traffic is "
+        "not encrypted, like with Perspective Broker",
+    )
+    parser.add_argument(
+        "--env-workers",
+        type=int,
+        dest="env_workers",
+        default=0,
+        help="Number of env worker processes, 0 steps the envs on the reactor thread",
+    )
+    parser.add_argument(
+        "--env-pool-size",
+        type=int,
+        dest="env_pool_size",
+        default=16,
+        help="Maximum number of idle pre-built envs kept for new games",
+    )
+    parser.add_argument(
+        "--tick-interval",
+        type=float,
+        dest="tick_interval",
+        default=0.0,
+        help="Step all ready games in lock-step batches every tick-interval seconds, "
+        "0 steps every game as soon as both actions arrived",
+    )
+    parser.add_argument(
+        "--matchmaking-interval",
+        type=float,
+        dest="matchmaking_interval",
+        default=0.0,
+        help="Pair all waiting players at once every matchmaking-interval seconds, "
+        "0 matches a player the moment it starts queuing",
+    )
+    parser.add_argument(
+        "--max-action-repeat",
+        type=int,
+        dest="max_action_repeat",
+        default=8,
+        help="Largest action repeat factor a client may ask for when queuing",
+    )
+    parser.add_argument(
+        "--waiting-timeout",
+        type=float,
+        dest="waiting_timeout",
+        default=0.0,
+        help="Abort a game if no opponent joined within waiting-timeout seconds, "
+        "0 waits forever",
+    )
+    parser.add_argument(
+        "--action-timeout",
+        type=float,
+        dest="action_timeout",
+        default=120.0,
+        help="Abort a running game if no action arrived for action-timeout seconds",
+    )
+    parser.add_argument(
+        "--state-store",
+        type=str,
+        dest="state_store",
+        default=StateStores.PICKLE,
+        choices=[StateStores.PICKLE, StateStores.SQLITE],
+        help="Store the server state as pickles or in the SQLite database state.db "
+        "in the working dir (import existing pickles with misc/import_pickle_state.py)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        dest="metrics_port",
+        default=None,
+        help="Serve metrics in the Prometheus text format on "
+        "http://127.0.0.1:metrics-port/metrics",
+    )
+    parser.add_argument(
+        "--stall-threshold",
+        type=float,
+        dest="stall_threshold",
+        default=0.25,
+        help="Capture the stack of the reactor when the event loop lags by more "
+        "than stall-threshold seconds, 0 disables the stall detector",
+    )
+    parser.add_argument(
+        "--record-queue-size",
+        type=int,
+        dest="record_queue_size",
+        default=256,
+        help="Number of game record writes that may wait for the disk before "
+        "further writes are logged and counted as overflowed. They are still "
+        "kept, blocking or dropping them would stall the server or break records",
+    )
+    parser.add_argument(
+        "--record-chunk-size",
+        type=int,
+        dest="record_chunk_size",
+        default=256,
+        help="Number of transitions a running game keeps in memory before they are "
+        "appended to its game record",
+    )
     args = parser.parse_args()
     return args
 
@@ -52,138 +188,256 @@ class GameServer:
 
     __VERSION__ = "1.0"
 
-    def __init__(self, working_dir: str, interactive=True):
+    def __init__(
+        self,
+        working_dir: str,
+        interactive=True,
+        env_workers=0,
+        env_pool_size=16,
+        tick_interval=0.0,
+        matchmaking_interval=0.0,
+        max_action_repeat=8,
+        waiting_timeout=0.0,
+        action_timeout=120.0,
+        record_queue_size=256,
+        record_chunk_size=256,
+        state_store=StateStores.PICKLE,
+        stall_threshold=0.25,
+        env_backend=None,
+    ):
 
         self.interactive = interactive
 
+        # histograms and counters for the metrics endpoint
+        self.metrics = ServerMetrics(self)
+
+        self.env_pool = EnvPool(max_size=env_pool_size)
+        if env_backend is None:
+            env_backend = create_env_backend(self.env_pool, env_workers)
+        self.env_backend = env_backend
+
+        self.max_action_repeat = max_action_repeat
+
+        # per-phase game timeouts in seconds, 0 disables a timeout
+        self.waiting_timeout = waiting_timeout
+        self.action_timeout = action_timeout
+
+        self.record_writer = RecordWriter(
+            max_queue_size=record_queue_size,
+            index_path=open_records_index(os.path.join(working_dir, "games")),
+        )
+        self.record_chunk_size = record_chunk_size
+
+        self.tick_scheduler = None
+        if tick_interval > 0:
+            self.tick_scheduler = TickScheduler(self.env_backend, tick_interval)
+
         self.avatars = {}
 
         self.active_avatars = []
 
-        self.all_connected_clients = []
-        self.idle_clients = []
-        self.waiting_clients = []
-        self.playing_clients = []
+        self.client_registry = Registry(
+            (ClientState.IDLE, ClientState.WAITING_FOR_GAME, ClientState.PLAYING)
+        )
 
         self.game_to_client_mapping = {}
         self.client_to_game_mapping = {}
 
         self.total_num_played_games = 0
-        self.all_games = []
-        self.running_games = []
-        self.waiting_games = []
+        self.game_registry = Registry(
+            (GameStates.WAITING_FOR_PLAYER, GameStates.GAME_RUNNING)
+        )
+        self.matchmaking_index = MatchmakingIndex()
 
-        self.leaderboard_matrix = {}
+        self.batch_matchmaker = None
+        if matchmaking_interval > 0:
+            self.batch_matchmaker = BatchMatchmaker(self, matchmaking_interval)
 
-        self.stats = defaultdict(dict)
+        self.leaderboard = Leaderboard()
+
+        # bounded multi-resolution time series sampled by the maintenance loop
+        self.stats = MultiResolutionStats()
+
+        # changes since the last save
+        self.dirty_results = set()
+        self.pending_rating_history = []
+        self.pending_finished_games = []
+
+        # only one save is written at a time, the shutdown save waits for it
+        self.save_lock = threading.Lock()
+        self.save_in_progress = False
 
         self.working_dir = working_dir
         os.makedirs(self.working_dir, exist_ok=True)
+        self.state_store = create_state_store(state_store, self.working_dir)
         self._load()
+        self._seal_unsealed_records()
+
+        # the server is created on the thread that runs the reactor
+        self.profiler = ServerProfiler(
+            os.path.join(self.working_dir, "profiles"), threading.get_ident()
+        )
+        self.stall_detector = None
+        if stall_threshold > 0:
+            self.stall_detector = StallDetector(
+                threading.get_ident(), stall_threshold, metrics=self.metrics
+            )
 
-        task.LoopingCall(self.maintainance_loop).start(10.0)
+        self.maintainance_call = task.LoopingCall(self.maintainance_loop)
+        self.maintainance_call.start(10.0)
 
         if self.interactive:
             self.server_cmd = ServerCMD(self)
             reactor.callInThread(self.server_cmd.cmdloop)
 
-        reactor.addSystemEventTrigger("before", "shutdown", self._close)
-
-    def _save(self):
-        ranking = {}
-        for username, avatar in self.avatars.items():
-            ranking[username] = (avatar.rating.mu, avatar.rating.sigma)
-            avatar.save(self.working_dir)
-
-        with open(os.path.join(self.working_dir, "trueskill-ranking.pkl"), "wb") as f:
-            pickle.dump(ranking, f)
-
-        with open(os.path.join(self.working_dir, "leaderboard.pkl"), "wb") as f:
-            pickle.dump(self.leaderboard_matrix, f)
-
-        with open(os.path.join(self.working_dir, "stats.pkl"), "wb") as f:
-            pickle.dump(self.stats, f)
+        self.shutdown_trigger = reactor.addSystemEventTrigger(
+            "before", "shutdown", self._close
+        )
 
-        with open(os.path.join(self.working_dir, "misc.pkl"), "wb") as f:
-            pickle.dump({"total_num_played_games": self.total_num_played_games}, f)
+    def _collect_changes(self):
+        """
+        Takes everything that changed since the last save, the dirty flags are
+        cleared
+        """
+        dirty_avatars = [avatar for avatar in self.avatars.values() if avatar.dirty]
+        for avatar in dirty_avatars:
+            avatar.dirty = False
+
+        changes = dict(
+            avatars=dirty_avatars,
+            results=self.dirty_results,
+            rating_history=self.pending_rating_history,
+            games=self.pending_finished_games,
+        )
+        self.dirty_results = set()
+        self.pending_rating_history = []
+        self.pending_finished_games = []
+        return changes
+
+    def _write_state(self, job):
+        with self.save_lock:
+            self.state_store.write(job)
+
+    def _save_failed(self, failure, changes, job):
+        log.err(failure, "Saving the server state failed")
+        # written again by the next save
+        for avatar in changes["avatars"]:
+            avatar.dirty = True
+        self.dirty_results |= changes["results"]
+        self.pending_rating_history[:0] = changes["rating_history"]
+        self.pending_finished_games[:0] = changes["games"]
+        self.state_store.failed(job)
+
+    def _save_done(self, _):
+        self.save_in_progress = False
+
+    def _save(self, blocking=False):
+        """
+        Writes everything that changed since the last save, in a thread pool
+        thread unless blocking is set. The changes are serialized on the
+        reactor thread.
+        """
+        if blocking:
+            job = self.state_store.collect(self, self._collect_changes(), closing=True)
+            self._write_state(job)
+            return
+
+        # skip, what changed in between stays dirty for the next save
+        if self.save_in_progress:
+            return
+
+        changes = self._collect_changes()
+        job = self.state_store.collect(self, changes)
+        self.save_in_progress = True
+        d = threads.deferToThread(self._write_state, job)
+        d.addErrback(self._save_failed, changes, job)
+        d.addBoth(self._save_done)
 
     def _load(self):
-        for avatar_state_file in glob(os.path.join(self.working_dir, "avatars", "*")):
-            username = pathlib.Path(avatar_state_file).stem
-            avatar = Avatar(username, self)
-            avatar.load(self.working_dir)
-            self.avatars[username.encode("utf-8")] = avatar
-
-        if os.path.exists(os.path.join(self.working_dir, "leaderboard.pkl")):
-            with open(os.path.join(self.working_dir, "leaderboard.pkl"), "rb") as f:
-                self.leaderboard_matrix = pickle.load(f)
-
-        if os.path.exists(os.path.join(self.working_dir, "stats.pkl")):
-            with open(os.path.join(self.working_dir, "stats.pkl"), "rb") as f:
-                self.stats = pickle.load(f)
-
-        if os.path.exists(os.path.join(self.working_dir, "misc.pkl")):
-            with open(os.path.join(self.working_dir, "misc.pkl"), "rb") as f:
-                self.__dict__.update(pickle.load(f))
+        self.state_store.load(self)
+
+    def _seal_unsealed_records(self):
+        """
+        Seals the records of the matches that were running when the server
+        stopped without closing them, as aborted records
+        """
+        games_path = os.path.join(self.working_dir, "games")
+        index_path = open_records_index(games_path)
+        for path in find_unsealed_game_records(games_path):
+            try:
+                seal_unsealed_game_record(path, index_path=index_path)
+            except Exception as e:
+                print(f"Could not seal game record {path}: {e}")
+            else:
+                print(f"Sealed unfinished game record {path}")
+        # from now on the index lists every open record, the next start does
+        # not need to walk games/ anymore
+        os.makedirs(index_path, exist_ok=True)
 
     def _close(self):
         print("Server stopped")
-        self._save()
+        # running games are recorded as aborted
+        for game in self.game_registry.snapshot():
+            game.abort("Game aborted, the server is shutting down")
+        self._save(blocking=True)
+        if self.tick_scheduler is not None:
+            self.tick_scheduler.stop()
+        if self.batch_matchmaker is not None:
+            self.batch_matchmaker.stop()
+        if self.stall_detector is not None:
+            self.stall_detector.stop()
+        self.env_backend.shutdown()
+        self.record_writer.close()
+        self.state_store.close()
 
     def abort_game(self, game, msg):
         game.abort(msg)
 
     def maintainance_loop(self):
         current_time = time.time()
-        for game in self.all_games:
-            if (
-                current_time - game.last_op_timestamp > 60 * 2
-                and not game.clients[1] is None
-            ):
-                game.abort("Game aborted due to timeout (2 min)")
-
-        for client in self.all_connected_clients:
-            if client.mind.broker.disconnected:
-                client.detached()
-        for client in self.idle_clients:
-            if client.mind.broker.disconnected:
-                client.detached()
-        for client in self.waiting_clients:
-            if client.mind.broker.disconnected:
-                client.detached()
-        for client in self.playing_clients:
-            if client.mind.broker.disconnected:
-                client.detached()
-
-        self.stats["games"].setdefault("total", []).append(
-            [current_time, self.total_num_played_games]
-        )
-        self.stats["games"].setdefault("total_open", []).append(
-            [current_time, len(self.all_games)]
-        )
-        self.stats["games"].setdefault("waiting", []).append(
-            [current_time, len(self.waiting_games)]
-        )
-        self.stats["games"].setdefault("running", []).append(
-            [current_time, len(self.running_games)]
+        self.stats.add_all(
+            "games",
+            current_time,
+            {
+                "total": self.total_num_played_games,
+                "total_open": len(self.game_registry),
+                "waiting": self.game_registry.count(GameStates.WAITING_FOR_PLAYER),
+                "running": self.game_registry.count(GameStates.GAME_RUNNING),
+            },
         )
 
-        self.stats["player"].setdefault("active_player", []).append(
-            [current_time, len(self.active_avatars)]
-        )
-        self.stats["player"].setdefault("total_clients", []).append(
-            [current_time, len(self.all_connected_clients)]
+        self.stats.add_all(
+            "player",
+            current_time,
+            {
+                "active_player": len(self.active_avatars),
+                "total_clients": len(self.client_registry),
+                "idle_clients": self.client_registry.count(ClientState.IDLE),
+                "waiting_clients": self.client_registry.count(
+                    ClientState.WAITING_FOR_GAME
+                ),
+                "playing_clients": self.client_registry.count(ClientState.PLAYING),
+            },
         )
-        self.stats["player"].setdefault("idle_clients", []).append(
-            [current_time, len(self.idle_clients)]
-        )
-        self.stats["player"].setdefault("waiting_clients", []).append(
-            [current_time, len(self.waiting_clients)]
-        )
-        self.stats["player"].setdefault("playing_clients", []).append(
-            [current_time, len(self.playing_clients)]
+
+        self.stats.add_all("env_pool", current_time, self.env_pool.get_stats())
+        self.stats.add_all(
+            "record_writer", current_time, self.record_writer.get_stats()
         )
 
+        if self.tick_scheduler is not None:
+            self.stats.add_all(
+                "tick_scheduler", current_time, self.tick_scheduler.get_stats()
+            )
+
+        if self.batch_matchmaker is not None:
+            self.stats.add_all(
+                "batch_matchmaker", current_time, self.batch_matchmaker.get_stats()
+            )
+
+        if self.stall_detector is not None:
+            self.stats.add_all("reactor", current_time, self.stall_detector.get_stats())
+
         self._save()
 
     # Functions called from cmd
@@ -195,23 +449,43 @@ class GameServer:
             )
         )
         print("".join(["-"] * 60))
-        for game in self.all_games:
+        for game in self.game_registry.snapshot():
             time_delta = relativedelta(
                 current_time, datetime.datetime.fromtimestamp(game.last_op_timestamp)
             )
             print(
                 "{:10}{:15}{:15}{:20}".format(
                     game.identifier,
-                    game.clients[0].avatar.username
-                    if game.clients[0] is not None
-                    else "",
-                    game.clients[1].avatar.username
-                    if game.clients[1] is not None
-                    else "",
+                    (
+                        game.clients[0].avatar.username
+                        if game.clients[0] is not None
+                        else ""
+                    ),
+                    (
+                        game.clients[1].avatar.username
+                        if game.clients[1] is not None
+                        else ""
+                    ),
                     f"{time_delta.days:02}d, {time_delta.hours:02}h, {time_delta.minutes:02}m, {time_delta.seconds:02}s",
                 )
             )
 
+    def show_counts(self):
+        client_counts = self.client_registry.counts()
+        game_counts = self.game_registry.counts()
+        print("{:25}{:>10}".format("", "Count"))
+        print("".join(["-"] * 35))
+        for name, count in [
+            ("Connected clients", len(self.client_registry)),
+            ("Idle clients", client_counts[ClientState.IDLE]),
+            ("Waiting clients", client_counts[ClientState.WAITING_FOR_GAME]),
+            ("Playing clients", client_counts[ClientState.PLAYING]),
+            ("Open games", len(self.game_registry)),
+            ("Waiting games", game_counts[GameStates.WAITING_FOR_PLAYER]),
+            ("Running games", game_counts[GameStates.GAME_RUNNING]),
+        ]:
+            print("{:25}{:>10}".format(name, count))
+
     def list_avatars(self):
         print(
             "{:15}{:20}{:15}{:15}{:15}{:15}".format(
@@ -237,26 +511,58 @@ class GameServer:
             )
 
     def show_leaderboard_matrix(self):
-        users = list(self.leaderboard_matrix.keys())
+        users = self.leaderboard.players
+        results = self.leaderboard.results
+        played = self.leaderboard.played()
 
         print(("{:<10}" * (len(users) + 1)).format(" ", *users))
         print("-" * (10 * (len(users) + 1)))
-        for user1 in users:
+        for i, user1 in enumerate(users):
             ln = "{:<10}".format(user1)
-            for user2 in users:
-                if user1 == user2:
+            for j in range(len(users)):
+                if i == j or not played[i, j]:
                     ln += " " * 10
                     continue
-                if user2 not in self.leaderboard_matrix[user1]:
-                    ln += " " * 10
-                    continue
-                ln += "{:<10}".format(
-                    f'{self.leaderboard_matrix[user1][user2]["wins"]}/'
-                    f'{self.leaderboard_matrix[user1][user2]["losses"]}/'
-                    f'{self.leaderboard_matrix[user1][user2]["draws"]}'
-                )
+                ln += "{:<10}".format("/".join(str(x) for x in results[i, j]))
             print(ln)
 
+    def show_stalls(self, num=20):
+        if self.stall_detector is None:
+            print("The stall detector is disabled")
+            return
+        stalls = self.stall_detector.recent_stalls()
+        print("{:5}{:22}{:>10}  {}".format("#", "Time", "Lag [s]", "Callback"))
+        print("".join(["-"] * 80))
+        # most recent first, the numbers are the ones show_stall takes
+        for index in reversed(range(max(len(stalls) - num, 0), len(stalls))):
+            stall = stalls[index]
+            print(
+                "{:<5}{:22}{:>10.3f}  {}".format(
+                    index,
+                    datetime.datetime.fromtimestamp(stall["time"]).strftime(
+                        "%Y-%m-%d %H:%M:%S"
+                    ),
+                    stall["lag"],
+                    stall["callback"] or "unknown",
+                )
+            )
+
+    def show_stall(self, index):
+        if self.stall_detector is None:
+            print("The stall detector is disabled")
+            return
+        stalls = self.stall_detector.recent_stalls()
+        if not -len(stalls) <= index < len(stalls):
+            print(f"No stall {index}, {len(stalls)} stalls are kept")
+            return
+        stall = stalls[index]
+        print(f"Stalled for {stall['lag']:.3f}s in {stall['callback'] or 'unknown'}")
+        if stall["stack"] is None:
+            print("The stall ended before its stack was captured")
+            return
+        print(f"Captured in {stall['location']}")
+        print("".join(stall["stack"].format()))
+
     def quit(self, *args, **kwargs):
         reactor.stop()
 
@@ -264,37 +570,15 @@ class GameServer:
     def join_game(self, client):
         game = None
 
-        all_eligible_games = [
-            potential_game
-            for potential_game in self.waiting_games
-            if (potential_game.clients[0].avatar is not client.avatar)
-            and not (
-                "BasicOpponent" in potential_game.clients[0].avatar.username
-                and "BasicOpponent" in client.avatar.username
-            )
-        ]  # not strong against weak
-        num_total = len(self.all_connected_clients)
-        if (
-            len(all_eligible_games) > num_total // 6
+        num_total = len(self.client_registry)
+        # the batch matchmaker pairs the waiting games periodically
+        if self.batch_matchmaker is None and (
+            self.matchmaking_index.num_eligible(client.avatar) > num_total // 6
         ):  # only match up of there is pool to choose from
-            own_rating = client.avatar.rating
-            qualities = np.array(
-                [
-                    quality_1vs1(own_rating, g.clients[0].avatar.rating)
-                    for g in all_eligible_games
-                ]
-            )
-            # add something for long waiting_time (5 minutes means you have a very high chance to be matched)
-            waiting_time = time.time() - np.array(
-                [g.last_op_timestamp for g in all_eligible_games]
-            )
-            qualities += np.minimum(1.0, waiting_time / (60.0 * 5))
-            game_idx = np.random.choice(
-                range(len(qualities)), p=qualities / np.sum(qualities)
-            )
-            game = all_eligible_games[game_idx]
-            self.waiting_games.remove(game)
-            game.add_player(client)
+            game = self.matchmaking_index.choose(client.avatar)
+            if game is not None:
+                # moves the game to running
+                game.add_player(client)
 
         if game is None:
             game = Game(server=self)
@@ -307,64 +591,21 @@ class GameServer:
         player_one, player_two = [c.avatar.username for c in game.clients]
         player_one_avatar, player_two_avatar = [c.avatar for c in game.clients]
         for winner in game.game_outcomes:
-            if player_one not in self.leaderboard_matrix:
-                self.leaderboard_matrix[player_one] = dict()
-                self.leaderboard_matrix[player_one]["total"] = {
-                    "wins": 0,
-                    "losses": 0,
-                    "draws": 0,
-                }
-            if player_two not in self.leaderboard_matrix[player_one]:
-                self.leaderboard_matrix[player_one][player_two] = {
-                    "wins": 0,
-                    "losses": 0,
-                    "draws": 0,
-                }
-
-            if player_two not in self.leaderboard_matrix:
-                self.leaderboard_matrix[player_two] = dict()
-                self.leaderboard_matrix[player_two]["total"] = {
-                    "wins": 0,
-                    "losses": 0,
-                    "draws": 0,
-                }
-            if player_one not in self.leaderboard_matrix[player_two]:
-                self.leaderboard_matrix[player_two][player_one] = {
-                    "wins": 0,
-                    "losses": 0,
-                    "draws": 0,
-                }
-
-            def rating_interpolation(rating_old, rating_new):
-                return Rating(
-                    0.1 * rating_new.mu + 0.9 * rating_old.mu,
-                    0.1 * rating_new.sigma + 0.9 * rating_old.sigma,
-                )
+            self.leaderboard.record(player_one, player_two, winner)
 
+            # keep in sync with rating.recompute_ratings (misc/recompute_ratings.py)
             if winner == 0:
-                self.leaderboard_matrix[player_one][player_two]["draws"] += 1
-                self.leaderboard_matrix[player_two][player_one]["draws"] += 1
-                self.leaderboard_matrix[player_one]["total"]["draws"] += 1
-                self.leaderboard_matrix[player_two]["total"]["draws"] += 1
                 new_one, new_two = rate_1vs1(
                     player_one_avatar.rating, player_two_avatar.rating, drawn=True
                 )
                 # apply only 10% of update, because draws are not very informative
-                new_one = rating_interpolation(player_one_avatar.rating, new_one)
-                new_two = rating_interpolation(player_two_avatar.rating, new_two)
+                new_one = interpolate_draw(player_one_avatar.rating, new_one)
+                new_two = interpolate_draw(player_two_avatar.rating, new_two)
             elif winner == 1:
-                self.leaderboard_matrix[player_one][player_two]["wins"] += 1
-                self.leaderboard_matrix[player_two][player_one]["losses"] += 1
-                self.leaderboard_matrix[player_one]["total"]["wins"] += 1
-                self.leaderboard_matrix[player_two]["total"]["losses"] += 1
                 new_one, new_two = rate_1vs1(
                     player_one_avatar.rating, player_two_avatar.rating
                 )
             else:
-                self.leaderboard_matrix[player_one][player_two]["losses"] += 1
-                self.leaderboard_matrix[player_two][player_one]["wins"] += 1
-                self.leaderboard_matrix[player_one]["total"]["losses"] += 1
-                self.leaderboard_matrix[player_two]["total"]["wins"] += 1
                 new_two, new_one = rate_1vs1(
                     player_two_avatar.rating, player_one_avatar.rating
                 )
@@ -372,9 +613,40 @@ class GameServer:
             player_one_avatar.rating = new_one
             player_two_avatar.rating = new_two
 
+        current_time = time.time()
+        player_one_avatar.dirty = True
+        player_two_avatar.dirty = True
+        self.dirty_results |= {(player_one, player_two), (player_two, player_one)}
+        self.pending_rating_history += [
+            (avatar.username, current_time, avatar.rating.mu, avatar.rating.sigma)
+            for avatar in (player_one_avatar, player_two_avatar)
+        ]
+        self.pending_finished_games.append(
+            dict(
+                identifier=game.identifier,
+                player_one=player_one,
+                player_two=player_two,
+                timestamp=current_time,
+                game_outcomes=list(game.game_outcomes),
+                path=game.recorder.path,
+            )
+        )
+
         self.total_num_played_games += 1
 
 
+class NoDelayBroker(pb.Broker):
+    """
+    Broker sending every message at once. Observations are sent from callbacks
+    after the ACK of the action went out, Nagle's algorithm would hold them back
+    until the delayed ACK of the client arrives.
+    """
+
+    def connectionMade(self):
+        self.transport.setTcpNoDelay(True)
+        super().connectionMade()
+
+
 @implementer(portal.IRealm)
 class GameServerRealm:
     def requestAvatar(self, avatarID, mind, *interfaces):
@@ -386,17 +658,42 @@ class GameServerRealm:
             self.server.avatars[avatarID] = avatar
         else:
             avatar = self.server.avatars[avatarID]
+        avatar.attached(mind)
         return pb.IPerspective, avatar, lambda a=avatar: a.detached(mind)
 
 
 def main(opts):
     realm = GameServerRealm()
     realm.server = GameServer(
-        interactive=opts.interactive, working_dir=opts.working_dir
+        interactive=opts.interactive,
+        working_dir=opts.working_dir,
+        env_workers=opts.env_workers,
+        env_pool_size=opts.env_pool_size,
+        tick_interval=opts.tick_interval,
+        matchmaking_interval=opts.matchmaking_interval,
+        max_action_repeat=opts.max_action_repeat,
+        waiting_timeout=opts.waiting_timeout,
+        action_timeout=opts.action_timeout,
+        record_queue_size=opts.record_queue_size,
+        record_chunk_size=opts.record_chunk_size,
+        state_store=opts.state_store,
+        stall_threshold=opts.stall_threshold,
     )
-    checker = checkers.FilePasswordDB("./users.db", cache=True)
+    checker = checkers.FilePasswordDB(opts.users_db, cache=True)
     p = portal.Portal(realm, [checker])
-    reactor.listenTCP(33000, pb.PBServerFactory(p))
+    factory = pb.PBServerFactory(p)
+    factory.protocol = NoDelayBroker
+    reactor.listenTCP(opts.port, factory)
+    if opts.binary_port is not None:
+        reactor.listenTCP(
+            opts.binary_port, BinaryServerFactory(p, realm.server.__VERSION__)
+        )
+    if opts.metrics_port is not None:
+        reactor.listenTCP(
+            opts.metrics_port,
+            web_server.Site(MetricsResource(realm.server.metrics)),
+            interface="127.0.0.1",
+        )
     reactor.run()
 
 
@@ -17,6 +17,10 @@ class ServerCMD(cmd.Cmd):
         "list all games"
         self.server.list_all_games()
 
+    def do_show_counts(self, arg):
+        "show number of clients and games per state"
+        self.server.show_counts()
+
     def do_list_avatars(self, arg):
         "list avatars"
         self.server.list_avatars()
@@ -25,10 +29,66 @@ class ServerCMD(cmd.Cmd):
         "Show leaderboard"
         self.server.show_leaderboard_matrix()
 
+    def do_show_stalls(self, arg):
+        "list the latest reactor stalls: show_stalls [NUM]"
+        args = self._parse_args(arg, (int,), (20,))
+        if args is not None:
+            self.server.show_stalls(*args)
+
+    def do_show_stall(self, arg):
+        "show the stack captured during a stall: show_stall [NUMBER]"
+        args = self._parse_args(arg, (int,), (-1,))
+        if args is not None:
+            self.server.show_stall(*args)
+
+    def do_profile(self, arg):
+        "sample the reactor thread: profile SECONDS [TOP_N] [INTERVAL_MS]"
+        args = self._parse_args(arg, (float, int, float), (10.0, 20, 5.0))
+        if args is not None:
+            seconds, top_n, interval = args
+            self.server.profiler.start_sampling(seconds, interval / 1000, top_n)
+
+    def do_cprofile(self, arg):
+        "run cProfile on the reactor thread: cprofile SECONDS [TOP_N]"
+        args = self._parse_args(arg, (float, int), (10.0, 20))
+        if args is not None:
+            self.server.profiler.start_cprofile(*args)
+
+    def do_profile_stop(self, arg):
+        "stop the running profile early"
+        self.server.profiler.stop()
+
+    def do_tracemalloc_start(self, arg):
+        "start tracing allocations: tracemalloc_start [NUM_FRAMES]"
+        args = self._parse_args(arg, (int,), (1,))
+        if args is not None:
+            self.server.profiler.start_tracemalloc(*args)
+
+    def do_tracemalloc_snapshot(self, arg):
+        "show allocations, diff to the last snapshot: tracemalloc_snapshot [TOP_N]"
+        args = self._parse_args(arg, (int,), (20,))
+        if args is not None:
+            self.server.profiler.snapshot_tracemalloc(*args)
+
+    def do_tracemalloc_stop(self, arg):
+        "stop tracing allocations"
+        self.server.profiler.stop_tracemalloc()
+
     def do_quit(self, arg):
         reactor.callFromThread(self.server.quit)
         return True
 
+    def _parse_args(self, arg, types, defaults):
+        values = arg.split()
+        if len(values) > len(types):
+            print(f"Expected at most {len(types)} arguments")
+            return None
+        try:
+            return [t(v) for t, v in zip(types, values)] + list(defaults[len(values) :])
+        except ValueError as e:
+            print(e)
+            return None
+
     def precmd(self, line):
         line = line.lower()
         return line
@@ -0,0 +1,140 @@
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import twisted
+from twisted.internet import reactor
+
+from gym_multiplayer_server.server.profiling import frame_name
+
+TWISTED_DIR = os.path.dirname(twisted.__file__) + os.sep
+
+
+def find_callback(frame):
+    """
+    Returns the name of the outermost frame below the reactor loop that is not
+    part of twisted, the callback the reactor is running
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    in_reactor = False
+    for frame in reversed(frames):
+        if frame.f_code.co_filename.startswith(TWISTED_DIR):
+            in_reactor = True
+        elif in_reactor:
+            return frame_name(frame)
+    return frame_name(frames[0]) if frames else None
+
+
+class StallDetector:
+    """
+    Watchdog of the reactor. A heartbeat on the reactor measures by how much it
+    is late, the event-loop lag. A watchdog thread captures the stack of the
+    reactor thread once the heartbeat is overdue by half the threshold, which
+    shows the callback that blocks the reactor. Lags above threshold seconds are
+    recorded as stalls.
+    """
+
+    def __init__(
+        self, reactor_thread_id, threshold, interval=0.05, max_stalls=100, metrics=None
+    ):
+        self.reactor_thread_id = reactor_thread_id
+        self.threshold = threshold
+        self.interval = interval
+        self.metrics = metrics
+
+        self.lock = threading.Lock()
+        # monotonic time the next heartbeat is due
+        self.due = time.monotonic() + self.interval
+        # stack captured by the watchdog while the heartbeat was overdue
+        self.capture = None
+
+        self.stalls = deque(maxlen=max_stalls)
+        self.num_stalls = 0
+        self.lags = []
+        self.window_stalls = 0
+
+        self.heartbeat = reactor.callLater(self.interval, self._beat)
+        self._stop = threading.Event()
+        self.watchdog = threading.Thread(
+            target=self._watch, name="StallDetector", daemon=True
+        )
+        self.watchdog.start()
+
+    def _beat(self):
+        now = time.monotonic()
+        with self.lock:
+            lag = max(now - self.due, 0.0)
+            capture, self.capture = self.capture, None
+            self.due = now + self.interval
+        self.heartbeat = reactor.callLater(self.interval, self._beat)
+
+        self.lags.append(lag)
+        if self.metrics is not None:
+            self.metrics.reactor_lag.observe(lag)
+        if lag >= self.threshold:
+            self._record(lag, capture)
+
+    def _record(self, lag, capture):
+        if capture is None:
+            # the stall ended before the watchdog looked
+            capture = dict(callback=None, location=None, stack=None)
+        stall = dict(time=time.time() - lag, lag=lag, **capture)
+        with self.lock:
+            self.stalls.append(stall)
+        self.num_stalls += 1
+        self.window_stalls += 1
+        if self.metrics is not None:
+            self.metrics.reactor_stalls.inc()
+        print(f"Reactor stalled for {lag:.3f}s in {stall['callback'] or 'unknown'}")
+
+    # Watchdog thread
+    def _watch(self):
+        poll_interval = min(self.interval, self.threshold / 4)
+        while not self._stop.wait(poll_interval):
+            with self.lock:
+                due = self.due
+                # captured early so that stalls just above the threshold have a stack
+                overdue = time.monotonic() - due
+                if self.capture is not None or overdue < self.threshold / 2:
+                    continue
+            frame = sys._current_frames().get(self.reactor_thread_id)
+            if frame is None:
+                continue
+            capture = dict(
+                callback=find_callback(frame),
+                location=frame_name(frame),
+                stack=traceback.extract_stack(frame),
+            )
+            del frame
+            with self.lock:
+                # only keep it if the heartbeat is still waiting for this stall
+                if self.due == due:
+                    self.capture = capture
+
+    def stop(self):
+        self._stop.set()
+        if self.heartbeat.active():
+            self.heartbeat.cancel()
+
+    def recent_stalls(self):
+        with self.lock:
+            return list(self.stalls)
+
+    def get_stats(self):
+        """
+        Returns the lag metrics since the last call and starts a new window
+        """
+        lags, self.lags = self.lags, []
+        stalls, self.window_stalls = self.window_stalls, 0
+        return dict(
+            mean_lag=sum(lags) / len(lags) if lags else 0.0,
+            max_lag=max(lags) if lags else 0.0,
+            stalls=stalls,
+            total_stalls=self.num_stalls,
+        )
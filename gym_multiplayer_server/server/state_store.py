@@ -0,0 +1,220 @@
+import os
+import pathlib
+import pickle
+import time
+from collections import defaultdict
+from glob import glob
+
+from gym_multiplayer_server.common.leaderboard import (
+    LEADERBOARD_FILE,
+    Leaderboard,
+    dumps_snapshot,
+)
+from gym_multiplayer_server.common.state_db import STATE_DB_FILE, StateDB
+from gym_multiplayer_server.common.timeseries import MultiResolutionStats
+from gym_multiplayer_server.server.persistence import write_files
+from gym_multiplayer_server.server.player import Avatar
+
+
+class StateStores:
+    PICKLE = "pickle"
+    SQLITE = "sqlite"
+
+
+class PickleStateStore:
+    """
+    Stores the server state as pickles in the working dir: one file per avatar
+    plus the ranking, stats and misc pickles, and the binary leaderboard dump.
+
+    collect runs on the reactor thread and serializes the changes, except for
+    the leaderboard which is only copied there and serialized by write in a
+    thread pool thread.
+    """
+
+    def __init__(self, working_dir):
+        self.working_dir = working_dir
+        self.leaderboard_written = False
+        self.saved_total_num_played_games = None
+
+    def _path(self, name):
+        return os.path.join(self.working_dir, name)
+
+    def load(self, server):
+        for avatar_state_file in glob(os.path.join(self.working_dir, "avatars", "*")):
+            username = pathlib.Path(avatar_state_file).stem
+            avatar = Avatar(username, server)
+            avatar.load(self.working_dir)
+            server.avatars[username.encode("utf-8")] = avatar
+
+        if os.path.exists(self._path(LEADERBOARD_FILE)):
+            server.leaderboard = Leaderboard.load(self._path(LEADERBOARD_FILE))
+            self.leaderboard_written = True
+        elif os.path.exists(self._path("leaderboard.pkl")):
+            # nested dicts written by older servers
+            with open(self._path("leaderboard.pkl"), "rb") as f:
+                server.leaderboard = Leaderboard.from_dict(pickle.load(f))
+
+        if os.path.exists(self._path("stats.pkl")):
+            with open(self._path("stats.pkl"), "rb") as f:
+                stats = pickle.load(f)
+            # lists of samples written by older servers
+            if isinstance(stats, dict):
+                stats = MultiResolutionStats.from_samples(stats)
+            server.stats = stats
+
+        if os.path.exists(self._path("misc.pkl")):
+            with open(self._path("misc.pkl"), "rb") as f:
+                server.__dict__.update(pickle.load(f))
+            self.saved_total_num_played_games = server.total_num_played_games
+
+    def collect(self, server, changes, closing=False):
+        files = []
+        leaderboard = None
+
+        for avatar in changes["avatars"]:
+            files.append(
+                (avatar.state_path(self.working_dir), pickle.dumps(avatar.get_state()))
+            )
+
+        if changes["avatars"]:
+            ranking = {
+                username: (avatar.rating.mu, avatar.rating.sigma)
+                for username, avatar in server.avatars.items()
+            }
+            files.append((self._path("trueskill-ranking.pkl"), pickle.dumps(ranking)))
+
+        if changes["results"] or not self.leaderboard_written:
+            leaderboard = server.leaderboard.snapshot()
+            self.leaderboard_written = True
+
+        # stats are updated by every maintenance loop, their size is bounded
+        files.append((self._path("stats.pkl"), pickle.dumps(server.stats)))
+
+        if self.saved_total_num_played_games != server.total_num_played_games:
+            files.append(
+                (
+                    self._path("misc.pkl"),
+                    pickle.dumps(
+                        {"total_num_played_games": server.total_num_played_games}
+                    ),
+                )
+            )
+            self.saved_total_num_played_games = server.total_num_played_games
+
+        return dict(files=files, leaderboard=leaderboard)
+
+    def write(self, job):
+        files = job["files"]
+        if job["leaderboard"] is not None:
+            files = files + [
+                (self._path(LEADERBOARD_FILE), dumps_snapshot(job["leaderboard"]))
+            ]
+        write_files(files)
+
+    def failed(self, job):
+        self.leaderboard_written = False
+        self.saved_total_num_played_games = None
+
+    def close(self):
+        pass
+
+
+class SQLiteStateStore:
+    """
+    Stores the server state in the SQLite database working_dir/state.db. Every
+    save is written as one transaction containing the changed avatars and
+    pairwise results, the new rating history entries, stats samples and
+    finished games.
+    """
+
+    def __init__(self, working_dir):
+        self.working_dir = working_dir
+        self.db = StateDB(os.path.join(working_dir, STATE_DB_FILE))
+        self.saved_total_num_played_games = None
+        # start of the newest finest resolution bucket of each stat that is in
+        # the database
+        self.saved_stats = defaultdict(lambda: float("-inf"))
+
+    def load(self, server):
+        for username, state in self.db.load_avatars().items():
+            avatar = Avatar(username, server)
+            avatar.set_state(state)
+            server.avatars[username.encode("utf-8")] = avatar
+
+        server.leaderboard = Leaderboard.from_dict(self.db.load_leaderboard())
+
+        # only the samples still covered by the coarsest resolution are kept
+        stats = MultiResolutionStats()
+        retention = max(res * size for res, size in stats.resolutions)
+        for group, key, t, value in self.db.load_stats(since=time.time() - retention):
+            stats.add(group, key, t, value)
+            self.saved_stats[(group, key)] = t
+        server.stats = stats
+
+        server.__dict__.update(self.db.load_misc())
+        self.saved_total_num_played_games = server.total_num_played_games
+
+    def collect(self, server, changes, closing=False):
+        results = []
+        for player, opponent in changes["results"]:
+            results.append(
+                (player, opponent) + server.leaderboard.result(player, opponent)
+            )
+
+        # the finest resolution buckets (i.e. the samples of the maintenance loop)
+        # are written once they are closed, or when the server shuts down
+        stats = []
+        previously_saved_stats = {}
+        for group, key in server.stats.keys():
+            series = server.stats.series[(group, key)]
+            saved = self.saved_stats[(group, key)]
+            buckets = series.levels[0].query(start=saved)
+            closed = buckets["time"] > saved
+            if not closing:
+                # the newest bucket is still open
+                closed[-1:] = False
+            stats.extend(
+                (group, key, float(t), float(value))
+                for t, value in zip(buckets["time"][closed], buckets["mean"][closed])
+            )
+            if closed.any():
+                previously_saved_stats[(group, key)] = saved
+                self.saved_stats[(group, key)] = float(buckets["time"][closed][-1])
+
+        misc = None
+        if self.saved_total_num_played_games != server.total_num_played_games:
+            misc = {"total_num_played_games": server.total_num_played_games}
+            self.saved_total_num_played_games = server.total_num_played_games
+
+        avatar_games = []
+        for game in changes["games"]:
+            avatar_games.append((game["player_one"], game["identifier"]))
+            avatar_games.append((game["player_two"], game["identifier"]))
+
+        return dict(
+            avatars=[avatar.get_state() for avatar in changes["avatars"]],
+            avatar_games=avatar_games,
+            results=results,
+            rating_history=changes["rating_history"],
+            stats=stats,
+            games=changes["games"],
+            misc=misc,
+            previously_saved_stats=previously_saved_stats,
+        )
+
+    def write(self, job):
+        self.db.write(**{k: v for k, v in job.items() if k != "previously_saved_stats"})
+
+    def failed(self, job):
+        for stat, saved in job["previously_saved_stats"].items():
+            self.saved_stats[stat] = min(self.saved_stats[stat], saved)
+        self.saved_total_num_played_games = None
+
+    def close(self):
+        self.db.close()
+
+
+def create_state_store(kind, working_dir):
+    if kind == StateStores.SQLITE:
+        return SQLiteStateStore(working_dir)
+    return PickleStateStore(working_dir)
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+from twisted.internet import task
+from twisted.python import failure, log
+
+from gym_multiplayer_server.server.env_backend import EnvWorkerError
+
+
+class TickScheduler:
+    """
+    Lock-step mode of the server. Instead of stepping a game as soon as both of
+    its actions arrived, games are collected and all games that are ready within
+    one tick window are stepped together as one batch through the env backend.
+    """
+
+    def __init__(self, env_backend, tick_interval):
+        self.env_backend = env_backend
+        self.tick_interval = tick_interval
+
+        self.ready_games = {}
+        self.tick_in_progress = False
+
+        self.num_ticks = 0
+        self.batch_sizes = []
+        self.latencies = []
+
+        self.loop = task.LoopingCall(self.tick)
+        self.loop.start(self.tick_interval, now=False)
+
+    def submit(self, game, action):
+        self.ready_games[game] = action
+
+    def tick(self):
+        # Skip this tick while the workers are still busy with the last batch,
+        # the ready games are picked up by the next one
+        if self.tick_in_progress or not self.ready_games:
+            return
+
+        batch, self.ready_games = self.ready_games, {}
+        games = list(batch.keys())
+        actions = [batch[game] for game in games]
+
+        self.tick_in_progress = True
+        tick_start = time.time()
+
+        d = self.env_backend.step_batch(
+            [game.identifier for game in games],
+            [np.concatenate(action) for action in actions],
+            [game.action_repeat for game in games],
+        )
+        d.addCallbacks(
+            self._fan_out,
+            self._batch_error,
+            callbackArgs=(games, actions, tick_start),
+            errbackArgs=(games,),
+        )
+        d.addErrback(log.err)
+        d.addBoth(self._tick_done)
+
+    def _fan_out(self, results, games, actions, tick_start):
+        for game, action, (success, result) in zip(games, actions, results):
+            if success:
+                game._on_step(result, action)
+            else:
+                game._env_error(failure.Failure(EnvWorkerError(result)))
+
+        self.num_ticks += 1
+        self.batch_sizes.append(len(games))
+        self.latencies.append(time.time() - tick_start)
+
+    def _batch_error(self, f, games):
+        for game in games:
+            game._env_error(f)
+
+    def _tick_done(self, _):
+        self.tick_in_progress = False
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def get_stats(self):
+        """
+        Returns the tick metrics since the last call and starts a new window
+        """
+        batch_sizes, self.batch_sizes = self.batch_sizes, []
+        latencies, self.latencies = self.latencies, []
+
+        return dict(
+            ticks=self.num_ticks,
+            pending_games=len(self.ready_games),
+            mean_batch_size=float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+            max_batch_size=int(np.max(batch_sizes)) if batch_sizes else 0,
+            mean_latency=float(np.mean(latencies)) if latencies else 0.0,
+            max_latency=float(np.max(latencies)) if latencies else 0.0,
+        )
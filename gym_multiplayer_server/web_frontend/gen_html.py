@@ -1,12 +1,24 @@
 import os
 import pickle
 import datetime
+import time
 from shutil import copyfile
 import numpy as np
 import argparse
 
 from pychartjs import BaseChart, ChartType, Color, Options
 
+from gym_multiplayer_server.common.leaderboard import LEADERBOARD_FILE, Leaderboard
+from gym_multiplayer_server.common.state_db import STATE_DB_FILE, StateDB
+from gym_multiplayer_server.common.timeseries import (
+    MultiResolutionStats,
+    resolution_for_span,
+)
+
+# default time span of the charts, the resolution follows from it
+STATS_SPAN = 5000 * 10
+STATS_MAX_POINTS = 1000
+
 
 def parseOptions():
     parser = argparse.ArgumentParser(
@@ -24,6 +36,13 @@ def parseOptions():
         dest="working_dir",
         default=".",
     )
+    parser.add_argument(
+        "--stats-span",
+        type=int,
+        dest="stats_span",
+        default=STATS_SPAN,
+        help="Time span of the charts in seconds",
+    )
     args = parser.parse_args()
     return args
 
@@ -54,15 +73,27 @@ class LineChart(BaseChart):
 
 
 class Fronend:
-    def __init__(self, working_dir, output_dir) -> None:
+    def __init__(self, working_dir, output_dir, stats_span=STATS_SPAN) -> None:
 
         self.working_dir = working_dir
         self.output_dir = output_dir
 
-        with open(os.path.join(__file__, "templates/head.html"), "r") as f:
+        self.stats_span = stats_span
+        self.stats_resolution = resolution_for_span(stats_span, STATS_MAX_POINTS)
+
+        # the SQLite state store is queried instead of the pickles if the server
+        # writes one
+        self.state_db = None
+        if os.path.exists(os.path.join(self.working_dir, STATE_DB_FILE)):
+            self.state_db = StateDB(
+                os.path.join(self.working_dir, STATE_DB_FILE), readonly=True
+            )
+
+        templates = os.path.join(os.path.dirname(__file__), "templates")
+        with open(os.path.join(templates, "head.html"), "r") as f:
             self.head = f.read()
 
-        with open(os.path.join(__file__, "templates/footer.html"), "r") as f:
+        with open(os.path.join(templates, "footer.html"), "r") as f:
             self.footer = f.read()
 
             self.content = []
@@ -104,15 +135,12 @@ class Fronend:
 
         def gen_line_chart(key, title, subsampling=1):
             chart = LineChart()
-            datetimes = [
-                datetime.datetime.fromtimestamp(d[0]) for d in stats[key[0]][key[1]]
-            ]
+            samples = self.load_stat(stats, *key, subsampling=subsampling)
+            datetimes = [datetime.datetime.fromtimestamp(d[0]) for d in samples]
             chart.labels.time = [
                 f"{d.day}.{d.month}.{d.year} {d.hour}:{d.minute}" for d in datetimes
-            ][-5000::subsampling]
-            chart.data.value.data = [p[1] for p in stats[key[0]][key[1]]][
-                -5000::subsampling
             ]
+            chart.data.value.data = [p[1] for p in samples]
             chart.options.title = Options.Title(text=title, fontSize=18)
 
             return chart.get()
@@ -178,7 +206,10 @@ class Fronend:
 
         leaderboard = self.load_leaderboard()
 
-        users = list(leaderboard.keys())
+        users = leaderboard.players
+        results = leaderboard.results
+        played = leaderboard.played()
+        totals = leaderboard.totals()
 
         html = """<h2>Leaderboard</h2>
 <table class="table table-hover leaderboard">
@@ -191,35 +222,15 @@ class Fronend:
         html += "".join([f"<th>{user}</th>\n" for user in users]) + "<th>Total</th>\n"
         html += "</tr>\n<tr>\n</thead>"
 
-        sorting = np.argsort(
-            [
-                -float(leaderboard[user]["total"]["wins"])
-                / (
-                    leaderboard[user]["total"]["losses"]
-                    + leaderboard[user]["total"]["wins"]
-                    + leaderboard[user]["total"]["draws"]
-                )
-                for user in users
-            ]
-        )
-
-        for user1 in np.asarray(users)[sorting]:
-            wins = 0
-            losses = 0
-            draws = 0
-            html += f"<td><strong>{user1}</strong></td>\n"
-            for user2 in users:
-                if user1 == user2 or user2 not in leaderboard[user1]:
+        for i in leaderboard.ranking():
+            html += f"<td><strong>{users[i]}</strong></td>\n"
+            for j in range(len(users)):
+                if i == j or not played[i, j]:
                     html += "<td></td>\n"
                     continue
-                wins += leaderboard[user1][user2]["wins"]
-                losses += leaderboard[user1][user2]["losses"]
-                draws += leaderboard[user1][user2]["draws"]
-                html += (
-                    f'<td>{leaderboard[user1][user2]["wins"]} / '
-                    f'{leaderboard[user1][user2]["losses"]} / '
-                    f'{leaderboard[user1][user2]["draws"]}</td>\n'
-                )
+                wins, losses, draws = results[i, j]
+                html += f"<td>{wins} / {losses} / {draws}</td>\n"
+            wins, losses, draws = totals[i]
             html += f"<td>{wins} / {losses} / {draws}</td>\n"
             html += "</tr>\n"
         html += """</table>
@@ -243,7 +254,7 @@ class Fronend:
 <tr>
 <th>User</th><th>Score</th><th>Uncertainty</th><th>LCB</th></tr></thead>"""
 
-        for (user, score, std, effective_score) in sorted_user_scores:
+        for user, score, std, effective_score in sorted_user_scores:
             html += f'<tr><td><strong>{user.decode("utf-8")}</strong></td>\n'
             html += f"<td>{np.round(score,2)}</td><td>{np.round(std, 2)}</td><td>{np.round(effective_score, 2)}</td></tr>\n"
         html += "</table>\n"
@@ -251,22 +262,64 @@ class Fronend:
         return html
 
     def load_leaderboard(self):
+        if self.state_db is not None:
+            return Leaderboard.from_dict(self.state_db.load_leaderboard())
+
+        if os.path.exists(os.path.join(self.working_dir, LEADERBOARD_FILE)):
+            return Leaderboard.load(os.path.join(self.working_dir, LEADERBOARD_FILE))
+
+        # nested dicts written by older servers
         with open(os.path.join(self.working_dir, "leaderboard.pkl"), "rb") as f:
             leaderboard = pickle.load(f)
 
-        return leaderboard
+        return Leaderboard.from_dict(leaderboard)
 
     def load_ranking(self):
+        if self.state_db is not None:
+            return {
+                username.encode("utf-8"): (mu, sigma)
+                for username, mu, sigma in self.state_db.ranking()
+            }
+
         with open(os.path.join(self.working_dir, "trueskill-ranking.pkl"), "rb") as f:
             ranking = pickle.load(f)
         return ranking
 
     def load_stats(self):
+        # every stat is queried on its own from the state store
+        if self.state_db is not None:
+            return None
+
         with open(os.path.join(self.working_dir, "stats.pkl"), "rb") as f:
             stats = pickle.load(f)
+        # lists of samples written by older servers
+        if isinstance(stats, dict):
+            stats = MultiResolutionStats.from_samples(stats)
 
         return stats
 
+    def load_stat(self, stats, group, key, subsampling=1):
+        """
+        Returns [timestamp, value] samples of a stat over the last stats_span
+        seconds, averaged into stats_resolution buckets by either store
+        """
+        start = time.time() - self.stats_span
+        if self.state_db is not None:
+            samples = self.state_db.stats(
+                group, key, start=start, resolution=self.stats_resolution
+            )
+        elif (group, key) in stats:
+            buckets = stats.query(
+                group, key, start=start, resolution=self.stats_resolution
+            )
+            samples = [
+                list(sample)
+                for sample in zip(buckets["time"].tolist(), buckets["mean"].tolist())
+            ]
+        else:
+            samples = []
+        return samples[::subsampling]
+
     def render(self):
         now = datetime.datetime.now()
 
@@ -290,13 +343,13 @@ class Fronend:
             f.write(final_html)
 
         copyfile(
-            os.path.join(__file__, "assets/style.css"),
+            os.path.join(os.path.dirname(__file__), "assets/style.css"),
             os.path.join(self.output_dir, "style.css"),
         )
 
 
 def main(opts):
-    frontend = Fronend(opts.working_dir, opts.output_dir)
+    frontend = Fronend(opts.working_dir, opts.output_dir, opts.stats_span)
     frontend.render()
 
 
@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.fixture
+def server(tmp_path):
+    """
+    GameServer without envs and without the reactor running, see bench_server
+    """
+    from gym_multiplayer_server.misc.bench_server import close_server, make_server
+
+    server = make_server(str(tmp_path), stall_threshold=0)
+    yield server
+    close_server(server)
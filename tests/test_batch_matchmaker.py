@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("gym")
+
+from gym_multiplayer_server.misc.bench_server import (  # noqa: E402
+    add_avatar,
+    add_client,
+    add_waiting_game,
+    random_rating,
+)
+from gym_multiplayer_server.server.game import GameStates  # noqa: E402
+
+
+@pytest.fixture
+def matchmaker_server(tmp_path):
+    from gym_multiplayer_server.misc.bench_server import close_server, make_server
+
+    server = make_server(str(tmp_path), stall_threshold=0, matchmaking_interval=1.0)
+    yield server
+    close_server(server)
+
+
+def waiting_games(server, num_games, seed=0):
+    rng = np.random.default_rng(seed)
+    games = []
+    for i in range(num_games):
+        client = add_client(server, add_avatar(server, f"user{i}", random_rating(rng)))
+        add_waiting_game(server, client)
+        games.append(client.game)
+    return games
+
+
+def test_pairs_are_disjoint(matchmaker_server):
+    games = waiting_games(matchmaker_server, 200)
+
+    pairs = matchmaker_server.batch_matchmaker._pair(games, time.time())
+
+    matched = [game for i, j, _ in pairs for game in (i, j)]
+    assert len(pairs) == 100
+    assert len(matched) == len(set(matched))
+
+
+def test_apply_skips_games_closed_while_pairing(matchmaker_server):
+    matchmaker = matchmaker_server.batch_matchmaker
+    games = waiting_games(matchmaker_server, 4)
+    now = time.time()
+    pairs = matchmaker._pair(games, now)
+    (i, j, _), (k, m, _) = pairs
+
+    # the pairing runs in a thread, the player left in the meantime
+    games[i].abort("Stop queuing")
+    for _ in matchmaker._start_games(pairs, games, now):
+        pass
+
+    assert games[j].state == GameStates.WAITING_FOR_PLAYER
+    assert matchmaker.num_matches == 1
+    host = games[k] if not games[k].closed else games[m]
+    assert host.state == GameStates.GAME_RUNNING
@@ -0,0 +1,100 @@
+import pytest
+
+pytest.importorskip("gym")
+
+from twisted.cred import checkers, portal  # noqa: E402
+from twisted.internet.testing import StringTransport  # noqa: E402
+
+from gym_multiplayer_server.common.binary_protocol import (  # noqa: E402
+    FRAME_PREFIX,
+    Op,
+    decode_message,
+    encode_message,
+    frame,
+    login_response,
+    pack_json,
+)
+from gym_multiplayer_server.server.binary_transport import (  # noqa: E402
+    BinaryServerFactory,
+)
+from gym_multiplayer_server.server.server import GameServerRealm  # noqa: E402
+
+
+class TCPTransport(StringTransport):
+    def setTcpNoDelay(self, enabled):
+        self.nodelay = enabled
+
+
+@pytest.fixture
+def connection(server):
+    realm = GameServerRealm()
+    realm.server = server
+    checker = checkers.InMemoryUsernamePasswordDatabaseDontUse(alice=b"secret")
+    factory = BinaryServerFactory(portal.Portal(realm, [checker]), server.__VERSION__)
+    protocol = factory.buildProtocol(None)
+    transport = TCPTransport()
+    protocol.makeConnection(transport)
+    yield protocol, transport
+    protocol.connectionLost()
+
+
+def send(protocol, op, payload=b""):
+    protocol.dataReceived(frame(encode_message(op, payload)))
+
+
+def received(transport):
+    data = transport.value()
+    transport.clear()
+    messages = []
+    while data:
+        (length,) = FRAME_PREFIX.unpack_from(data)
+        end = FRAME_PREFIX.size + length
+        messages.append(decode_message(data[FRAME_PREFIX.size : end]))
+        data = data[end:]
+    return messages
+
+
+def login(protocol, transport, password):
+    send(
+        protocol,
+        Op.LOGIN,
+        pack_json({"username": "alice", "client_version": protocol.server_version}),
+    )
+    [(op, challenge)] = received(transport)
+    assert op == Op.LOGIN_CHALLENGE
+    send(protocol, Op.LOGIN_RESPONSE, login_response(challenge, password))
+    return challenge, received(transport)
+
+
+def test_login_sends_no_password(connection):
+    protocol, transport = connection
+    send(
+        protocol,
+        Op.LOGIN,
+        pack_json({"username": "alice", "client_version": protocol.server_version}),
+    )
+    assert b"secret" not in transport.value()
+
+    [(op, challenge)] = received(transport)
+    send(protocol, Op.LOGIN_RESPONSE, login_response(challenge, "secret"))
+    [(op, _)] = received(transport)
+    assert op == Op.LOGIN_OK
+    assert protocol.client is not None
+
+
+def test_login_with_wrong_password(connection):
+    protocol, transport = connection
+    _, [(op, _)] = login(protocol, transport, "wrong")
+    assert op == Op.LOGIN_FAILED
+    assert protocol.client is None
+
+
+def test_challenge_is_answered_once(connection):
+    protocol, transport = connection
+    challenge, _ = login(protocol, transport, "wrong")
+
+    # replaying a response to an old challenge fails
+    send(protocol, Op.LOGIN_RESPONSE, login_response(challenge, "secret"))
+    [(op, _)] = received(transport)
+    assert op == Op.ERROR
+    assert protocol.client is None
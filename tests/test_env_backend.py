@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("gym")
+
+from gym_multiplayer_server.server.env_backend import (  # noqa: E402
+    EnvPool,
+    EnvWorkerError,
+    EnvWorkerPool,
+)
+
+
+@pytest.fixture
+def worker_pool():
+    pool = EnvWorkerPool(2, EnvPool(max_size=0))
+    yield pool
+    pool.shutdown()
+
+
+def kill(worker):
+    worker.process.kill()
+    worker.process.join()
+    # the reactor is not running, read the end of the pipe by hand
+    worker.doRead()
+
+
+def test_dead_worker_gets_no_games(worker_pool):
+    dead, alive = worker_pool.workers
+    kill(dead)
+
+    assert dead.dead
+    for i in range(4):
+        worker_pool.make(f"game{i}")
+        assert worker_pool.assignment[f"game{i}"] is alive
+    assert dead.num_games == 0
+
+
+def test_make_fails_without_workers(worker_pool):
+    for worker in worker_pool.workers:
+        kill(worker)
+
+    failures = []
+    worker_pool.make("game").addErrback(failures.append)
+
+    assert failures[0].check(EnvWorkerError)
+    assert "game" not in worker_pool.assignment
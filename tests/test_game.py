@@ -0,0 +1,84 @@
+import pytest
+
+pytest.importorskip("gym")
+
+from twisted.spread import pb  # noqa: E402
+from trueskill import Rating  # noqa: E402
+
+from gym_multiplayer_server.misc.bench_server import (  # noqa: E402
+    StubBroker,
+    add_avatar,
+    add_client,
+)
+from gym_multiplayer_server.server.game import GameStates  # noqa: E402
+from gym_multiplayer_server.server.player import ClientState  # noqa: E402
+
+
+class DeadBroker(StubBroker):
+    disconnected = True
+
+
+class DeadMind:
+    def __init__(self):
+        self.broker = DeadBroker()
+
+    def callRemote(self, name, **kwargs):
+        raise pb.DeadReferenceError("Calling Stale Broker")
+
+
+def start_game(server):
+    one = add_client(server, add_avatar(server, "one", Rating()))
+    two = add_client(server, add_avatar(server, "two", Rating()))
+    one.remote_start_queuing()
+    two.remote_start_queuing()
+    assert one.game is two.game
+    assert one.game.state == GameStates.GAME_RUNNING
+    return one, two
+
+
+def test_abort_resets_clients(server):
+    one, two = start_game(server)
+    game = one.game
+
+    game.abort("aborted")
+
+    assert game.state == GameStates.ABORTED
+    for client in (one, two):
+        assert client.game is None
+        assert client.state == ClientState.IDLE
+    assert not server.client_to_game_mapping
+    assert not server.game_to_client_mapping
+    assert len(server.game_registry) == 0
+
+
+def test_abort_is_idempotent(server):
+    one, _ = start_game(server)
+    game = one.game
+
+    game.abort("aborted")
+    game.abort("aborted again")
+    game._close()
+    # the game is already gone when the client acts or stops queueing
+    one.remote_receive_action([0.0] * 4)
+    one.remote_stop_queueing()
+
+    assert server.metrics.games_aborted.value == 1
+    assert one.state == ClientState.IDLE
+
+
+def test_abort_with_dead_opponent(server):
+    one, two = start_game(server)
+    game = one.game
+    two.mind = DeadMind()
+
+    game.abort("aborted")
+
+    assert game.closed
+    assert one.game is None and one.state == ClientState.IDLE
+    # the opponent is detached by the failed notification
+    assert two.state == ClientState.DETACHED
+    assert two.avatar.clients == []
+    assert two.avatar not in server.active_avatars
+    assert one.avatar in server.active_avatars
+    assert not server.client_to_game_mapping
+    assert server.metrics.games_aborted.value == 1
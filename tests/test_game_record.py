@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+
+from gym_multiplayer_server.common.game_record import (
+    SEGMENTS_FILE,
+    append_game_record_chunk,
+    find_unsealed_game_records,
+    is_game_record,
+    load_game_record,
+    open_records_index,
+    seal_game_record,
+    seal_unsealed_game_record,
+)
+
+
+def chunk(num_transitions, start=0):
+    return dict(
+        ob=np.arange(start, start + num_transitions * 2, dtype=np.float32).reshape(
+            -1, 2
+        ),
+        done=np.zeros(num_transitions, dtype=np.int8),
+    )
+
+
+def test_seal_joins_the_chunks(tmp_path):
+    path = os.path.join(str(tmp_path), "game")
+    fields = append_game_record_chunk(path, chunk(3), identifier="game")
+    append_game_record_chunk(path, chunk(2, start=6))
+    seal_game_record(path, fields, 5, identifier="game")
+
+    record = load_game_record(path)
+    assert len(record) == 5
+    assert record.identifier == "game"
+    assert "missing_transitions" not in record.meta
+    np.testing.assert_array_equal(record["ob"], chunk(5)["ob"])
+    assert sorted(os.listdir(path)) == ["done.npy", "meta.json", "ob.npy"]
+
+
+def test_seal_counts_missing_transitions(tmp_path):
+    path = os.path.join(str(tmp_path), "game")
+    fields = append_game_record_chunk(path, chunk(3))
+    # the writer failed on the second chunk
+    seal_game_record(path, fields, 5)
+
+    record = load_game_record(path)
+    assert len(record) == 3
+    assert record.meta["missing_transitions"] == 2
+
+
+def test_recovery_after_a_crash(tmp_path):
+    path = os.path.join(str(tmp_path), "game")
+    append_game_record_chunk(path, chunk(3), identifier="game", player_one="one")
+    # the server died while writing the second chunk
+    with open(os.path.join(path, "ob.seg"), "ab") as f:
+        f.write(b"\0" * 5)
+
+    seal_unsealed_game_record(path)
+
+    record = load_game_record(path)
+    assert len(record) == 3
+    assert record.meta["aborted"]
+    assert record.player_one == "one"
+    assert "timestamp" in record.meta
+    np.testing.assert_array_equal(record["ob"], chunk(3)["ob"])
+    assert not os.path.exists(os.path.join(path, SEGMENTS_FILE))
+
+
+def test_recovery_of_a_sealed_record(tmp_path):
+    path = os.path.join(str(tmp_path), "game")
+    fields = append_game_record_chunk(path, chunk(3))
+    seal_game_record(path, fields, 3)
+    # the server died before the segments were removed
+    append_game_record_chunk(path, chunk(1))
+
+    seal_unsealed_game_record(path)
+
+    assert len(load_game_record(path)) == 3
+    assert sorted(os.listdir(path)) == ["done.npy", "meta.json", "ob.npy"]
+
+
+def test_open_records_are_indexed(tmp_path):
+    games_path = str(tmp_path)
+    index_path = open_records_index(games_path)
+    running = os.path.join(games_path, "2026", "1", "2", "running")
+    finished = os.path.join(games_path, "2026", "1", "2", "finished")
+
+    append_game_record_chunk(running, chunk(3), index_path=index_path)
+    fields = append_game_record_chunk(finished, chunk(3), index_path=index_path)
+    seal_game_record(finished, fields, 3, index_path=index_path)
+
+    assert find_unsealed_game_records(games_path) == [running]
+    assert os.listdir(index_path) == ["running"]
+
+
+def test_only_the_index_is_read(tmp_path):
+    games_path = str(tmp_path)
+    os.makedirs(open_records_index(games_path))
+    unindexed = os.path.join(games_path, "2020", "1", "2", "unindexed")
+    append_game_record_chunk(unindexed, chunk(3))
+
+    assert find_unsealed_game_records(games_path) == []
+    assert find_unsealed_game_records(games_path, scan=True) == [unindexed]
+
+
+def test_records_from_before_the_index_are_found(tmp_path):
+    games_path = str(tmp_path)
+    path = os.path.join(games_path, "2020", "1", "2", "old")
+    append_game_record_chunk(path, chunk(3))
+
+    assert find_unsealed_game_records(games_path) == [path]
+
+
+def test_stale_markers_are_removed(tmp_path):
+    games_path = str(tmp_path)
+    index_path = open_records_index(games_path)
+    path = os.path.join(games_path, "2026", "1", "2", "crashed")
+    append_game_record_chunk(path, chunk(3), index_path=index_path)
+
+    seal_unsealed_game_record(path, index_path=index_path)
+    assert is_game_record(path)
+    assert os.listdir(index_path) == []
+
+    # sealed by a writer that did not know the index
+    append_game_record_chunk(path + "2", chunk(3), index_path=index_path)
+    seal_unsealed_game_record(path + "2")
+    assert find_unsealed_game_records(games_path) == []
+    assert os.listdir(index_path) == []
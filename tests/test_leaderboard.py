@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+
+from gym_multiplayer_server.common.leaderboard import Leaderboard
+
+
+def played_leaderboard():
+    leaderboard = Leaderboard(capacity=2)
+    for player_one, player_two, winner in [
+        ("alice", "bob", 1),
+        ("alice", "bob", 0),
+        ("bob", "carol", -1),
+        ("carol", "dave", 1),
+    ]:
+        leaderboard.record(player_one, player_two, winner)
+    return leaderboard
+
+
+def test_dumps_loads_round_trip():
+    leaderboard = played_leaderboard()
+    loaded = Leaderboard.loads(leaderboard.dumps())
+
+    assert loaded.players == leaderboard.players
+    assert loaded.to_dict() == leaderboard.to_dict()
+    np.testing.assert_array_equal(loaded.totals(), leaderboard.totals())
+    assert loaded.result("alice", "bob") == (1, 0, 1)
+    assert loaded.result("carol", "bob") == (1, 0, 0)
+
+    # still growable after loading
+    loaded.record("eve", "alice", 1)
+    assert loaded.result("alice", "eve") == (0, 1, 0)
+
+
+def test_loads_legacy_dense_results():
+    leaderboard = played_leaderboard()
+    f = io.BytesIO()
+    np.savez(
+        f,
+        players=np.array(leaderboard.players, dtype=str),
+        results=leaderboard.results,
+    )
+
+    loaded = Leaderboard.loads(f.getvalue())
+
+    assert loaded.to_dict() == leaderboard.to_dict()
+    assert len(loaded.rows) == len(leaderboard.rows)
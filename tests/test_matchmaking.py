@@ -0,0 +1,65 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("trueskill")
+
+from trueskill import Rating  # noqa: E402
+
+from gym_multiplayer_server.server.matchmaking import MatchmakingIndex  # noqa: E402
+
+
+class Avatar:
+    def __init__(self, username, mu=25.0):
+        self.username = username
+        self.rating = Rating(mu=mu)
+
+
+class WaitingGame:
+    def __init__(self, username, mu=25.0, waiting_since=None):
+        avatar = Avatar(username, mu)
+        self.clients = (SimpleNamespace(avatar=avatar), None)
+        self.last_op_timestamp = (
+            waiting_since if waiting_since is not None else time.time()
+        )
+
+
+def test_candidates_capped_with_same_rating():
+    index = MatchmakingIndex(max_candidates=64)
+    now = time.time()
+    for i in range(5000):
+        index.add(WaitingGame(f"user{i}", waiting_since=now))
+    joining = Avatar("joining")
+
+    candidates = index.candidates(joining, now)
+
+    assert len(candidates) == 64
+    assert index.choose(joining, now) is not None
+
+
+def test_candidates_include_long_waiting_games():
+    index = MatchmakingIndex(max_candidates=8)
+    now = time.time()
+    old = [
+        WaitingGame(f"old{i}", mu=-100.0, waiting_since=now - 3600) for i in range(4)
+    ]
+    for game in old:
+        index.add(game)
+    for i in range(100):
+        index.add(WaitingGame(f"user{i}", waiting_since=now))
+
+    candidates = index.candidates(Avatar("joining"), now)
+
+    assert len(candidates) == 12
+    assert all(game in candidates for game in old)
+
+
+def test_all_eligible_games_in_small_pools():
+    index = MatchmakingIndex(max_candidates=8)
+    games = [WaitingGame(f"user{i}", mu=i * 10.0) for i in range(6)]
+    for game in games:
+        index.add(game)
+    avatar = games[0].clients[0].avatar
+
+    assert index.candidates(avatar) == games[1:]
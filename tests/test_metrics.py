@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("gym")
+
+from gym_multiplayer_server.misc.bench_server import (  # noqa: E402
+    add_avatar,
+    add_client,
+    random_rating,
+)
+
+
+def test_client_rtt_has_bounded_labels(server):
+    rng = np.random.default_rng(0)
+    for i in range(100):
+        client = add_client(server, add_avatar(server, f"user{i}", random_rating(rng)))
+        client.rtt = (i + 1) / 1000
+
+    lines = [
+        line
+        for line in server.metrics.expose().splitlines()
+        if line.startswith("gym_client_mean_rtt_seconds")
+    ]
+    assert lines == [
+        'gym_client_mean_rtt_seconds{quantile="0.5"} 0.051',
+        'gym_client_mean_rtt_seconds{quantile="0.9"} 0.091',
+        'gym_client_mean_rtt_seconds{quantile="0.99"} 0.1',
+        'gym_client_mean_rtt_seconds{quantile="1.0"} 0.1',
+    ]
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("gym")
+
+from trueskill import Rating  # noqa: E402
+
+from gym_multiplayer_server.common.error import (  # noqa: E402
+    ServerClientVersionMissmatchError,
+)
+from gym_multiplayer_server.common.wire import WireFormat  # noqa: E402
+from gym_multiplayer_server.misc.bench_server import (  # noqa: E402
+    add_avatar,
+    add_client,
+)
+
+
+@pytest.fixture
+def client(server):
+    return add_client(server, add_avatar(server, "one", Rating()))
+
+
+def test_old_client_gets_lists(server, client):
+    # old clients only send their version and expect True
+    assert client.avatar.perspective_check_server_client_compatibility(
+        server.__VERSION__
+    )
+    assert client.wire_format == WireFormat.LIST
+
+
+def test_new_client_negotiates_binary(server, client):
+    wire_format = client.avatar.perspective_check_server_client_compatibility(
+        server.__VERSION__,
+        wire_formats=[WireFormat.BINARY, WireFormat.LIST],
+        mind=client.mind,
+    )
+    assert wire_format == WireFormat.BINARY
+    assert client.wire_format == WireFormat.BINARY
+
+
+def test_version_mismatch(server, client):
+    with pytest.raises(ServerClientVersionMissmatchError):
+        client.avatar.perspective_check_server_client_compatibility("0.0.0")
@@ -0,0 +1,26 @@
+import os
+import threading
+
+import numpy as np
+
+from gym_multiplayer_server.common.game_record import load_game_record
+from gym_multiplayer_server.server.record_writer import RecordWriter
+
+
+def test_overflowed_jobs_are_written(tmp_path, monkeypatch):
+    writer = RecordWriter(max_queue_size=2)
+    # the disk stalls until released
+    release = threading.Event()
+    write = writer._write
+    monkeypatch.setattr(writer, "_write", lambda *job: release.wait() and write(*job))
+
+    path = os.path.join(str(tmp_path), "game")
+    for i in range(5):
+        writer.submit_chunk(path, dict(done=np.full(2, i, dtype=np.int8)))
+    writer.submit_seal(path, dict(done=dict(dtype="|i1", shape=[])), 10)
+    assert writer.num_overflowed > 0
+
+    release.set()
+    writer.close()
+    assert writer.num_written == 6
+    assert load_game_record(path)["done"].tolist() == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4]
@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+
+from gym_multiplayer_server.common.state_db import StateDB
+from gym_multiplayer_server.common.timeseries import MultiResolutionStats
+
+
+def test_stats_buckets_match_the_timeseries(tmp_path):
+    # samples of the maintenance loop, every 10 s
+    samples = [(1_000_000 + 10 * i, float(i % 7)) for i in range(200)]
+
+    db = StateDB(os.path.join(str(tmp_path), "state.sqlite"))
+    db.write(stats=[("games", "running", t, value) for t, value in samples])
+    stats = MultiResolutionStats()
+    for t, value in samples:
+        stats.add("games", "running", t, value)
+
+    start = samples[50][0] + 5
+    buckets = stats.query("games", "running", start=start, resolution=60)
+    rows = db.stats("games", "running", start=start, resolution=60)
+    db.close()
+
+    assert [row[0] for row in rows] == buckets["time"].tolist()
+    np.testing.assert_allclose([row[1] for row in rows], buckets["mean"])
@@ -0,0 +1,12 @@
+from gym_multiplayer_server.common.timeseries import resolution_for_span
+
+
+def test_resolution_follows_the_span():
+    # one hour fits the 10 s level, a day the 1 min level, a week only 1 h
+    assert resolution_for_span(3600, 1000) == 10
+    assert resolution_for_span(24 * 3600, 1440) == 60
+    assert resolution_for_span(7 * 24 * 3600, 1000) == 3600
+    # too many 1 min buckets for the chart
+    assert resolution_for_span(24 * 3600, 500) == 3600
+    # beyond the history of every level
+    assert resolution_for_span(365 * 24 * 3600, 1000) == 3600
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from twisted.internet import defer
+
+from gym_multiplayer_server.client.backend.network_interface import NetworkInterface
+from gym_multiplayer_server.common.wire import (
+    WireFormat,
+    negotiate_wire_format,
+    pack_step,
+    unpack_step,
+)
+
+
+def test_step_round_trip():
+    ob = np.linspace(-1, 1, 18, dtype=np.float32)
+    info = {"winner": -1, "reward_touch_puck": 0.5, "not_transferred": 3}
+
+    ob_, r, done, info_ = unpack_step(pack_step(ob, 1.5, True, info))
+
+    np.testing.assert_array_equal(ob_, ob)
+    assert (r, done) == (1.5, True)
+    assert info_ == {"winner": -1, "reward_touch_puck": 0.5}
+    assert isinstance(info_["winner"], int)
+
+
+def test_step_round_trip_without_reward():
+    ob = np.zeros(18, dtype=np.float32)
+    ob_, r, done, info = unpack_step(pack_step(ob, None, None, None))
+
+    np.testing.assert_array_equal(ob_, ob)
+    assert (r, done, info) == (None, None, None)
+
+
+@pytest.mark.parametrize(
+    "client_formats, wire_format",
+    [
+        (None, WireFormat.LIST),
+        ([WireFormat.LIST], WireFormat.LIST),
+        ([WireFormat.LIST, WireFormat.BINARY], WireFormat.BINARY),
+        (["unknown"], WireFormat.LIST),
+    ],
+)
+def test_negotiation(client_formats, wire_format):
+    assert negotiate_wire_format(client_formats) == wire_format
+
+
+class OldServerAvatar:
+    """
+    Remote avatar of a server without wire format negotiation
+    """
+
+    def callRemote(self, name, client_version, **kwargs):
+        if kwargs:
+            return defer.fail(TypeError("unexpected keyword argument"))
+        return defer.succeed(True)
+
+
+def test_new_client_against_old_server():
+    # nothing of the constructor but the attributes, it connects right away
+    network_interface = NetworkInterface.__new__(NetworkInterface)
+    network_interface.client = type("Client", (), {"__VERSION__": "1"})
+    network_interface.wire_formats = [WireFormat.BINARY, WireFormat.LIST]
+    network_interface.remote_avatar = OldServerAvatar()
+    network_interface.wire_format = None
+
+    results = []
+    network_interface.check_server_client_compatibility().addBoth(results.append)
+
+    assert results == [None]
+    assert network_interface.wire_format == WireFormat.LIST